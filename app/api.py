@@ -1,14 +1,20 @@
 """
 FastAPI 路由定义
 """
-from fastapi import FastAPI, Request, WebSocket
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Union
 import os
 import json
+import threading
 from app.process_manager import ProcessManager
+from app.worker_pool import WorkerPool
+from app.result_hub import ResultHub
+from app.journal import EventJournal
+from app.metrics import render_prometheus
+from app.static_assets import StaticAssets
 import logging
 import asyncio
 
@@ -17,12 +23,31 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Telegram Group Monitor")
 
-# 全局进程管理器
-process_manager: Optional[ProcessManager] = None
+# 全局进程管理器（单进程模式为 ProcessManager，进程池模式为 WorkerPool）
+process_manager: Optional[Union[ProcessManager, WorkerPool]] = None
+# 后台启动（线程池中）和 POST /api/config 都会替换 process_manager，读取和替换都在锁内进行
+process_manager_lock = threading.Lock()
+
+# 结果广播中心（所有 WebSocket 连接共享）
+result_hub = ResultHub()
 
 # API 配置存储文件
 CONFIG_FILE = "api_config.json"
 
+# 匹配记录和发送记录的持久化日志
+JOURNAL_FILE = "event_journal.db"
+event_journal = EventJournal(JOURNAL_FILE)
+
+# 控制台页面：启动时读入内存并预压缩；DASHBOARD_RELOAD=1 时文件修改后自动重新加载（开发用）
+dashboard_assets = StaticAssets(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'), ['index.html'])
+DASHBOARD_RELOAD = os.environ.get('DASHBOARD_RELOAD') == '1'
+
+# 工作进程（账号）数量，大于 1 时启用进程池模式
+WORKER_POOL_SIZE = int(os.environ.get('WORKER_POOL_SIZE', '1'))
+
+# 工作进程到主进程的结果通道: queue（multiprocessing.Queue）或 shm（共享内存环形缓冲区）
+RESULT_TRANSPORT = os.environ.get('RESULT_TRANSPORT', 'queue')
+
 
 # Pydantic 模型
 class APIConfigRequest(BaseModel):
@@ -34,18 +59,89 @@ class LoginRequest(BaseModel):
     phone: str
     password: Optional[str] = None
     second_password: Optional[str] = None
+    shard: int = 0
 
 
 class VerifyRequest(BaseModel):
     code: str
     second_password: Optional[str] = None
+    shard: int = 0
 
 
-class StartMonitorRequest(BaseModel):
+class MonitorRule(BaseModel):
     target_group_id: int
-    keywords: List[str]
+    # 任一关键字命中即可；与 expression 同时配置时两者都需满足
+    keywords: List[str] = []
+    # 布尔表达式，如 "(招聘 | 求职) & !广告"、"/\\d{11}/"
+    expression: Optional[str] = None
     messages: List[str]
     interval: int = 1
+    rule_id: Optional[str] = None
+    # 发送优先级，数字越小越先发送
+    priority: int = 10
+    # 合并窗口：窗口内的多次匹配只回复一次（秒）
+    coalesce: float = 0
+    # 冷却时间：回复后这段时间内不再触发（秒）
+    cooldown: float = 0
+
+
+class TriggerWindow(BaseModel):
+    coalesce: float = 0
+    cooldown: float = 0
+
+
+class SendLimits(BaseModel):
+    # 每秒发送数和突发上限都必须大于 0
+    global_rate: Optional[float] = Field(None, gt=0)
+    global_burst: Optional[int] = Field(None, gt=0)
+    chat_rate: Optional[float] = Field(None, gt=0)
+    chat_burst: Optional[int] = Field(None, gt=0)
+
+
+class MatchPipelineOptions(BaseModel):
+    # thread: 线程池；process: 进程池
+    mode: str = 'thread'
+    batch_size: Optional[int] = None
+    max_delay_ms: Optional[float] = None
+    workers: Optional[int] = None
+
+
+class CatchUpOptions(BaseModel):
+    # 重连或重启后是否补拉断线期间的消息
+    enabled: bool = True
+    # 只补拉最近多少秒内的消息
+    max_age: Optional[float] = None
+    # 每个群聊最多补拉的条数
+    max_messages: Optional[int] = None
+    # 群聊之间、每批历史消息请求之间的间隔（秒）
+    interval: Optional[float] = None
+
+
+class StartMonitorRequest(BaseModel):
+    # 旧格式：单个群聊一组规则
+    target_group_id: Optional[int] = None
+    keywords: List[str] = []
+    messages: List[str] = []
+    interval: int = 1
+    # 新格式：多个群聊，每个群聊可以有多条规则
+    rules: List[MonitorRule] = []
+    # 发送限速（全局和单个群聊的令牌桶）
+    send_limits: Optional[SendLimits] = None
+    # 群聊级别的合并窗口和冷却时间: 群聊 ID -> 窗口
+    chat_windows: Dict[int, TriggerWindow] = {}
+    # 匹配前规范化文本（全角/半角、大小写、繁简）
+    normalize: bool = True
+    # 在线程池/进程池中批量匹配，不配置时在事件循环中直接匹配
+    match_pipeline: Optional[MatchPipelineOptions] = None
+    # 补拉断线期间消息的限制，不配置时使用默认限制
+    catch_up: Optional[CatchUpOptions] = None
+
+
+class UpdateRulesRequest(BaseModel):
+    # 新增或替换的规则（按 rule_id 替换，未指定 rule_id 时新增）
+    upsert: List[MonitorRule] = []
+    # 要删除的规则 ID
+    remove: List[str] = []
 
 
 def load_config():
@@ -66,37 +162,77 @@ def save_config(api_id: str, api_hash: str):
         json.dump(config, f)
 
 
+def create_process_manager(api_id: int, api_hash: str):
+    """根据 WORKER_POOL_SIZE 创建单进程管理器或进程池"""
+    if WORKER_POOL_SIZE > 1:
+        manager = WorkerPool(api_id, api_hash, WORKER_POOL_SIZE, result_transport=RESULT_TRANSPORT)
+    else:
+        manager = ProcessManager(api_id, api_hash, result_transport=RESULT_TRANSPORT)
+    manager.add_result_listener(result_hub.publish_threadsafe)
+    manager.add_result_listener(event_journal.record)
+    return manager
+
+
 def init_process_manager():
-    """初始化进程管理器"""
+    """初始化进程管理器，返回启动的管理器；已经有管理器（用户先提交了配置）时不再启动"""
     global process_manager
     
+    with process_manager_lock:
+        if process_manager is not None:
+            return None
+    
     config = load_config()
     if not config:
-        return False
+        return None
     
     try:
-        process_manager = ProcessManager(int(config['api_id']), config['api_hash'])
-        process_manager.start()
-        logger.info("进程管理器已启动")
-        return True
+        manager = create_process_manager(int(config['api_id']), config['api_hash'])
+        manager.start()
     except Exception as e:
         logger.error(f"初始化进程管理器失败: {e}")
-        return False
+        return None
+    
+    # 启动期间 POST /api/config 可能已经设置了新的管理器，以它为准
+    with process_manager_lock:
+        superseded = process_manager is not None
+        if not superseded:
+            process_manager = manager
+    if superseded:
+        manager.stop()
+        logger.info("已使用新提交的配置，停止后台启动的进程管理器")
+        return None
+    logger.info("进程管理器已启动")
+    return manager
+
+
+async def connect_in_background(manager):
+    """后台连接 Telegram，连接后的登录状态由工作进程推送，不阻塞调用方"""
+    response = await manager.request({'type': 'connect'}, timeout=30.0, response_type='connect_response')
+    if response and response.get('is_authorized'):
+        logger.info("检测到已登录状态")
+    elif not response or not response.get('success'):
+        logger.warning(f"连接 Telegram 失败: {(response or {}).get('error', '超时')}")
+
+
+async def start_worker_in_background():
+    """在后台启动工作进程并连接，就绪状态通过 /api/health 查询"""
+    manager = await asyncio.get_running_loop().run_in_executor(None, init_process_manager)
+    if manager is not None:
+        await connect_in_background(manager)
+    elif not load_config():
+        logger.info("等待用户配置 API 凭证")
 
 
 @app.on_event("startup")
 async def startup_event():
-    """启动时尝试加载配置"""
-    if init_process_manager():
-        # 尝试连接检查登录状态
-        if process_manager:
-            process_manager.send_command({'type': 'connect'})
-            response = process_manager.get_response(timeout=3.0)
-            if response and response.get('is_authorized'):
-                logger.info("检测到已登录状态")
-        logger.info("系统已就绪")
-    else:
-        logger.info("等待用户配置 API 凭证")
+    """启动时尝试加载配置（工作进程在后台启动，HTTP 服务不等待）"""
+    result_hub.bind_loop(asyncio.get_running_loop())
+    event_journal.start()
+    dashboard_assets.load()
+    if DASHBOARD_RELOAD:
+        asyncio.create_task(dashboard_assets.watch())
+    asyncio.create_task(start_worker_in_background())
+    logger.info("HTTP 服务已就绪")
 
 
 @app.on_event("shutdown")
@@ -106,51 +242,70 @@ async def shutdown_event():
     if process_manager:
         process_manager.stop()
         logger.info("进程管理器已停止")
+    
+    event_journal.close()
 
 
 @app.get("/", response_class=HTMLResponse)
-async def index():
-    """返回首页"""
-    with open("app/templates/index.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(content=f.read())
+async def index(request: Request):
+    """返回首页（内存中的预压缩页面，未变化时返回 304）"""
+    return dashboard_assets.response('index.html', request)
 
 
 @app.get("/api/config")
 async def get_config():
-    """获取 API 配置状态"""
+    """获取 API 配置状态（登录状态来自工作进程推送的缓存，不经过进程间通信）"""
     config = load_config()
     
-    # 检查登录状态
-    is_logged_in = False
-    if config and process_manager:
-        try:
-            process_manager.send_command({'type': 'connect'})
-            response = process_manager.get_response(timeout=2.0)
-            if response and response.get('is_authorized'):
-                is_logged_in = True
-        except:
-            pass
+    state = process_manager.worker_state if config and process_manager and process_manager.is_running else None
+    is_logged_in = bool(state and state['authorized'])
+    # 工作进程已启动但还没有推送状态（正在连接），前端稍后再查询
+    connecting = bool(config and process_manager and process_manager.is_running and state is None)
     
     if config:
         return JSONResponse({
             "configured": True,
             "is_logged_in": is_logged_in,
-            "message": "API 已配置" + ("，已登录" if is_logged_in else "，未登录")
+            "connecting": connecting,
+            "message": "API 已配置" + ("，正在连接" if connecting else "，已登录" if is_logged_in else "，未登录")
         })
     else:
         return JSONResponse({
             "configured": False,
             "is_logged_in": False,
+            "connecting": False,
             "message": "请先配置 API 凭证"
         })
 
 
+@app.get("/api/health")
+async def health():
+    """服务和工作进程的就绪状态（只读主进程内的状态，不经过进程间通信）
+
+    worker 为 unconfigured（未配置 API 凭证）、starting、ready 或 stopped。
+    """
+    if process_manager is None:
+        worker = 'starting' if load_config() else 'unconfigured'
+    elif not process_manager.is_running:
+        worker = 'stopped'
+    else:
+        worker = 'ready' if process_manager.worker_ready else 'starting'
+    
+    state = process_manager.worker_state if process_manager else None
+    return JSONResponse({
+        "server": "ready",
+        "worker": worker,
+        "worker_startup_seconds": process_manager.worker_startup_seconds if process_manager else None,
+        "authorized": state['authorized'] if state else None
+    })
+
+
 @app.post("/api/config")
 async def set_config(request: APIConfigRequest):
     """设置 API 配置"""
     try:
         # 验证 API 凭证
-        test_manager = ProcessManager(int(request.api_id), request.api_hash)
+        test_manager = create_process_manager(int(request.api_id), request.api_hash)
         test_manager.start()
         
         # 如果测试成功，保存配置
@@ -158,10 +313,12 @@ async def set_config(request: APIConfigRequest):
         
         # 重新初始化全局进程管理器
         global process_manager
-        if process_manager:
-            process_manager.stop()
+        with process_manager_lock:
+            old_manager, process_manager = process_manager, test_manager
+        if old_manager:
+            old_manager.stop()
         
-        process_manager = test_manager
+        asyncio.create_task(connect_in_background(test_manager))
         logger.info("API 配置已保存")
         
         return JSONResponse({
@@ -183,8 +340,9 @@ async def connect():
     if not process_manager:
         return JSONResponse({"success": False, "error": "进程管理器未初始化"})
     
-    process_manager.send_command({'type': 'connect'})
-    response = process_manager.get_response(timeout=3.0)
+    response = await process_manager.request(
+        {'type': 'connect'}, timeout=3.0, response_type='connect_response'
+    )
     
     if response:
         return JSONResponse(response)
@@ -198,11 +356,11 @@ async def send_code(request: LoginRequest):
     if not process_manager:
         return JSONResponse({"success": False, "error": "进程管理器未初始化"})
     
-    process_manager.send_command({
+    response = await process_manager.request({
         'type': 'send_code',
-        'phone': request.phone
-    })
-    response = process_manager.get_response(timeout=30.0, filter_type='code_sent')
+        'phone': request.phone,
+        'shard': request.shard
+    }, timeout=30.0, response_type='code_sent')
     
     if response:
         return JSONResponse(response)
@@ -219,15 +377,15 @@ async def verify(request: VerifyRequest):
     # 发送验证命令
     command = {
         'type': 'verify_code',
-        'code': request.code
+        'code': request.code,
+        'shard': request.shard
     }
     
     # 如果有二次密码，添加到命令中
     if request.second_password and request.second_password.strip():
         command['password'] = request.second_password
     
-    process_manager.send_command(command)
-    response = process_manager.get_response(timeout=10.0, filter_type='verify_response')
+    response = await process_manager.request(command, timeout=10.0, response_type='verify_response')
     
     if response:
         return JSONResponse(response)
@@ -236,34 +394,112 @@ async def verify(request: VerifyRequest):
 
 
 @app.get("/api/dialogs")
-async def get_dialogs():
-    """获取群聊列表"""
+async def get_dialogs(request: Request, offset: int = 0, limit: Optional[int] = None,
+                      refresh: bool = False, stream: bool = False):
+    """获取群聊列表
+    
+    Args:
+        offset/limit: 分页（不传 limit 返回全部）
+        refresh: 强制工作进程重新加载群聊列表
+        stream: 以 NDJSON 流式返回，每行一个群聊
+    
+    群聊列表未变化时，带 If-None-Match 的请求返回 304。
+    """
     if not process_manager:
         return JSONResponse({"success": False, "error": "进程管理器未初始化"})
     
-    process_manager.send_command({'type': 'get_dialogs'})
-    response = process_manager.get_response(timeout=10.0, filter_type='dialogs_response')
+    if stream:
+        return StreamingResponse(stream_dialogs(), media_type='application/x-ndjson')
+    
+    command = {'type': 'get_dialogs', 'offset': offset, 'limit': limit, 'refresh': refresh}
+    etag = request.headers.get('if-none-match')
+    if etag and not refresh:
+        command['etag'] = etag
+    
+    response = await process_manager.request(command, timeout=10.0, response_type='dialogs_response')
     
     if response:
-        return JSONResponse(response)
+        headers = {'Cache-Control': 'no-cache'}
+        if response.get('etag'):
+            headers['ETag'] = response['etag']
+        if response.get('not_modified'):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(response, headers=headers)
     else:
         return JSONResponse({"success": False, "error": "超时"})
 
 
+async def stream_dialogs():
+    """把工作进程分批返回的群聊逐行输出为 NDJSON，出错时最后一行为错误信息"""
+    async for batch in process_manager.stream(
+        {'type': 'stream_dialogs'}, timeout=10.0, response_type='dialogs_batch'
+    ):
+        if not batch.get('success', True):
+            yield json.dumps({"success": False, "error": batch.get('error'), "done": True}, ensure_ascii=False) + "\n"
+            return
+        if batch.get('groups'):
+            yield "".join(json.dumps(group, ensure_ascii=False) + "\n" for group in batch['groups'])
+
+
 @app.post("/api/start_monitor")
 async def start_monitor(request: StartMonitorRequest):
     """开始监听"""
     if not process_manager:
         return JSONResponse({"success": False, "error": "进程管理器未初始化"})
     
-    process_manager.send_command({
+    rules = [rule.model_dump() for rule in request.rules]
+    if request.target_group_id is not None:
+        rules.append({
+            'target_group_id': request.target_group_id,
+            'keywords': request.keywords,
+            'messages': request.messages,
+            'interval': request.interval,
+            'rule_id': None
+        })
+    
+    if not rules:
+        return JSONResponse({"success": False, "error": "请至少配置一条监听规则"})
+    
+    command = {
         'type': 'start_monitor',
-        'target_group_id': request.target_group_id,
-        'keywords': request.keywords,
-        'messages': request.messages,
-        'interval': request.interval
-    })
-    response = process_manager.get_response(timeout=5.0)
+        'rules': rules,
+        'normalize': request.normalize
+    }
+    if request.send_limits:
+        command['send_limits'] = request.send_limits.model_dump(exclude_none=True)
+    if request.match_pipeline:
+        command['match_pipeline'] = request.match_pipeline.model_dump(exclude_none=True)
+    if request.catch_up:
+        catch_up = request.catch_up.model_dump(exclude_none=True)
+        command['catch_up'] = catch_up if catch_up.pop('enabled') else False
+    if request.chat_windows:
+        command['chat_windows'] = {
+            chat_id: window.model_dump() for chat_id, window in request.chat_windows.items()
+        }
+    
+    response = await process_manager.request(command, timeout=5.0, response_type='monitor_started')
+    
+    if response:
+        return JSONResponse(response)
+    else:
+        return JSONResponse({"success": False, "error": "超时"})
+
+
+@app.patch("/api/monitor/rules")
+async def update_monitor_rules(request: UpdateRulesRequest):
+    """增量更新监听规则，新规则表在工作进程中整体替换，不会停止监听"""
+    if not process_manager:
+        return JSONResponse({"success": False, "error": "进程管理器未初始化"})
+    
+    if not request.upsert and not request.remove:
+        return JSONResponse({"success": False, "error": "没有需要更新的规则"})
+    
+    command = {
+        'type': 'update_rules',
+        'upsert': [rule.model_dump() for rule in request.upsert],
+        'remove': request.remove
+    }
+    response = await process_manager.request(command, timeout=5.0, response_type='rules_updated')
     
     if response:
         return JSONResponse(response)
@@ -277,8 +513,23 @@ async def stop_monitor():
     if not process_manager:
         return JSONResponse({"success": False, "error": "进程管理器未初始化"})
     
-    process_manager.send_command({'type': 'stop_monitor'})
-    response = process_manager.get_response(timeout=5.0)
+    response = await process_manager.request(
+        {'type': 'stop_monitor'}, timeout=5.0, response_type='monitor_stopped'
+    )
+    
+    if response:
+        return JSONResponse(response)
+    else:
+        return JSONResponse({"success": False, "error": "超时"})
+
+
+@app.get("/api/stats")
+async def get_stats():
+    """获取触发节流和发送统计"""
+    if not process_manager:
+        return JSONResponse({"success": False, "error": "进程管理器未初始化"})
+    
+    response = await process_manager.request({'type': 'get_stats'}, timeout=3.0, response_type='stats')
     
     if response:
         return JSONResponse(response)
@@ -286,33 +537,107 @@ async def stop_monitor():
         return JSONResponse({"success": False, "error": "超时"})
 
 
+@app.get("/api/profile")
+async def profile(seconds: float = 10, mode: str = "sample", format: str = "json",
+                  interval: float = Query(0.005, ge=0.001, le=1), limit: int = 50, shard: int = 0):
+    """在工作进程内运行性能分析
+
+    Args:
+        seconds: 分析时长（秒）
+        mode: sample（调用栈采样）或 cprofile（函数级统计）
+        format: json，或 collapsed（仅 sample 模式，输出可直接生成火焰图的折叠栈文本）
+        interval: 采样间隔（秒，0.001~1）
+        limit: cprofile 模式返回的函数数
+        shard: 使用进程池时要分析的分片
+    """
+    if not process_manager:
+        return JSONResponse({"success": False, "error": "进程管理器未初始化"})
+
+    command = {
+        'type': 'profile',
+        'mode': mode,
+        'seconds': seconds,
+        'interval': interval,
+        'limit': limit,
+        'shard': shard
+    }
+    response = await process_manager.request(command, timeout=seconds + 10.0, response_type='profile')
+
+    if not response:
+        return JSONResponse({"success": False, "error": "超时"})
+    if format == "collapsed" and response.get('success') and 'collapsed' in response:
+        return PlainTextResponse(response['collapsed'] + "\n")
+    return JSONResponse(response)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标（工作进程的指标为最近一次推送的快照，不向工作进程发请求）"""
+    snapshots = process_manager.metrics_snapshots() if process_manager else []
+    return PlainTextResponse(render_prometheus(snapshots), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/results")
-async def get_results():
-    """获取监听结果"""
+async def get_results(since: int = 0, limit: int = 100):
+    """获取监听结果
+    
+    Args:
+        since: 已读到的结果序号，返回序号更大的结果（0 表示从最旧的结果开始）
+        limit: 最多返回的条数
+    """
     if not process_manager:
-        return JSONResponse({"results": []})
+        return JSONResponse({"results": [], "next": since, "missed": 0})
     
-    results = process_manager.check_results()
-    return JSONResponse({"results": results})
+    limit = max(1, min(limit, 1000))
+    return JSONResponse(process_manager.read_results(since, limit))
+
+
+@app.get("/api/journal")
+async def get_journal(chat_id: Optional[int] = None, kind: Optional[str] = None,
+                      since: Optional[float] = None, until: Optional[float] = None,
+                      before_id: Optional[int] = None, limit: int = 100):
+    """查询历史匹配和发送记录（按时间倒序）
+
+    翻页时把上一页返回的 next_until 和 next_before_id 作为 until 和 before_id。
+    """
+    limit = max(1, min(limit, 1000))
+    try:
+        loop = asyncio.get_running_loop()
+        events = await loop.run_in_executor(
+            None, lambda: event_journal.query(chat_id, kind, since, until, limit, before_id)
+        )
+    except Exception as e:
+        logger.error(f"查询事件日志失败: {e}")
+        return JSONResponse({"success": False, "error": str(e)})
+    
+    more = len(events) == limit
+    return JSONResponse({
+        "success": True,
+        "events": events,
+        # 翻页游标 (ts, id)：作为下一次请求的 until 和 before_id
+        "next_until": events[-1]['ts'] if more else None,
+        "next_before_id": events[-1]['id'] if more else None
+    })
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket 连接 - 实时推送监听结果"""
     await websocket.accept()
+    subscriber = result_hub.subscribe()
     
     try:
         while True:
-            # 检查新结果
-            if process_manager:
-                results = process_manager.check_results()
-                if results:
-                    await websocket.send_json({"results": results})
-            
-            await asyncio.sleep(0.5)
+            # 结果一到达就推送，积压的结果合并成一条消息
+            results, dropped = await subscriber.get()
+            payload = {"results": results}
+            if dropped:
+                payload["dropped"] = dropped
+            await websocket.send_json(payload)
             
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
         logger.error(f"WebSocket 错误: {e}")
     finally:
-        await websocket.close()
-
+        result_hub.unsubscribe(subscriber)
@@ -0,0 +1,49 @@
+"""
+重复消息过滤 - 按 (chat_id, message_id) 去重
+断线重连后 Telethon 可能重复推送同一条更新，重复的消息不再匹配和回复
+"""
+from collections import OrderedDict
+from typing import Any, Dict
+
+# 默认记住的消息数，每条约 200 字节
+DEFAULT_CAPACITY = 16384
+
+
+class DuplicateFilter:
+    """有界的 LRU 集合
+
+    只记住最近 capacity 条消息，超出时淘汰最久未出现的，内存占用不随运行时间增长。
+    重复推送通常紧跟在重连之后，远小于这个范围。
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError("capacity 必须大于 0")
+        self.capacity = capacity
+        self._seen: "OrderedDict[tuple, None]" = OrderedDict()
+        self.checked = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def is_duplicate(self, chat_id: int, message_id: int) -> bool:
+        """记录一条消息，已经出现过时返回 True"""
+        key = (chat_id, message_id)
+        self.checked += 1
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            self.dropped += 1
+            return True
+        self._seen[key] = None
+        if len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'checked': self.checked,
+            'dropped': self.dropped,
+            'size': len(self._seen),
+            'capacity': self.capacity
+        }
@@ -0,0 +1,59 @@
+"""
+群聊索引 - 工作进程内的群聊列表缓存
+首次加载后根据群聊变动增量更新，版本号变化时 ETag 随之变化
+"""
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class DialogIndex:
+    """群聊索引
+
+    按首次加载时的会话顺序保存群聊，新加入的群聊排在最后。
+    """
+
+    def __init__(self):
+        self.groups: Dict[int, Dict[str, Any]] = {}
+        self.loaded = False
+        self.version = 0
+        # 每个进程不同，避免工作进程重启后 ETag 与旧缓存冲突
+        self._epoch = os.urandom(4).hex()
+        self._snapshot: Optional[List[Dict[str, Any]]] = None
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._epoch}-{self.version}"'
+
+    def _changed(self):
+        self.version += 1
+        self._snapshot = None
+
+    def replace(self, groups: Iterable[Dict[str, Any]]):
+        """用完整列表重建索引"""
+        self.groups = {group['id']: group for group in groups}
+        self.loaded = True
+        self._changed()
+
+    def upsert(self, group: Dict[str, Any]) -> bool:
+        """新增或更新一个群聊，内容没有变化时返回 False"""
+        if self.groups.get(group['id']) == group:
+            return False
+        self.groups[group['id']] = group
+        self._changed()
+        return True
+
+    def remove(self, group_id: int) -> bool:
+        if self.groups.pop(group_id, None) is None:
+            return False
+        self._changed()
+        return True
+
+    def page(self, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按顺序返回一页群聊"""
+        if self._snapshot is None:
+            self._snapshot = list(self.groups.values())
+        end = None if limit is None else offset + limit
+        return self._snapshot[offset:end]
@@ -0,0 +1,193 @@
+"""
+事件日志 - 匹配记录和发送记录的持久化存储
+使用 SQLite（WAL 模式）只追加写入，后台线程批量提交，按群聊和时间建立索引
+"""
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 需要持久化的结果类型
+JOURNAL_KINDS = {'keyword_matched', 'message_sent', 'error', 'worker_restarted'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    chat_id INTEGER,
+    rule_id TEXT,
+    message_id INTEGER,
+    text TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_chat_ts ON events (chat_id, ts);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts);
+"""
+
+
+class EventJournal:
+    """只追加的事件日志
+
+    record() 只把结果放入内存队列，由写入线程按批次提交，不阻塞调用方。
+    """
+
+    def __init__(self, path: str = "event_journal.db", batch_size: int = 200,
+                 flush_interval: float = 0.5):
+        """
+        Args:
+            path: SQLite 数据库文件
+            batch_size: 每个事务最多写入的记录数
+            flush_interval: 攒批的最长等待时间（秒）
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self.written = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        """建表并启动写入线程"""
+        if self._writer is not None:
+            return
+
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name='journal-writer', daemon=True)
+        self._writer.start()
+        logger.info(f"事件日志已启动: {self.path}")
+
+    def close(self):
+        """写完队列中剩余的记录并停止写入线程"""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+        self._writer = None
+        logger.info("事件日志已关闭")
+
+    def record(self, result: Dict[str, Any]):
+        """记录一条结果（线程安全，可直接作为结果监听者）"""
+        if result.get('type') in JOURNAL_KINDS:
+            self._queue.put(result)
+
+    @staticmethod
+    def _row(result: Dict[str, Any]) -> tuple:
+        kind = result.get('type')
+        if kind == 'keyword_matched':
+            text = result.get('text')
+        elif kind == 'message_sent':
+            text = result.get('content')
+        else:
+            text = result.get('error')
+        return (
+            result.get('ts') or time.time(),
+            kind,
+            result.get('chat_id'),
+            result.get('rule_id'),
+            result.get('message_id'),
+            text,
+            json.dumps(result, ensure_ascii=False, default=str)
+        )
+
+    def _write_loop(self):
+        """写入线程：攒够一批或等待超时后在一个事务中提交"""
+        conn = self._connect()
+        stopping = False
+        try:
+            while not stopping:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                batch = [self._row(item)]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(self._row(item))
+
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT INTO events (ts, kind, chat_id, rule_id, message_id, text, data) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            batch
+                        )
+                    self.written += len(batch)
+                except sqlite3.Error as e:
+                    logger.error(f"写入事件日志失败: {e}")
+        finally:
+            conn.close()
+
+    def query(self, chat_id: Optional[int] = None, kind: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              limit: int = 100, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按群聊和时间查询事件，按时间倒序返回（时间相同时按 id 倒序）
+
+        Args:
+            chat_id: 群聊 ID（与结果中的 chat_id 一致）
+            kind: 事件类型（keyword_matched / message_sent / error）
+            since: 起始时间戳（包含）
+            until: 结束时间戳（不包含），翻页时传入上一页最后一条的 ts
+            limit: 最多返回的条数
+            before_id: 与 until 一起使用，翻页时传入上一页最后一条的 id；
+                此时返回 ts 小于 until，以及 ts 等于 until 且 id 更小的事件，同一时间戳的事件不会被跳过
+        """
+        conditions = []
+        params: List[Any] = []
+        if chat_id is not None:
+            conditions.append("chat_id = ?")
+            params.append(chat_id)
+        if kind is not None:
+            conditions.append("kind = ?")
+            params.append(kind)
+        if since is not None:
+            conditions.append("ts >= ?")
+            params.append(since)
+        if until is not None and before_id is not None:
+            # 等价于 (ts, id) < (until, before_id)，写成 ts <= ? 的形式可以使用 ts 索引
+            conditions.append("ts <= ? AND (ts < ? OR id < ?)")
+            params.extend((until, until, before_id))
+        elif until is not None:
+            conditions.append("ts < ?")
+            params.append(until)
+
+        sql = "SELECT id, ts, kind, chat_id, rule_id, message_id, text FROM events"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
@@ -0,0 +1,119 @@
+"""
+关键字匹配器 - 基于 Aho-Corasick 自动机的多模式匹配
+构建一次，单次扫描消息文本即可找出所有命中的关键字
+"""
+from typing import Dict, Iterable, List
+
+# 关键字较少时 C 实现的 str.__contains__ 比纯 Python 自动机更快
+SMALL_SET_THRESHOLD = 32
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多关键字匹配器
+
+    匹配耗时只与消息长度和命中数量有关，与关键字数量无关。
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        """
+        构建自动机
+
+        Args:
+            keywords: 关键字列表（重复项会被合并）
+        """
+        # 去重并保持原有顺序
+        self.keywords: List[str] = list(dict.fromkeys(keywords))
+
+        # 空关键字与原实现（'' in text）一致，视为匹配任意消息
+        self.match_empty = '' in self.keywords
+        self.use_scan = len(self.keywords) <= SMALL_SET_THRESHOLD
+
+        # 节点 i 的转移表、失败指针、输出（关键字下标）
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for index, keyword in enumerate(self.keywords):
+            if keyword:
+                self._insert(keyword, index)
+        self._build_fail_links()
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def _insert(self, keyword: str, index: int):
+        """插入一个关键字到字典树"""
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(index)
+
+    def _build_fail_links(self):
+        """按层（BFS）构建失败指针，并把后缀节点的输出合并进来"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target if target != child else 0
+                if output[fail[child]]:
+                    output[child] = output[child] + output[fail[child]]
+
+    def search(self, text: str) -> bool:
+        """是否命中任意关键字（命中即返回）"""
+        if self.match_empty:
+            return True
+        if self.use_scan:
+            return any(keyword in text for keyword in self.keywords)
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                return True
+        return False
+
+    def find(self, text: str) -> List[str]:
+        """单次扫描返回所有命中的关键字（按关键字列表顺序，去重）"""
+        if self.use_scan:
+            return [keyword for keyword in self.keywords if keyword in text]
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        hits = set()
+        if self.match_empty:
+            hits.add(self.keywords.index(''))
+
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                hits.update(output[node])
+
+        return [self.keywords[i] for i in sorted(hits)]
@@ -0,0 +1,182 @@
+"""
+匹配流水线 - 把关键字匹配移出 Telethon 事件循环
+新消息先攒成小批次，在线程池或进程池中匹配，结果按提交顺序回到事件循环再触发回复
+"""
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .rule_engine import RuleSet
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODES = ('thread', 'process')
+
+DEFAULT_OPTIONS = {
+    'mode': 'thread',       # thread: 线程池；process: 进程池（不占用工作进程的 GIL）
+    'batch_size': 64,       # 每批最多消息数，攒满立即提交
+    'max_delay_ms': 5,      # 批次中第一条消息最多等待的毫秒数
+    'workers': 1,           # 线程/进程数
+}
+
+# (chat_id, message_id, text)
+Item = Tuple[int, int, str]
+# 每条消息命中的 (规则下标, 命中的关键字)
+Matches = List[Tuple[int, List[str]]]
+
+# 进程池中编译好的规则表（由 _init_process 设置）
+_process_rule_table: Dict[int, RuleSet] = {}
+
+
+def _init_process(chat_rules: Dict[int, List[dict]], normalize_text: bool):
+    """进程池初始化：在子进程中编译规则（编译结果含闭包，不能直接传递）"""
+    global _process_rule_table
+    _process_rule_table = {
+        chat_id: RuleSet(rules, normalize_text) for chat_id, rules in chat_rules.items()
+    }
+
+
+def _match_batch(rule_table: Dict[int, RuleSet], items: List[Item]) -> List[Matches]:
+    results = []
+    for chat_id, _, text in items:
+        rule_set = rule_table.get(chat_id)
+        results.append(rule_set.match_indices(text) if rule_set is not None else [])
+    return results
+
+
+def _match_batch_in_process(items: List[Item]) -> List[Matches]:
+    return _match_batch(_process_rule_table, items)
+
+
+class MatchPipeline:
+    """微批匹配流水线
+
+    submit() 只把消息加入当前批次；批次攒满 batch_size 条或等待超过 max_delay_ms 后
+    交给执行器匹配。各批次的结果按提交顺序交给 on_matched，保证同一群聊的回复顺序不变。
+    """
+
+    def __init__(self, on_matched: Callable[[Item, RuleSet, Matches], None], **options):
+        """
+        Args:
+            on_matched: 在事件循环中调用 on_matched(消息, 提交时的规则集, 命中结果)
+            options: 覆盖 DEFAULT_OPTIONS 中的参数
+        """
+        self.on_matched = on_matched
+        self.options = dict(DEFAULT_OPTIONS)
+        unknown = set(options) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError(f"未知的流水线参数: {', '.join(sorted(unknown))}")
+        self.options.update({key: value for key, value in options.items() if value is not None})
+        if self.options['mode'] not in MODES:
+            raise ValueError(f"未知的流水线模式: {self.options['mode']}")
+
+        self.batch_size = max(1, int(self.options['batch_size']))
+        self.max_delay = max(0.0, self.options['max_delay_ms'] / 1000)
+
+        self._loop = asyncio.get_running_loop()
+        self._executor: Optional[Executor] = None
+        self._rule_table: Dict[int, RuleSet] = {}
+
+        self._batch: List[Item] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # 已提交的批次: (消息, 规则表快照, 结果)
+        self._inflight: Deque[Tuple[List[Item], Dict[int, RuleSet], asyncio.Future]] = deque()
+
+        self.batches = 0
+        self.messages = 0
+        self.largest_batch = 0
+
+    @property
+    def mode(self) -> str:
+        return self.options['mode']
+
+    @property
+    def pending(self) -> int:
+        """尚未返回结果的消息数"""
+        return len(self._batch) + sum(len(items) for items, _, _ in self._inflight)
+
+    def set_rules(self, rule_table: Dict[int, RuleSet]):
+        """更新规则表，之后提交的批次使用新规则"""
+        self._flush()
+        self._rule_table = rule_table
+
+        if self.mode == 'thread':
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.options['workers'], thread_name_prefix='match')
+            return
+
+        # 进程池在初始化时编译规则，规则变化时换一个新的进程池；旧进程池处理完已提交的批次后退出
+        old_executor = self._executor
+        chat_rules = {chat_id: rule_set.rules for chat_id, rule_set in rule_table.items()}
+        normalize_text = next(iter(rule_table.values())).normalize_text if rule_table else True
+        self._executor = ProcessPoolExecutor(
+            self.options['workers'],
+            initializer=_init_process,
+            initargs=(chat_rules, normalize_text)
+        )
+        if old_executor is not None:
+            old_executor.shutdown(wait=False)
+
+    def submit(self, chat_id: int, message_id: int, text: str):
+        """加入当前批次（不等待匹配）"""
+        self._batch.append((chat_id, message_id, text))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.max_delay, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batch or self._executor is None:
+            return
+
+        items, self._batch = self._batch, []
+        rule_table = self._rule_table
+        if self.mode == 'thread':
+            future = self._loop.run_in_executor(self._executor, _match_batch, rule_table, items)
+        else:
+            future = self._loop.run_in_executor(self._executor, _match_batch_in_process, items)
+        self._inflight.append((items, rule_table, future))
+        future.add_done_callback(self._deliver)
+
+        self.batches += 1
+        self.messages += len(items)
+        self.largest_batch = max(self.largest_batch, len(items))
+
+    def _deliver(self, _future: asyncio.Future):
+        """按提交顺序交付已完成的批次"""
+        while self._inflight and self._inflight[0][2].done():
+            items, rule_table, future = self._inflight.popleft()
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None:
+                logger.error(f"批量匹配失败: {error}")
+                continue
+            for item, matches in zip(items, future.result()):
+                if matches:
+                    self.on_matched(item, rule_table[item[0]], matches)
+
+    async def close(self):
+        """匹配完已提交的消息并关闭执行器"""
+        self._flush()
+        if self._inflight:
+            await asyncio.gather(*(future for _, _, future in self._inflight), return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'mode': self.mode,
+            'batches': self.batches,
+            'messages': self.messages,
+            'largest_batch': self.largest_batch,
+            'pending': self.pending,
+            'avg_batch': round(self.messages / self.batches, 2) if self.batches else 0
+        }
@@ -0,0 +1,161 @@
+"""
+运行指标 - 计数器、仪表和直方图，以及 Prometheus 文本格式输出
+工作进程在本地累加，定期把快照通过结果队列发给主进程；主进程合并后由 /metrics 输出
+"""
+import bisect
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+# 直方图桶上限（秒）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 指标名 -> (类型, 说明)
+METRICS = {
+    # 工作进程
+    'tgmon_command_duration_seconds': ('histogram', '工作进程处理命令的耗时'),
+    'tgmon_message_handle_duration_seconds': ('histogram', '处理一条新消息（匹配或提交到批量匹配）的耗时'),
+    'tgmon_messages_total': ('counter', '监听群聊中收到的消息数'),
+    'tgmon_duplicate_messages_total': ('counter', '重复推送而被丢弃的消息数'),
+    'tgmon_catch_up_messages_total': ('counter', '重连或重启后补拉并处理的消息数'),
+    'tgmon_rule_matches_total': ('counter', '规则命中次数'),
+    'tgmon_rule_suppressed_total': ('counter', '规则命中后被合并窗口或冷却时间抑制的次数'),
+    'tgmon_messages_sent_total': ('counter', '已发送的回复数'),
+    'tgmon_send_errors_total': ('counter', '发送失败次数'),
+    'tgmon_flood_waits_total': ('counter', '触发 FloodWait 的次数'),
+    'tgmon_flood_wait_seconds_total': ('counter', 'FloodWait 累计等待秒数'),
+    'tgmon_send_queue_depth': ('gauge', '发送调度器中排队的回复序列数'),
+    'tgmon_pending_commands': ('gauge', '工作进程已读取、等待处理的命令数'),
+    'tgmon_match_pipeline_depth': ('gauge', '批量匹配中尚未返回结果的消息数'),
+    # 主进程
+    'tgmon_worker_up': ('gauge', '工作进程是否在运行'),
+    'tgmon_ipc_queue_depth': ('gauge', '进程间队列中的消息数'),
+    'tgmon_result_ring_dropped': ('gauge', '共享内存结果通道已满而丢弃的结果数'),
+    'tgmon_ipc_request_duration_seconds': ('histogram', '命令从发出到收到响应的往返耗时'),
+    'tgmon_result_delivery_seconds': ('histogram', '结果从工作进程产生到主进程收到的耗时'),
+    'tgmon_metrics_snapshot_age_seconds': ('gauge', '工作进程指标快照距今的秒数'),
+    'tgmon_worker_heartbeat_age_seconds': ('gauge', '工作进程心跳距今的秒数'),
+    'tgmon_worker_startup_seconds': ('gauge', '从创建工作进程到事件循环开始运行的秒数'),
+    'tgmon_worker_restarts_total': ('counter', '工作进程退出或无响应后被自动重启的次数'),
+    'tgmon_worker_recovery_seconds': ('histogram', '工作进程从最后一次心跳到重启并重放配置完成的停机时间'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    """固定桶的直方图，observe 只做一次二分查找"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        # 最后一个桶为 +Inf
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+class MetricsRegistry:
+    """一个进程内的指标
+
+    主进程中结果读取线程、监督线程和事件循环会同时更新，/metrics 同时读取快照，
+    所以更新和快照都在同一把锁内进行（没有竞争时加锁只需几十纳秒）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self) -> Dict[str, List]:
+        """可以通过队列传递的快照（复制后的数据，之后的更新不影响快照）"""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> Dict[str, List]:
+        return {
+            'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+            'gauges': [[name, dict(labels), value] for (name, labels), value in self.gauges.items()],
+            'histograms': [
+                [name, dict(labels), histogram.snapshot()]
+                for (name, labels), histogram in self.histograms.items()
+            ]
+        }
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(str(value))}"' for key, value in sorted(labels.items())) + '}'
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(snapshots: Iterable[Tuple[Dict[str, Any], Dict[str, List]]]) -> str:
+    """把多个快照输出为 Prometheus 文本格式
+
+    Args:
+        snapshots: (附加标签, 快照)，附加标签用于区分分片
+    """
+    series: Dict[str, List[str]] = {}
+
+    for extra, snapshot in snapshots:
+        for kind in ('counters', 'gauges'):
+            for name, labels, value in snapshot.get(kind, ()):
+                series.setdefault(name, []).append(
+                    f"{name}{_format_labels(dict(labels, **extra))} {_format_value(value)}"
+                )
+        for name, labels, histogram in snapshot.get('histograms', ()):
+            labels = dict(labels, **extra)
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), histogram['counts']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    output = []
+    for name, lines in series.items():
+        kind, description = METRICS.get(name, ('untyped', ''))
+        output.append(f"# HELP {name} {description}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(lines)
+    return '\n'.join(output) + '\n'
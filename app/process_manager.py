@@ -1,41 +1,120 @@
 """
 进程管理器 - 管理主进程和工作进程的通信
 """
+import asyncio
+import atexit
+import itertools
 import multiprocessing
+import queue
+import threading
 from queue import Empty
 import logging
 import time
-from typing import Optional, Dict, Any
+from typing import AsyncIterator, Callable, List, Optional, Dict, Any, Tuple, Union
+
+from .metrics import MetricsRegistry
+from .result_ring import ResultRing
+from .shm_ring import ShmResultQueue
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 心跳超过这么久没有更新即认为工作进程无响应（秒）
+HEARTBEAT_TIMEOUT = 10.0
+# 监督线程的检查间隔（秒）
+SUPERVISE_INTERVAL = 0.5
+# 读取线程检查所读的队列是否已被重启替换的间隔（秒）
+READER_POLL_INTERVAL = 1.0
+# 连续重启前的等待时间（秒）；工作进程稳定运行 RESTART_RESET 秒后重新计数
+RESTART_BACKOFF = (0, 1, 2, 5, 10, 30)
+RESTART_RESET = 60.0
+# 重启后不重放的命令：登录流程的状态随进程丢失，重放没有意义
+NO_REPLAY_COMMANDS = {'send_code', 'verify_code', 'disconnect', 'profile'}
+
 
 class ProcessManager:
     """进程管理器 - 管理与 Telegram 工作进程的通信"""
     
-    def __init__(self, api_id: int, api_hash: str):
+    def __init__(self, api_id: int, api_hash: str, session_name: str = 'telegram_session',
+                 result_capacity: int = 1000, result_transport: str = 'queue',
+                 supervise: bool = True, heartbeat_timeout: float = HEARTBEAT_TIMEOUT):
         """
         初始化进程管理器
         
         Args:
             api_id: Telegram API ID
             api_hash: Telegram API Hash
+            session_name: Telethon 会话文件名（每个账号一个）
+            result_capacity: 结果环形缓冲区容量
+            result_transport: 结果通道，queue（multiprocessing.Queue）或 shm（共享内存环形缓冲区）
+            supervise: 工作进程退出或心跳超时时自动重启，并重放监听配置和未完成的命令
+            heartbeat_timeout: 心跳超时时间（秒）
         """
+        if result_transport not in ('queue', 'shm'):
+            raise ValueError(f"未知的结果通道: {result_transport}")
         self.api_id = api_id
         self.api_hash = api_hash
+        self.session_name = session_name
+        self.result_transport = result_transport
         
-        # 创建进程间通信队列
+        # 创建进程间通信队列（共享内存结果通道在 start 中创建）
         self.command_queue = multiprocessing.Queue()
         self.response_queue = multiprocessing.Queue()
-        self.result_queue = multiprocessing.Queue()
+        self.result_queue: Union[multiprocessing.Queue, ShmResultQueue, None] = (
+            multiprocessing.Queue() if result_transport == 'queue' else None
+        )
         
-        # 工作进程
+        # 工作进程，以及它在事件循环中定期写入的心跳时间
         self.worker_process: Optional[multiprocessing.Process] = None
+        self.heartbeat = multiprocessing.RawValue('d', 0.0)
+        
+        # 监督线程
+        self.supervise = supervise
+        self.heartbeat_timeout = heartbeat_timeout
+        self._supervisor: Optional[threading.Thread] = None
+        self._supervisor_stop = threading.Event()
+        self._spawned_at = 0.0
+        # 从创建工作进程到第一次心跳（事件循环开始运行）的秒数
+        self.worker_startup_seconds: Optional[float] = None
+        # 重启时替换队列，与 send_command 互斥
+        self._queue_lock = threading.Lock()
+        # 当前生效的监听配置: start_monitor（或开始监听的 update_rules）和合并了之后所有成功增量更新的规则，
+        # 重启后作为一条命令重放
+        self._monitor_snapshot: Optional[Dict[str, Any]] = None
+        # 已发出、还没确认生效的监听命令: request_id -> 命令
+        self._monitor_unconfirmed: Dict[str, Dict[str, Any]] = {}
+        # 已发出、还在等待响应的命令: request_id -> 命令
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        # 正在进行的恢复，以及最近一次恢复的记录
+        self._recovery: Optional[Dict[str, Any]] = None
+        self.restarts = 0
+        self.last_recovery: Optional[Dict[str, Any]] = None
         
         # 状态
         self.is_running = False
-        self.results: list = []
+        self.results = ResultRing(result_capacity)
+        # check_results/get_result 的读取位置
+        self._results_cursor = 0
+        
+        # 等待响应的异步请求: request_id -> (事件循环, future 或流式响应队列, 期望的响应类型)
+        self._pending: Dict[str, Tuple[asyncio.AbstractEventLoop,
+                                       Union[asyncio.Future, asyncio.Queue], Optional[str]]] = {}
+        self._pending_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        
+        # 不带 request_id 的响应（同步 send_command/get_response 调用方使用）
+        self._responses: queue.Queue = queue.Queue()
+        self._response_reader: Optional[threading.Thread] = None
+        
+        # 结果由读取线程统一接收，再分发给监听者（在读取线程中调用）
+        self._result_reader: Optional[threading.Thread] = None
+        self._result_listeners: List[Callable[[Dict[str, Any]], None]] = []
+        
+        # 主进程一侧的指标，以及工作进程最近一次推送的指标快照
+        self.metrics = MetricsRegistry()
+        self.worker_metrics: Optional[Dict[str, Any]] = None
+        # 工作进程推送的连接/登录/监听状态，收到第一次推送前为 None
+        self.worker_state: Optional[Dict[str, Any]] = None
     
     def start(self):
         """启动工作进程"""
@@ -44,24 +123,62 @@ class ProcessManager:
             return
         
         try:
-            self.worker_process = multiprocessing.Process(
-                target=self._worker_target,
-                args=(
-                    self.api_id,
-                    self.api_hash,
-                    self.command_queue,
-                    self.response_queue,
-                    self.result_queue
-                ),
-                daemon=True
-            )
-            self.worker_process.start()
+            if self.result_transport == 'shm':
+                self.result_queue = ShmResultQueue()
+            self._spawn()
             self.is_running = True
+            atexit.register(self.stop)
+            
+            if self.supervise:
+                self._supervisor_stop.clear()
+                self._supervisor = threading.Thread(target=self._supervise, name='worker-supervisor', daemon=True)
+                self._supervisor.start()
             logger.info("工作进程已启动")
         except Exception as e:
             logger.error(f"启动工作进程失败: {e}")
             raise
     
+    def _spawn(self):
+        """创建工作进程和两个读取线程（读取线程绑定当前的队列）"""
+        self.worker_state = None
+        self.worker_startup_seconds = None
+        # 工作进程第一次写入心跳前为 0
+        self.heartbeat.value = 0.0
+        self._spawned_at = time.time()
+        self.worker_process = multiprocessing.Process(
+            target=self._worker_target,
+            args=(
+                self.api_id,
+                self.api_hash,
+                self.command_queue,
+                self.response_queue,
+                self.result_queue,
+                self.session_name,
+                self.heartbeat
+            ),
+            # 非守护进程才能创建子进程（匹配流水线的进程池）；
+            # 退出时由 atexit 调用 stop()，先于 multiprocessing 等待子进程结束
+            daemon=False
+        )
+        self.worker_process.start()
+        
+        # 唯一的响应读取线程，按 request_id 分发响应
+        self._response_reader = threading.Thread(
+            target=self._read_responses,
+            args=(self.response_queue,),
+            name='response-reader',
+            daemon=True
+        )
+        self._response_reader.start()
+        
+        self._result_reader = threading.Thread(
+            target=self._read_results,
+            args=(self.result_queue,),
+            name='result-reader',
+            daemon=True
+        )
+        self._result_reader.start()
+    
     def stop(self):
         """停止工作进程"""
         if not self.is_running:
@@ -70,6 +187,12 @@ class ProcessManager:
         try:
             self.is_running = False
             
+            # 先停止监督线程，避免把正常退出当作崩溃
+            self._supervisor_stop.set()
+            if self._supervisor is not None:
+                self._supervisor.join(timeout=10)
+                self._supervisor = None
+            
             # 发送断开命令
             if self.worker_process:
                 self.command_queue.put({'type': 'disconnect'})
@@ -85,12 +208,33 @@ class ProcessManager:
                         self.worker_process.kill()
                 
                 self.worker_process = None
+            atexit.unregister(self.stop)
+            
+            # 结束响应读取线程，并让仍在等待的请求立即返回
+            self.response_queue.put(None)
+            self.result_queue.put(None)
+            self._fail_pending()
+            self.worker_state = None
+            self._monitor_snapshot = None
+            self._monitor_unconfirmed.clear()
+            self._recovery = None
+            
+            # 读取线程退出后才能释放共享内存
+            if isinstance(self.result_queue, ShmResultQueue):
+                if self._result_reader is not None:
+                    self._result_reader.join(timeout=1)
+                self.result_queue.close()
             
             logger.info("工作进程已停止")
             
         except Exception as e:
             logger.error(f"停止工作进程失败: {e}")
     
+    @property
+    def worker_ready(self) -> bool:
+        """工作进程的事件循环是否已开始运行（已写入心跳）"""
+        return self.is_running and self.heartbeat.value > 0
+    
     def send_command(self, command: Dict[str, Any]):
         """发送命令到工作进程"""
         if not self.is_running:
@@ -98,13 +242,49 @@ class ProcessManager:
             return False
         
         try:
-            self.command_queue.put(command)
+            with self._queue_lock:
+                # 先记录再放入队列，否则工作进程很快响应时响应读取线程还找不到这条命令
+                self._track(command)
+                try:
+                    self.command_queue.put(command)
+                except Exception:
+                    self._untrack(command)
+                    raise
             logger.info(f"发送命令: {command.get('type')}")
             return True
         except Exception as e:
             logger.error(f"发送命令失败: {e}")
             return False
     
+    def _track(self, command: Dict[str, Any]):
+        """记录重启后需要重放的命令
+
+        监听命令在工作进程响应成功后才计入监听配置（见 _confirm_monitor），
+        没有 request_id 的监听命令无法确认，不会重放。
+        """
+        cmd_type = command.get('type')
+        request_id = command.get('request_id')
+        if cmd_type in ('start_monitor', 'update_rules'):
+            if request_id is not None:
+                self._monitor_unconfirmed[request_id] = command
+        elif cmd_type in ('stop_monitor', 'disconnect', 'send_code'):
+            # 之前发出的监听命令即使成功也会被这条命令取消（send_code 换用新客户端，监听随旧客户端清除）
+            self._monitor_snapshot = None
+            self._monitor_unconfirmed.clear()
+        
+        if request_id is not None:
+            with self._pending_lock:
+                if request_id in self._pending:
+                    self._inflight[request_id] = command
+    
+    def _untrack(self, command: Dict[str, Any]):
+        """命令没能发出时撤销 _track 的记录"""
+        request_id = command.get('request_id')
+        if request_id is not None:
+            self._monitor_unconfirmed.pop(request_id, None)
+            with self._pending_lock:
+                self._inflight.pop(request_id, None)
+    
     def get_response(self, timeout: float = 1.0, filter_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """从工作进程获取响应
         
@@ -115,7 +295,7 @@ class ProcessManager:
         try:
             # 如果不是过滤模式，直接获取
             if filter_type is None:
-                response = self.response_queue.get(timeout=timeout)
+                response = self._responses.get(timeout=timeout)
                 logger.info(f"收到响应: {response.get('type')}")
                 return response
             
@@ -128,7 +308,7 @@ class ProcessManager:
                     return None
                 
                 try:
-                    response = self.response_queue.get(timeout=0.1)
+                    response = self._responses.get(timeout=0.1)
                     if response.get('type') == filter_type:
                         logger.info(f"收到匹配响应: {filter_type}")
                         return response
@@ -142,46 +322,493 @@ class ProcessManager:
             logger.error(f"获取响应失败: {e}")
             return None
     
-    def get_result(self, timeout: float = 0.1) -> Optional[Dict[str, Any]]:
-        """获取结果（来自 result_queue）"""
+    async def request(self, command: Dict[str, Any], timeout: float = 5.0,
+                      response_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """发送命令并异步等待对应的响应（不阻塞事件循环）
+        
+        Args:
+            command: 命令
+            timeout: 超时时间（秒）
+            response_type: 如果指定，忽略同一请求产生的其他类型响应
+        
+        Returns:
+            响应；超时或发送失败时返回 None
+        """
+        request_id = f"{self.session_name}-{next(self._request_ids)}"
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        with self._pending_lock:
+            self._pending[request_id] = (loop, future, response_type)
+        
         try:
-            result = self.result_queue.get(timeout=timeout)
-            self.results.append(result)
-            logger.info(f"收到结果: {result.get('type')}")
-            return result
-        except Empty:
+            start = time.perf_counter()
+            if not self.send_command(dict(command, request_id=request_id)):
+                return None
+            response = await asyncio.wait_for(future, timeout)
+            if response is not None:
+                self.metrics.observe(
+                    'tgmon_ipc_request_duration_seconds', time.perf_counter() - start,
+                    command=command.get('type')
+                )
+            return response
+        except asyncio.TimeoutError:
+            logger.warning(f"请求超时: {command.get('type')} ({request_id})")
             return None
-        except Exception as e:
-            logger.error(f"获取结果失败: {e}")
+        finally:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+                self._inflight.pop(request_id, None)
+    
+    async def stream(self, command: Dict[str, Any], timeout: float = 10.0,
+                     response_type: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """发送命令并逐个接收同一请求的多条响应，直到收到 done 为真的响应
+        
+        Args:
+            command: 命令
+            timeout: 两条响应之间的最长等待时间（秒）
+            response_type: 如果指定，忽略其他类型的响应
+        """
+        request_id = f"{self.session_name}-{next(self._request_ids)}"
+        loop = asyncio.get_running_loop()
+        responses: asyncio.Queue = asyncio.Queue()
+        
+        with self._pending_lock:
+            self._pending[request_id] = (loop, responses, response_type)
+        
+        try:
+            # 出错时也以一条 done 为真的响应结束，调用方不会收到没有结尾的流
+            if not self.send_command(dict(command, request_id=request_id)):
+                yield {'type': response_type, 'success': False, 'error': '发送命令失败', 'done': True}
+                return
+            while True:
+                try:
+                    response = await asyncio.wait_for(responses.get(), timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"流式响应超时: {command.get('type')} ({request_id})")
+                    yield {'type': response_type, 'success': False, 'error': '超时', 'done': True}
+                    return
+                if response is None:
+                    yield {'type': response_type, 'success': False, 'error': '工作进程已停止或重启', 'done': True}
+                    return
+                yield response
+                if response.get('done'):
+                    return
+        finally:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+                self._inflight.pop(request_id, None)
+    
+    def _read_responses(self, response_queue):
+        """响应读取线程：把响应交给对应请求的 future"""
+        while True:
+            try:
+                response = response_queue.get(timeout=READER_POLL_INTERVAL)
+            except Empty:
+                # 重启后旧进程已结束，旧队列读空后不会再有数据
+                if response_queue is not self.response_queue:
+                    break
+                continue
+            except (EOFError, OSError):
+                break
+            if response is None:
+                break
+            
+            request_id = response.get('request_id')
+            # rule_ids 只用于记录监听配置，不返回给调用方
+            rule_ids = response.pop('rule_ids', None)
+            if request_id is None:
+                self._responses.put(response)
+                continue
+            
+            monitor_command = self._monitor_unconfirmed.pop(request_id, None)
+            if monitor_command is not None and response.get('success') and rule_ids is not None:
+                self._confirm_monitor(monitor_command, rule_ids)
+            
+            # 重放的命令全部处理完，恢复完成
+            recovery = self._recovery
+            if recovery is not None and request_id == recovery['request_id']:
+                self._finish_recovery(recovery)
+                continue
+            
+            with self._pending_lock:
+                pending = self._pending.get(request_id)
+                if pending is not None:
+                    response_type = pending[2]
+                    if response_type is not None and response.get('type') != response_type:
+                        pending = None
+            
+            if pending is None:
+                logger.debug(f"丢弃无人等待的响应: {response.get('type')} ({request_id})")
+                continue
+            
+            loop, sink, _ = pending
+            try:
+                if isinstance(sink, asyncio.Queue):
+                    loop.call_soon_threadsafe(sink.put_nowait, response)
+                else:
+                    loop.call_soon_threadsafe(self._resolve, sink, response)
+            except RuntimeError:
+                # 等待方的事件循环已关闭
+                pass
+    
+    @staticmethod
+    def _resolve(future: asyncio.Future, response: Optional[Dict[str, Any]]):
+        if not future.done():
+            future.set_result(response)
+    
+    def _fail_pending(self):
+        """让所有等待中的请求返回 None"""
+        with self._pending_lock:
+            pending = list(self._pending.values())
+        for loop, sink, _ in pending:
+            try:
+                if isinstance(sink, asyncio.Queue):
+                    loop.call_soon_threadsafe(sink.put_nowait, None)
+                else:
+                    loop.call_soon_threadsafe(self._resolve, sink, None)
+            except RuntimeError:
+                pass
+    
+    def _fail_request(self, request_id: str):
+        """让一个等待中的请求立即返回 None"""
+        with self._pending_lock:
+            pending = self._pending.get(request_id)
+        if pending is None:
+            return
+        loop, sink, _ = pending
+        try:
+            if isinstance(sink, asyncio.Queue):
+                loop.call_soon_threadsafe(sink.put_nowait, None)
+            else:
+                loop.call_soon_threadsafe(self._resolve, sink, None)
+        except RuntimeError:
+            pass
+    
+    # ------------------------------------------------------------ 监督与重启
+    
+    def _supervise(self):
+        """监督线程：工作进程退出或心跳超时时重启"""
+        failures = 0
+        while not self._supervisor_stop.wait(SUPERVISE_INTERVAL):
+            process = self.worker_process
+            if process is None:
+                continue
+            
+            now = time.time()
+            last_heartbeat = self.heartbeat.value
+            if last_heartbeat and self.worker_startup_seconds is None:
+                # 检查间隔小于心跳间隔，这里看到的就是第一次心跳
+                self.worker_startup_seconds = last_heartbeat - self._spawned_at
+                self.metrics.set('tgmon_worker_startup_seconds', self.worker_startup_seconds)
+                logger.info(f"工作进程已就绪，启动耗时 {self.worker_startup_seconds:.2f} 秒")
+            # 还没有心跳时从创建进程的时间算起
+            last_heartbeat = last_heartbeat or self._spawned_at
+            if not process.is_alive():
+                reason, detail = 'exited', f"退出码 {process.exitcode}"
+            elif now - last_heartbeat > self.heartbeat_timeout:
+                reason, detail = 'hung', f"{now - last_heartbeat:.1f} 秒没有心跳"
+            else:
+                if failures and now - self._spawned_at > RESTART_RESET:
+                    failures = 0
+                continue
+            
+            logger.error(f"工作进程异常（{detail}），准备重启")
+            # 连续崩溃时逐渐拉长间隔，避免重启风暴
+            delay = RESTART_BACKOFF[min(failures, len(RESTART_BACKOFF) - 1)]
+            failures += 1
+            if delay and self._supervisor_stop.wait(delay):
+                break
+            try:
+                self._restart(reason, detail, last_heartbeat, now)
+            except Exception as e:
+                logger.error(f"重启工作进程失败: {e}")
+    
+    def _restart(self, reason: str, detail: str, last_heartbeat: float, detected_at: float):
+        """结束旧进程，用新队列启动新进程，并重放监听配置和未完成的命令
+        
+        旧进程可能在持有队列锁时被杀死，所以三个队列都换成新的；旧的读取线程读完旧队列后退出。
+        """
+        old_process = self.worker_process
+        if old_process.is_alive():
+            old_process.terminate()
+            old_process.join(timeout=2)
+            if old_process.is_alive():
+                old_process.kill()
+                old_process.join(timeout=2)
+        
+        old_result_reader = self._result_reader
+        with self._queue_lock:
+            if not self.is_running:
+                return
+            unread = self._drain_commands(self.command_queue)
+            old_queues = (self.response_queue, self.result_queue)
+            self.command_queue = multiprocessing.Queue()
+            self.response_queue = multiprocessing.Queue()
+            self.result_queue = ShmResultQueue() if self.result_transport == 'shm' else multiprocessing.Queue()
+            self._spawn()
+            
+            replay = self._replay_commands(unread)
+            # 最后一条 ping 的响应到达说明前面的命令都已处理完
+            request_id = f"{self.session_name}-{next(self._request_ids)}"
+            replay.append({'type': 'ping', 'request_id': request_id})
+            previous = self._recovery
+            self._recovery = {
+                'request_id': request_id,
+                'reason': reason,
+                'detail': detail,
+                # 上一次恢复还没完成又失败时，停机时间从第一次失败算起
+                'last_heartbeat': previous['last_heartbeat'] if previous else last_heartbeat,
+                'detected_at': previous['detected_at'] if previous else detected_at,
+                'replayed': len(replay) - 1
+            }
+            for command in replay:
+                self.command_queue.put(command)
+        
+        for old_queue in old_queues:
+            try:
+                old_queue.put(None)
+            except Exception:
+                pass
+        if isinstance(old_queues[1], ShmResultQueue):
+            if old_result_reader is not None:
+                old_result_reader.join(timeout=1)
+            old_queues[1].close()
+        
+        self.restarts += 1
+        self.metrics.inc('tgmon_worker_restarts_total', reason=reason)
+        logger.info(f"工作进程已重启，重放 {len(replay) - 1} 条命令")
+    
+    @staticmethod
+    def _drain_commands(command_queue) -> List[Dict[str, Any]]:
+        """取出旧命令队列中工作进程还没读取的命令"""
+        commands = []
+        while True:
+            try:
+                # 带超时，旧进程持有读锁时不会卡住
+                command = command_queue.get(timeout=0.05)
+            except (Empty, EOFError, OSError):
+                break
+            if command is not None:
+                commands.append(command)
+        return commands
+    
+    def _confirm_monitor(self, command: Dict[str, Any], rule_ids: List[str]):
+        """监听命令已在工作进程中生效，合并到重启时重放的监听配置（在响应读取线程中调用）
+
+        update_rules 按 rule_id 合并到规则列表中，重放的始终是一份当前规则，不随更新次数增长。
+        """
+        with self._queue_lock:
+            if command['type'] == 'start_monitor':
+                rules = command.get('rules') or [{
+                    'target_group_id': command['target_group_id'],
+                    'keywords': command['keywords'],
+                    'messages': command['messages'],
+                    'interval': command.get('interval', 1)
+                }]
+                base = {key: value for key, value in command.items() if key not in ('request_id', 'rules')}
+                self._monitor_snapshot = {
+                    'base': base,
+                    'rules': [dict(rule, rule_id=rule_id) for rule, rule_id in zip(rules, rule_ids)]
+                }
+                return
+            
+            snapshot = self._monitor_snapshot
+            if snapshot is None:
+                # 未监听时的 update_rules 以空规则表开始监听
+                base = {key: value for key, value in command.items() if key in ('type', 'normalize', 'send_limits')}
+                snapshot = {'base': base, 'rules': []}
+            
+            removed = set(command.get('remove') or []) | set(command.get('evict') or [])
+            rules = [rule for rule in snapshot['rules'] if rule['rule_id'] not in removed]
+            positions = {rule['rule_id']: index for index, rule in enumerate(rules)}
+            for rule, rule_id in zip(command.get('upsert') or [], rule_ids):
+                stored = dict(rule, rule_id=rule_id)
+                index = positions.get(rule_id)
+                # 同一群聊内原位替换，换群聊时移到末尾（与工作进程中的顺序一致）
+                if index is not None and rules[index]['target_group_id'] == rule['target_group_id']:
+                    rules[index] = stored
+                    continue
+                if index is not None:
+                    rules[index] = None
+                positions[rule_id] = len(rules)
+                rules.append(stored)
+            snapshot['rules'] = [rule for rule in rules if rule is not None]
+            self._monitor_snapshot = snapshot
+    
+    def _monitor_replay_command(self) -> Optional[Dict[str, Any]]:
+        """把当前监听配置转换为一条重放命令（没有规则时不需要重放）"""
+        snapshot = self._monitor_snapshot
+        if snapshot is None or not snapshot['rules']:
             return None
+        base = snapshot['base']
+        request_id = f"{self.session_name}-{next(self._request_ids)}"
+        if base['type'] == 'start_monitor':
+            return dict(base, rules=list(snapshot['rules']), request_id=request_id)
+        return dict(base, upsert=list(snapshot['rules']), request_id=request_id)
     
-    def check_results(self):
-        """检查所有待处理结果"""
-        results = []
+    def _replay_commands(self, unread: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """重启后要按顺序发给新进程的命令
+        
+        先连接（会话文件保存了登录状态），再重放已确认生效的监听配置（一条命令），
+        最后是还在等待响应或还没被读取的命令（按发出顺序）。登录相关的命令直接让请求失败。
+        """
+        replay = [{'type': 'connect', 'request_id': f"{self.session_name}-{next(self._request_ids)}"}]
+        monitor = self._monitor_replay_command()
+        if monitor is not None:
+            replay.append(monitor)
+        with self._pending_lock:
+            inflight = list(self._inflight.values())
+        
+        seen = set()
+        for command in inflight + unread:
+            key = command.get('request_id') or id(command)
+            if key in seen:
+                continue
+            seen.add(key)
+            if command.get('type') in NO_REPLAY_COMMANDS:
+                if command.get('request_id') is not None:
+                    self._fail_request(command['request_id'])
+                continue
+            replay.append(command)
+        return replay
+    
+    def _finish_recovery(self, recovery: Dict[str, Any]):
+        """新进程处理完重放的命令，记录恢复耗时（在响应读取线程中调用）"""
+        self._recovery = None
+        now = time.time()
+        record = {
+            'type': 'worker_restarted',
+            'reason': recovery['reason'],
+            'error': recovery['detail'],
+            'replayed': recovery['replayed'],
+            # 从最后一次心跳到恢复监听，即实际的停机时间
+            'downtime': round(now - recovery['last_heartbeat'], 3),
+            # 从发现异常到恢复
+            'recovery_seconds': round(now - recovery['detected_at'], 3),
+            'ts': now
+        }
+        self.last_recovery = record
+        self.metrics.observe('tgmon_worker_recovery_seconds', record['downtime'])
+        logger.info(f"工作进程已恢复，停机 {record['downtime']} 秒")
+        self._dispatch_result(record)
+    
+    def add_result_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """注册结果监听者，每条结果到达时在读取线程中调用"""
+        self._result_listeners.append(listener)
+    
+    def remove_result_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """移除结果监听者"""
+        if listener in self._result_listeners:
+            self._result_listeners.remove(listener)
+    
+    def _read_results(self, result_queue):
+        """结果读取线程：结果一到达就分发给所有监听者"""
         while True:
-            result = self.get_result(timeout=0)
+            try:
+                result = result_queue.get(timeout=READER_POLL_INTERVAL)
+            except Empty:
+                if result_queue is not self.result_queue:
+                    break
+                continue
+            except (EOFError, OSError):
+                break
             if result is None:
                 break
-            results.append(result)
+            
+            # 指标快照和状态只保存最新的一份，不进入结果缓冲区
+            if result.get('type') == 'metrics':
+                self.worker_metrics = result
+                continue
+            if result.get('type') == 'worker_state':
+                self.worker_state = result
+                logger.info(f"工作进程状态: 已连接 {result['connected']}，已登录 {result['authorized']}")
+                continue
+            
+            if 'ts' in result:
+                self.metrics.observe('tgmon_result_delivery_seconds', max(0.0, time.time() - result['ts']))
+            self._dispatch_result(result)
+    
+    def _dispatch_result(self, result: Dict[str, Any]):
+        """结果写入缓冲区并分发给所有监听者"""
+        self.results.append(result)
+        logger.info(f"收到结果: {result.get('type')}")
+        
+        for listener in list(self._result_listeners):
+            try:
+                listener(result)
+            except Exception as e:
+                logger.error(f"结果监听者异常: {e}")
+    
+    def metrics_snapshots(self) -> List[Tuple[Dict[str, Any], Dict[str, List]]]:
+        """返回 (附加标签, 快照) 列表：主进程一侧的指标和工作进程最近推送的指标"""
+        metrics = self.metrics
+        metrics.set('tgmon_worker_up', int(bool(
+            self.is_running and self.worker_process and self.worker_process.is_alive()
+        )))
+        if self.is_running and self.heartbeat.value:
+            metrics.set('tgmon_worker_heartbeat_age_seconds', max(0.0, time.time() - self.heartbeat.value))
+        queues = [('command', self.command_queue), ('response', self.response_queue)]
+        if isinstance(self.result_queue, ShmResultQueue):
+            # 共享内存在 stop 后已释放
+            if self.is_running:
+                queues.append(('result', self.result_queue))
+                metrics.set('tgmon_result_ring_dropped', self.result_queue.dropped)
+        else:
+            queues.append(('result', self.result_queue))
+        for name, ipc_queue in queues:
+            try:
+                metrics.set('tgmon_ipc_queue_depth', ipc_queue.qsize(), queue=name)
+            except NotImplementedError:
+                # macOS 不支持 multiprocessing.Queue.qsize
+                pass
+        
+        snapshots = [({}, metrics.snapshot())]
+        if self.worker_metrics is not None:
+            age = max(0.0, time.time() - self.worker_metrics['ts'])
+            snapshot = dict(self.worker_metrics['metrics'])
+            snapshot['gauges'] = snapshot['gauges'] + [['tgmon_metrics_snapshot_age_seconds', {}, age]]
+            snapshots.append(({}, snapshot))
+        return snapshots
+    
+    def read_results(self, since: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """从指定序号之后读取结果，不影响其他读取方
+        
+        Args:
+            since: 已读到的序号（0 表示从缓冲区最旧的结果开始）
+            limit: 最多返回的条数
+        """
+        results, cursor, missed = self.results.since(since, limit)
+        return {'results': results, 'next': cursor, 'missed': missed}
+    
+    def get_result(self, timeout: float = 0.1) -> Optional[Dict[str, Any]]:
+        """获取下一条结果（check_results 使用的读取位置）"""
+        results, cursor, _ = self.results.since(self._results_cursor, 1)
+        if not results and timeout > 0 and self.results.wait(self._results_cursor, timeout):
+            results, cursor, _ = self.results.since(self._results_cursor, 1)
+        self._results_cursor = cursor
+        return results[0] if results else None
+    
+    def check_results(self):
+        """检查所有待处理结果"""
+        results, self._results_cursor, _ = self.results.since(self._results_cursor, self.results.capacity)
         return results
     
     def clear_results(self):
-        """清空结果列表"""
-        self.results = []
-        while not self.result_queue.empty():
-            try:
-                self.result_queue.get(timeout=0.1)
-            except Empty:
-                break
+        """清空结果缓冲区"""
+        self.results.clear()
+        self._results_cursor = self.results.last_seq
     
     @staticmethod
-    def _worker_target(api_id, api_hash, command_queue, response_queue, result_queue):
+    def _worker_target(api_id, api_hash, command_queue, response_queue, result_queue,
+                       session_name='telegram_session', heartbeat=None):
         """工作进程目标函数"""
         from .telegram_client import telegram_worker_process
         
         try:
             telegram_worker_process(api_id, api_hash, 
-                                   command_queue, response_queue, result_queue)
+                                   command_queue, response_queue, result_queue,
+                                   session_name, heartbeat)
         except Exception as e:
             logger.error(f"工作进程异常: {e}")
         finally:
@@ -0,0 +1,107 @@
+"""
+性能分析 - 在工作进程内按需采样调用栈或运行 cProfile
+只在收到 profile 命令后运行指定的秒数，未运行时没有任何开销
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+MODES = ('sample', 'cprofile')
+
+# 返回的不同调用栈数量上限，避免响应过大
+MAX_STACKS = 5000
+
+# 采样间隔范围（秒），过小时采样线程会持续占用 CPU 和 GIL
+MIN_INTERVAL = 0.001
+MAX_INTERVAL = 1.0
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """调用栈采样器
+
+    在单独的线程中按固定间隔读取目标线程的当前调用栈，统计为折叠栈（collapsed stacks），
+    可以直接交给 flamegraph.pl / speedscope 生成火焰图。
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005):
+        """
+        Args:
+            thread_id: 被采样的线程，默认为调用 start() 的线程（事件循环所在线程）
+            interval: 采样间隔（秒），需在 MIN_INTERVAL~MAX_INTERVAL 之间
+        """
+        if not MIN_INTERVAL <= interval <= MAX_INTERVAL:
+            raise ValueError(f"采样间隔需在 {MIN_INTERVAL}~{MAX_INTERVAL} 秒之间")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self._stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """折叠栈文本，每行为 "外层;...;内层 次数"，按次数降序"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self._stacks.most_common(MAX_STACKS))
+
+
+class FunctionProfiler:
+    """基于 cProfile 的确定性分析，统计事件循环线程中每个函数的调用次数和耗时"""
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def top(self, limit: int = 50, sort: str = 'cumulative') -> List[Dict[str, Any]]:
+        """按累计耗时排序的函数列表"""
+        stats = pstats.Stats(self._profile, stream=io.StringIO())
+        stats.sort_stats(sort)
+        rows = []
+        for func in stats.fcn_list[:limit]:
+            primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[func]
+            filename, line, name = func
+            rows.append({
+                'function': f"{name} ({os.path.basename(filename)}:{line})",
+                'calls': calls,
+                'primitive_calls': primitive_calls,
+                'tottime': round(total_time, 6),
+                'cumtime': round(cumulative_time, 6)
+            })
+        return rows
@@ -0,0 +1,100 @@
+"""
+结果广播中心 - 把工作进程的结果推送给所有 WebSocket 订阅者
+每个订阅者有独立的有界缓冲区，慢客户端不会拖慢其他客户端，也不会无限占用内存
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 溢出策略
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class Subscriber:
+    """单个订阅者的有界缓冲区
+
+    缓冲区满时按策略丢弃结果并计数；发送时把积压的结果合并成一批。
+    """
+
+    def __init__(self, maxsize: int = 256, policy: str = DROP_OLDEST):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"未知的溢出策略: {policy}")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.buffer: deque = deque()
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def push(self, result: Dict[str, Any]):
+        """放入一条结果（在事件循环线程中调用，不会阻塞）"""
+        if len(self.buffer) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return
+            self.buffer.popleft()
+        self.buffer.append(result)
+        self._ready.set()
+
+    async def get(self) -> Tuple[List[Dict[str, Any]], int]:
+        """等待并取出所有积压的结果
+
+        Returns:
+            (结果列表, 自上次取出以来丢弃的数量)
+        """
+        await self._ready.wait()
+        results = list(self.buffer)
+        self.buffer.clear()
+        dropped, self.dropped = self.dropped, 0
+        self._ready.clear()
+        return results, dropped
+
+
+class ResultHub:
+    """结果广播中心"""
+
+    def __init__(self, maxsize: int = 256, policy: str = DROP_OLDEST):
+        """
+        Args:
+            maxsize: 每个订阅者最多缓存的结果数
+            policy: 缓冲区满时的策略（drop_oldest / drop_newest）
+        """
+        self.maxsize = maxsize
+        self.policy = policy
+        self.subscribers: Set[Subscriber] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """绑定 API 进程的事件循环，读取线程通过它投递结果"""
+        self._loop = loop
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.maxsize, self.policy)
+        self.subscribers.add(subscriber)
+        logger.info(f"新增订阅者，当前 {len(self.subscribers)} 个")
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        logger.info(f"订阅者已断开，当前 {len(self.subscribers)} 个")
+
+    def publish(self, result: Dict[str, Any]):
+        """把结果推送给所有订阅者（在事件循环线程中调用）"""
+        for subscriber in self.subscribers:
+            subscriber.push(result)
+
+    def publish_threadsafe(self, result: Dict[str, Any]):
+        """供结果读取线程调用的结果监听者"""
+        loop = self._loop
+        if loop is None or not self.subscribers:
+            return
+        try:
+            loop.call_soon_threadsafe(self.publish, result)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
@@ -0,0 +1,86 @@
+"""
+结果环形缓冲区 - 固定容量，按单调递增的序号读取
+多个客户端可以各自从自己的位置读取同一个结果流，内存占用恒定
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ResultRing:
+    """固定容量的结果环形缓冲区
+
+    每条结果写入时分配序号 seq（从 1 开始），容量满后覆盖最旧的结果。
+    """
+
+    def __init__(self, capacity: int = 1000):
+        """
+        Args:
+            capacity: 最多保留的结果数量
+        """
+        if capacity < 1:
+            raise ValueError("容量至少为 1")
+
+        self.capacity = capacity
+        self._buffer: List[Optional[Dict[str, Any]]] = [None] * capacity
+        # 下一条结果的序号
+        self._next_seq = 1
+        # 最旧的可读序号（clear 后会前移）
+        self._first_seq = 1
+        self._changed = threading.Condition()
+
+    def __len__(self) -> int:
+        return self._next_seq - self._first_seq
+
+    @property
+    def last_seq(self) -> int:
+        """最新一条结果的序号，没有结果时为 0"""
+        return self._next_seq - 1
+
+    @property
+    def first_seq(self) -> int:
+        """仍在缓冲区中的最旧序号"""
+        return self._first_seq
+
+    def append(self, result: Dict[str, Any]) -> int:
+        """写入一条结果，并把序号记录到结果的 seq 字段"""
+        with self._changed:
+            seq = self._next_seq
+            result['seq'] = seq
+            self._buffer[seq % self.capacity] = result
+            self._next_seq = seq + 1
+            self._first_seq = max(self._first_seq, self._next_seq - self.capacity)
+            self._changed.notify_all()
+        return seq
+
+    def since(self, seq: int, limit: int = 100) -> Tuple[List[Dict[str, Any]], int, int]:
+        """读取序号大于 seq 的结果
+
+        Args:
+            seq: 客户端已读到的序号（0 表示从头读）
+            limit: 最多返回的条数
+
+        Returns:
+            (结果列表, 下次读取使用的序号, 已被覆盖而错过的条数)
+        """
+        with self._changed:
+            if seq >= self._next_seq:
+                # 客户端的位置比缓冲区还新（例如服务重启过），从头读取
+                seq = 0
+            start = max(seq + 1, self._first_seq)
+            end = min(self._next_seq, start + max(limit, 0))
+            results = [self._buffer[i % self.capacity] for i in range(start, end)]
+            missed = start - (seq + 1)
+        cursor = end - 1 if end > start else max(seq, start - 1)
+        return results, cursor, missed
+
+    def wait(self, seq: int, timeout: float) -> bool:
+        """等待序号大于 seq 的结果出现"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self._next_seq - 1 > seq, timeout)
+
+    def clear(self):
+        """丢弃当前所有结果（序号继续递增）"""
+        with self._changed:
+            for i in range(self._first_seq, self._next_seq):
+                self._buffer[i % self.capacity] = None
+            self._first_seq = self._next_seq
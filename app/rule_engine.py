@@ -0,0 +1,312 @@
+"""
+规则引擎 - 把一个群聊的所有规则编译成一个匹配器
+消息文本只规范化一次（全角/半角、大小写、繁简），所有关键字在一次扫描中找出，
+再按每条规则的布尔表达式判断是否命中
+
+表达式语法:
+    价格 & !广告            同时包含“价格”且不包含“广告”
+    (招聘 | 求职) 远程      相邻的条件默认为 AND
+    "hello world" OR 你好   引号内为完整短语，AND/OR/NOT 与 & | ! 等价
+    /\\d{11}/               斜杠内为正则表达式
+
+正则表达式匹配的是规范化后的文本，编译时其中的非 ASCII 字面字符也会同样规范化
+（如 /價格\\d+/ 等价于 /价格\\d+/），ASCII 字母的大小写由 IGNORECASE 处理。
+"""
+import re
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from .keyword_matcher import KeywordMatcher
+
+try:
+    import opencc
+    _t2s_converter = opencc.OpenCC('t2s')
+except Exception:
+    _t2s_converter = None
+
+# 常用繁体字 -> 简体字（未安装 opencc 时使用）
+_T2S_PAIRS = (
+    "與与 個个 們们 來来 這这 時时 說说 會会 對对 國国 學学 過过 還还 後后 開开 關关 機机 發发 問问 "
+    "當当 經经 現现 種种 樣样 點点 實实 動动 電电 話话 讓让 進进 業业 長长 門门 間间 錢钱 買买 賣卖 "
+    "價价 貨货 費费 號号 碼码 網网 絡络 聯联 繫系 資资 訊讯 軟软 體体 質质 無无 為为 麼么 嗎吗 見见 "
+    "覺觉 頭头 車车 馬马 鳥鸟 魚鱼 東东 陽阳 陰阴 萬万 億亿 戶户 帳账 賬账 務务 員员 團团 圖图 書书 "
+    "寫写 讀读 認认 識识 語语 請请 謝谢 歡欢 愛爱 親亲 區区 廣广 場场 報报 紙纸 線线 紅红 綠绿 藍蓝 "
+    "黃黄 幣币 銀银 鐵铁 測测 試试 驗验 優优 紹绍 總总 計计 劃划 從从 眾众 衆众 氣气 漢汉 華华 臺台 "
+    "灣湾 兩两 處处 辦办 變变 頁页 視视 頻频 節节 樂乐 飛飞 應应 該该 讚赞 轉转 帶带 壓压 鬆松 舊旧 "
+    "據据 隻只 單单 雙双 順顺 顏颜 題题 類类 願愿 風风 飯饭 館馆 協协 約约 級级 紀纪 結结 給给 統统 "
+    "絕绝 維维 編编 練练 繼继 續续 條条 錯错 鍵键 準准 減减 溫温 滿满 潔洁 濟济 災灾 燈灯 獲获 環环 "
+    "產产 畫画 異异 療疗 盡尽 監监 盤盘 禮礼 稱称 穩稳 窮穷 競竞 筆笔 範范 簡简 糧粮 緊紧 聲声 聽听 "
+    "腦脑 臉脸 蘋苹 蟲虫 術术 衛卫 補补 製制 複复 規规 訂订 記记 設设 許许 論论 證证 評评 詞词 詢询 "
+    "詳详 誤误 調调 談谈 議议 護护 豐丰 貝贝 負负 財财 責责 貼贴 貴贵 貸贷 賠赔 賺赚 賽赛 趕赶 跡迹 "
+    "蹤踪 軍军 輕轻 輸输 辭辞 農农 運运 遊游 達达 違违 遠远 適适 選选 遺遗 邊边 郵邮 鄉乡 醫医 釋释 "
+    "針针 鈔钞 鏈链 閱阅 陳陈 陸陆 隊队 際际 隨随 險险 雜杂 難难 雲云 靜静 響响 項项 須须 預预 領领 "
+    "額额 飲饮 餘余 駕驾 髮发 鬥斗 齊齐 龍龙 廠厂 僅仅 傳传 儲储 兌兑 勞劳 勢势 匯汇 參参 嚴严 備备 "
+    "寶宝 將将 專专 導导 屬属 歲岁 幫帮 庫库 彈弹 徵征 復复 惡恶 懷怀 戰战 擇择 擊击 擔担 攝摄 數数 "
+    "斷断 舉举 艦舰 藥药 贏赢 鍋锅 闆板 陣阵"
+)
+_T2S_TABLE = {ord(pair[0]): pair[1] for pair in _T2S_PAIRS.split()}
+
+
+def normalize(text: str) -> str:
+    """规范化文本：全角转半角（NFKC）、大小写折叠、繁体转简体"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    if _t2s_converter is not None:
+        return _t2s_converter.convert(text)
+    return text.translate(_T2S_TABLE)
+
+
+def normalize_pattern(pattern: str) -> str:
+    """规范化正则表达式中的非 ASCII 字面字符，使其能匹配规范化后的文本
+
+    转义序列和 ASCII 字符（语法字符、分组名、标志）保持不变。
+    字符类外规范化后变成多个字符时（如 ㎏ -> kg）包在非捕获分组中，保证后面的量词仍作用于整体；
+    字符类内只替换规范化后仍是单个字符的字面字符。
+    """
+    output = []
+    in_class = False
+    # 字符类内容的起始位置，紧跟 [ 或 [^ 的 ] 是字面字符
+    class_start = 0
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            output.append(pattern[index:index + 2])
+            index += 2
+            continue
+        if char == '[' and not in_class:
+            in_class = True
+            class_start = index + 1
+            if pattern[class_start:class_start + 1] == '^':
+                class_start += 1
+        elif char == ']' and in_class and index > class_start:
+            in_class = False
+        elif ord(char) > 127:
+            normalized = normalize(char)
+            if len(normalized) == 1:
+                char = normalized
+            elif not in_class and normalized:
+                char = f"(?:{re.escape(normalized)})"
+        output.append(char)
+        index += 1
+    return ''.join(output)
+
+
+# ---------------------------------------------------------------- 表达式解析
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<lparen>\() |
+        (?P<rparen>\)) |
+        (?P<and>&) |
+        (?P<or>\|) |
+        (?P<not>!) |
+        "(?P<phrase>(?:[^"\\]|\\.)*)" |
+        /(?P<regex>(?:[^/\\]|\\.)+)/ |
+        (?P<word>[^\s()&|!"]+)
+    )
+''', re.VERBOSE)
+
+_KEYWORD_OPERATORS = {'AND': 'and', 'OR': 'or', 'NOT': 'not'}
+
+
+def _tokenize(expression: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"表达式语法错误（位置 {position}）: {expression}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value in _KEYWORD_OPERATORS:
+            kind = _KEYWORD_OPERATORS[value]
+        elif kind == 'phrase':
+            kind, value = 'word', re.sub(r'\\(.)', r'\1', value)
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    """递归下降解析，生成 ('term', 文本) / ('regex', 模式) / ('and'|'or', [子节点]) / ('not', 子节点)"""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def _error(self, message: str):
+        raise ValueError(f"{message}: {self.expression}")
+
+    def parse(self):
+        if not self.tokens:
+            self._error("表达式为空")
+        node = self._or()
+        if self.position != len(self.tokens):
+            self._error("多余的右括号或运算符")
+        return node
+
+    def _or(self):
+        nodes = [self._and()]
+        while self._peek() == 'or':
+            self.position += 1
+            nodes.append(self._and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def _and(self):
+        nodes = [self._not()]
+        while self._peek() in ('and', 'not', 'lparen', 'word', 'regex'):
+            if self._peek() == 'and':
+                self.position += 1
+            nodes.append(self._not())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def _not(self):
+        if self._peek() == 'not':
+            self.position += 1
+            return ('not', self._not())
+        return self._atom()
+
+    def _atom(self):
+        kind = self._peek()
+        if kind is None:
+            self._error("表达式不完整")
+        value = self.tokens[self.position][1]
+        self.position += 1
+        if kind == 'lparen':
+            node = self._or()
+            if self._peek() != 'rparen':
+                self._error("缺少右括号")
+            self.position += 1
+            return node
+        if kind == 'word':
+            return ('term', value)
+        if kind == 'regex':
+            return ('regex', value)
+        self._error(f"意外的符号 {value!r}")
+
+
+def parse_expression(expression: str):
+    """解析规则表达式，语法错误时抛出 ValueError"""
+    return _Parser(expression).parse()
+
+
+# ---------------------------------------------------------------- 编译与匹配
+
+# 编译后的条件: (命中的关键字编号集合, 正则求值函数) -> bool
+Predicate = Callable[[Set[int], Callable[[int], bool]], bool]
+
+
+class RuleSet:
+    """一个群聊的全部规则编译成的匹配器
+
+    所有规则的关键字合并成一个 Aho-Corasick 自动机，每条消息只扫描一次；
+    每个不同的正则在一条消息上最多执行一次，且只在表达式需要时执行。
+    """
+
+    def __init__(self, rules: Sequence[Dict[str, Any]], normalize_text: bool = True):
+        """
+        Args:
+            rules: 规则列表，每条规则可包含 keywords（任一命中即可）和 expression（布尔表达式），
+                   两者同时配置时都需满足
+            normalize_text: 是否规范化消息和关键字
+        """
+        self.rules = list(rules)
+        self.normalize_text = normalize_text
+
+        self._terms: Dict[str, int] = {}
+        self._regexes: Dict[str, int] = {}
+        # 每条规则: (条件, 用于报告的关键字编号 -> 原始关键字)
+        self._compiled: List[Tuple[Predicate, Dict[int, str]]] = []
+
+        for rule in self.rules:
+            self._compiled.append(self._compile_rule(rule))
+
+        self._matcher = KeywordMatcher(self._terms)
+        self._patterns = [
+            re.compile(pattern, re.IGNORECASE) for pattern in self._regexes
+        ]
+
+    def _prepare(self, text: str) -> str:
+        return normalize(text) if self.normalize_text else text
+
+    def _term_id(self, term: str) -> int:
+        return self._terms.setdefault(self._prepare(term), len(self._terms))
+
+    def _compile_rule(self, rule: Dict[str, Any]) -> Tuple[Predicate, Dict[int, str]]:
+        reported: Dict[int, str] = {}
+        predicates: List[Predicate] = []
+
+        keywords = rule.get('keywords') or []
+        if keywords:
+            ids = []
+            for keyword in keywords:
+                term_id = self._term_id(keyword)
+                reported.setdefault(term_id, keyword)
+                ids.append(term_id)
+            keyword_ids = frozenset(ids)
+            predicates.append(lambda hits, regex, ids=keyword_ids: not hits.isdisjoint(ids))
+
+        expression = rule.get('expression')
+        if expression:
+            predicates.append(self._compile_node(parse_expression(expression), reported))
+
+        if not predicates:
+            raise ValueError(f"规则 {rule.get('rule_id')} 没有关键字或表达式")
+        if len(predicates) == 1:
+            return predicates[0], reported
+        first, second = predicates
+        return (lambda hits, regex: first(hits, regex) and second(hits, regex)), reported
+
+    def _compile_node(self, node, reported: Dict[int, str]) -> Predicate:
+        kind = node[0]
+        if kind == 'term':
+            term_id = self._term_id(node[1])
+            reported.setdefault(term_id, node[1])
+            return lambda hits, regex: term_id in hits
+        if kind == 'regex':
+            pattern = normalize_pattern(node[1]) if self.normalize_text else node[1]
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"正则表达式错误 /{node[1]}/: {e}")
+            regex_id = self._regexes.setdefault(pattern, len(self._regexes))
+            return lambda hits, regex: regex(regex_id)
+        if kind == 'not':
+            inner = self._compile_node(node[1], {})
+            return lambda hits, regex: not inner(hits, regex)
+        children = [self._compile_node(child, reported) for child in node[1]]
+        if kind == 'and':
+            return lambda hits, regex: all(child(hits, regex) for child in children)
+        return lambda hits, regex: any(child(hits, regex) for child in children)
+
+    def match(self, text: str) -> List[Tuple[Dict[str, Any], List[str]]]:
+        """返回命中的规则及其命中的关键字（按规则顺序）"""
+        rules = self.rules
+        return [(rules[index], keywords) for index, keywords in self.match_indices(text)]
+
+    def match_indices(self, text: str) -> List[Tuple[int, List[str]]]:
+        """返回命中规则的下标及其命中的关键字，结果可以跨进程传递"""
+        text = self._prepare(text)
+
+        term_ids = self._terms
+        hits = {term_ids[term] for term in self._matcher.find(text)}
+
+        regex_cache: Dict[int, bool] = {}
+        patterns = self._patterns
+
+        def regex(regex_id: int) -> bool:
+            result = regex_cache.get(regex_id)
+            if result is None:
+                result = regex_cache[regex_id] = patterns[regex_id].search(text) is not None
+            return result
+
+        matched = []
+        for index, (predicate, reported) in enumerate(self._compiled):
+            if predicate(hits, regex):
+                matched.append((index, [keyword for term_id, keyword in reported.items() if term_id in hits]))
+        return matched
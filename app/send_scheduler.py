@@ -0,0 +1,311 @@
+"""
+发送调度器 - 与消息处理解耦的限速发送队列
+全局和每个群聊各有一个令牌桶；触发 FloodWait 时全局暂停；群聊之间按优先级出队，群聊内先进先出
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from telethon.errors import FloodWaitError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 数字越小优先级越高
+DEFAULT_PRIORITY = 10
+
+DEFAULT_LIMITS = {
+    'global_rate': 3.0,    # 全局每秒发送数
+    'global_burst': 5,     # 全局突发上限
+    'chat_rate': 1.0,      # 单个群聊每秒发送数
+    'chat_burst': 3,       # 单个群聊突发上限
+}
+
+# 调度循环出错后重新开始前的等待时间（秒）
+ERROR_RETRY_DELAY = 1.0
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """距离有可用令牌还需等待的秒数"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class SendJob:
+    """一次触发对应的回复序列，按顺序逐条发送"""
+
+    __slots__ = ('chat_id', 'messages', 'interval', 'priority', 'meta', 'index', 'seq')
+
+    def __init__(self, chat_id: int, messages: List[str], interval: float,
+                 priority: int, meta: Dict[str, Any], seq: int):
+        self.chat_id = chat_id
+        self.messages = messages
+        self.interval = interval
+        self.priority = priority
+        self.meta = meta
+        self.index = 0
+        self.seq = seq
+
+    @property
+    def text(self) -> str:
+        return self.messages[self.index]
+
+
+class SendScheduler:
+    """限速发送调度器
+
+    submit() 只入队并立即返回；由单独的任务按令牌桶节奏发送。
+    每个群聊一个先进先出队列，只有队首的回复序列参与调度，发完整个序列后才轮到下一个，
+    所以同一个群聊的回复不会交错；优先级只决定不同群聊之间的先后。
+    某个群聊被限速时不影响其他群聊。
+    """
+
+    def __init__(self, send: Callable[[int, str], Awaitable[Any]],
+                 on_sent: Optional[Callable[[SendJob, str], None]] = None,
+                 on_error: Optional[Callable[[SendJob, str, Exception], None]] = None,
+                 on_flood_wait: Optional[Callable[[int], None]] = None,
+                 **limits):
+        """
+        Args:
+            send: 实际发送函数 send(chat_id, text)
+            on_sent: 发送成功回调
+            on_error: 发送失败回调（FloodWait 除外）
+            on_flood_wait: 触发 FloodWait 时的回调，参数为等待秒数
+            limits: 覆盖 DEFAULT_LIMITS 中的限速参数
+        """
+        self.send = send
+        self.on_sent = on_sent
+        self.on_error = on_error
+        self.on_flood_wait = on_flood_wait
+
+        self.limits = dict(DEFAULT_LIMITS)
+        self.global_bucket = TokenBucket(1, 1)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.configure(**limits)
+
+        self._seq = itertools.count()
+        # 每个群聊的任务队列，队首是正在发送的任务
+        self._queues: Dict[int, Deque[SendJob]] = {}
+        # 可以发送的队首任务: (优先级, 序号, 任务)
+        self._ready: List[Tuple[int, int, SendJob]] = []
+        # 等待消息间隔或单群聊限速的队首任务: (可发送时间, 序号, 任务)
+        self._waiting: List[Tuple[float, int, SendJob]] = []
+        # 带延迟提交、到期后才进入群聊队列的任务: (到期时间, 序号, 任务)
+        self._delayed: List[Tuple[float, int, SendJob]] = []
+
+        self.paused_until = 0.0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.sent = 0
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def configure(self, **limits):
+        """更新限速参数"""
+        unknown = set(limits) - set(DEFAULT_LIMITS)
+        if unknown:
+            raise ValueError(f"未知的限速参数: {', '.join(sorted(unknown))}")
+        for key, value in limits.items():
+            if value is not None and value <= 0:
+                raise ValueError(f"限速参数 {key} 必须大于 0")
+        self.limits.update({key: value for key, value in limits.items() if value is not None})
+        self.global_bucket = TokenBucket(self.limits['global_rate'], self.limits['global_burst'])
+        self.chat_buckets = {}
+
+    @property
+    def pending(self) -> int:
+        """排队中的任务数"""
+        return len(self._delayed) + sum(len(queue) for queue in self._queues.values())
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止调度并丢弃未发送的任务"""
+        self.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def clear(self):
+        self._queues.clear()
+        self._ready.clear()
+        self._waiting.clear()
+        self._delayed.clear()
+
+    def submit(self, chat_id: int, messages: List[str], interval: float = 0,
+               priority: int = DEFAULT_PRIORITY, delay: float = 0, **meta) -> Optional[SendJob]:
+        """提交一个回复序列（不等待发送）
+
+        Args:
+            chat_id: 目标群聊
+            messages: 按顺序发送的消息
+            interval: 相邻两条消息的最小间隔（秒）
+            priority: 优先级，数字越小越先发送（只在不同群聊之间比较）
+            delay: 第一条消息的延迟（秒）
+            meta: 附加信息，会传给回调（如 rule_id）
+        """
+        if not messages:
+            return None
+        job = SendJob(chat_id, list(messages), interval, priority, meta, next(self._seq))
+        if delay > 0:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, job.seq, job))
+        else:
+            self._enqueue(job)
+        self._wakeup.set()
+        return job
+
+    def _enqueue(self, job: SendJob):
+        """放到群聊队列末尾，队列原本为空时直接可以发送"""
+        queue = self._queues.get(job.chat_id)
+        if queue is None:
+            self._queues[job.chat_id] = deque([job])
+            heapq.heappush(self._ready, (job.priority, job.seq, job))
+        else:
+            queue.append(job)
+
+    def _finish(self, job: SendJob):
+        """队首任务发送完毕，下一个任务成为队首"""
+        queue = self._queues[job.chat_id]
+        queue.popleft()
+        if queue:
+            head = queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, head))
+        else:
+            del self._queues[job.chat_id]
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.limits['chat_rate'], self.limits['chat_burst'])
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _promote(self, now: float):
+        """把到期的延迟任务放入群聊队列，把等待结束的队首任务放回可发送队列"""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, job = heapq.heappop(self._delayed)
+            self._enqueue(job)
+
+        while self._waiting and self._waiting[0][0] <= now:
+            _, _, job = heapq.heappop(self._waiting)
+            heapq.heappush(self._ready, (job.priority, job.seq, job))
+
+    def _next_wakeup(self, now: float) -> Optional[float]:
+        times = []
+        if self._delayed:
+            times.append(self._delayed[0][0])
+        if self._waiting:
+            times.append(self._waiting[0][0])
+        return max(0.0, min(times) - now) if times else None
+
+    async def _sleep(self, timeout: Optional[float]):
+        """等待超时或有新任务提交"""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                await self._step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 单次出错不能让调度任务退出，否则之后的回复都不会再发送
+                logger.error(f"发送调度出错: {e}", exc_info=True)
+                await asyncio.sleep(ERROR_RETRY_DELAY)
+
+    async def _step(self):
+        """调度一次：等待、挡住或发送一条消息"""
+        now = time.monotonic()
+        self._promote(now)
+
+        if self.paused_until > now:
+            await asyncio.sleep(self.paused_until - now)
+            return
+
+        if not self._ready:
+            await self._sleep(self._next_wakeup(now))
+            return
+
+        wait = self.global_bucket.delay(now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+            return
+
+        _, _, job = heapq.heappop(self._ready)
+
+        # 只有队首任务在可发送队列中，被单群聊限速挡住时该群聊的其他任务也在等待
+        wait = self._chat_bucket(job.chat_id).delay(now)
+        if wait > 0:
+            heapq.heappush(self._waiting, (now + wait, job.seq, job))
+            return
+
+        self.global_bucket.consume(now)
+        self._chat_bucket(job.chat_id).consume(now)
+        await self._send(job)
+
+    async def _send(self, job: SendJob):
+        text = job.text
+        try:
+            await self.send(job.chat_id, text)
+        except FloodWaitError as e:
+            # 全局暂停，稍后重试同一条消息
+            logger.warning(f"触发了 Flood Wait: {e.seconds}秒，暂停所有发送")
+            self.paused_until = time.monotonic() + e.seconds
+            self.flood_waits += 1
+            self.flood_wait_seconds += e.seconds
+            heapq.heappush(self._ready, (job.priority, job.seq, job))
+            if self.on_flood_wait:
+                self.on_flood_wait(e.seconds)
+            return
+        except Exception as e:
+            logger.error(f"发送消息失败: {e}")
+            if self.on_error:
+                self.on_error(job, text, e)
+        else:
+            self.sent += 1
+            if self.on_sent:
+                self.on_sent(job, text)
+
+        # 同一序列的下一条消息在间隔之后发送，序列发完后轮到该群聊的下一个任务
+        job.index += 1
+        if job.index >= len(job.messages):
+            self._finish(job)
+        elif job.interval > 0:
+            heapq.heappush(self._waiting, (time.monotonic() + job.interval, job.seq, job))
+        else:
+            heapq.heappush(self._ready, (job.priority, job.seq, job))
@@ -0,0 +1,304 @@
+"""
+共享内存结果通道 - 用于替代 result_queue 的单生产者/单消费者环形缓冲区
+工作进程直接把紧凑的二进制记录写入共享内存，不经过 pickle、feeder 线程和管道
+"""
+import multiprocessing
+import pickle
+import queue
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional
+
+# ---------------------------------------------------------------- 记录编码
+
+KIND_PICKLE = 0
+KIND_MATCHED = 1
+KIND_SENT = 2
+KIND_ERROR = 3
+
+_MATCHED_KEYS = frozenset(('type', 'ts', 'chat_id', 'message_id', 'rule_id', 'keywords', 'text', 'suppressed'))
+_SENT_KEYS = frozenset(('type', 'ts', 'chat_id', 'rule_id', 'content'))
+_ERROR_KEYS = frozenset(('type', 'ts', 'chat_id', 'rule_id', 'error'))
+
+# 定长头中带各字符串的字节数，字符串依次紧跟在头后面；flags 标记 None 和 suppressed
+_MATCHED_HEAD = struct.Struct('<BdqqBIHII')  # kind, ts, chat_id, message_id, flags, rule_id, 关键字数, text, 关键字
+_SENT_HEAD = struct.Struct('<BdqBII')        # kind, ts, chat_id, flags, rule_id, content/error
+_U32 = struct.Struct('<I')
+
+_SUPPRESSED = 1
+_RULE_NONE = 2
+_TEXT_NONE = 4
+
+# 关键字以 NUL 连接，规范化后的关键字不会包含 NUL，包含时退回 pickle
+_SEP = '\0'
+
+
+def _utf8(value: Optional[str], none_flag: int):
+    if value is None:
+        return b'', none_flag
+    return value.encode('utf-8'), 0
+
+
+def encode_record(result: Dict[str, Any]) -> bytes:
+    """把一条结果编码为二进制记录
+
+    keyword_matched / message_sent / error 编码为定长头加 UTF-8 字符串，
+    字段或类型不符合预期的结果（以及其他类型）用 pickle，保证不丢信息。
+    """
+    try:
+        kind = result.get('type')
+        if kind == 'keyword_matched' and result.keys() == _MATCHED_KEYS:
+            keywords = result['keywords']
+            joined = _SEP.join(keywords)
+            if type(result['suppressed']) is bool and type(keywords) is list and \
+                    joined.count(_SEP) == max(len(keywords) - 1, 0):
+                rule, rule_flag = _utf8(result['rule_id'], _RULE_NONE)
+                text, text_flag = _utf8(result['text'], _TEXT_NONE)
+                keyword_bytes = joined.encode('utf-8')
+                flags = rule_flag | text_flag | (_SUPPRESSED if result['suppressed'] else 0)
+                return _MATCHED_HEAD.pack(
+                    KIND_MATCHED, result['ts'], result['chat_id'], result['message_id'], flags,
+                    len(rule), len(keywords), len(text), len(keyword_bytes)
+                ) + rule + text + keyword_bytes
+        elif kind == 'message_sent' and result.keys() == _SENT_KEYS or \
+                kind == 'error' and result.keys() == _ERROR_KEYS:
+            rule, rule_flag = _utf8(result['rule_id'], _RULE_NONE)
+            if kind == 'message_sent':
+                text, text_flag = _utf8(result['content'], _TEXT_NONE)
+                code = KIND_SENT
+            else:
+                text, text_flag = _utf8(result['error'], _TEXT_NONE)
+                code = KIND_ERROR
+            return _SENT_HEAD.pack(
+                code, result['ts'], result['chat_id'], rule_flag | text_flag, len(rule), len(text)
+            ) + rule + text
+    except (struct.error, TypeError, AttributeError):
+        pass
+    return bytes((KIND_PICKLE,)) + pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+
+
+def decode_record(data: bytes) -> Dict[str, Any]:
+    """encode_record 的逆操作"""
+    kind = data[0]
+    if kind == KIND_MATCHED:
+        _, ts, chat_id, message_id, flags, rule_size, count, text_size, keyword_size = \
+            _MATCHED_HEAD.unpack_from(data)
+        offset = _MATCHED_HEAD.size
+        rule_end = offset + rule_size
+        text_end = rule_end + text_size
+        keywords = data[text_end:text_end + keyword_size].decode('utf-8').split(_SEP) if count else []
+        return {
+            'type': 'keyword_matched', 'chat_id': chat_id, 'message_id': message_id,
+            'rule_id': None if flags & _RULE_NONE else data[offset:rule_end].decode('utf-8'),
+            'keywords': keywords,
+            'text': None if flags & _TEXT_NONE else data[rule_end:text_end].decode('utf-8'),
+            'suppressed': bool(flags & _SUPPRESSED), 'ts': ts
+        }
+    if kind in (KIND_SENT, KIND_ERROR):
+        _, ts, chat_id, flags, rule_size, text_size = _SENT_HEAD.unpack_from(data)
+        offset = _SENT_HEAD.size
+        rule_end = offset + rule_size
+        rule_id = None if flags & _RULE_NONE else data[offset:rule_end].decode('utf-8')
+        text = None if flags & _TEXT_NONE else data[rule_end:rule_end + text_size].decode('utf-8')
+        if kind == KIND_SENT:
+            return {'type': 'message_sent', 'chat_id': chat_id, 'rule_id': rule_id, 'content': text, 'ts': ts}
+        return {'type': 'error', 'chat_id': chat_id, 'rule_id': rule_id, 'error': text, 'ts': ts}
+    return pickle.loads(data[1:])
+
+
+# ---------------------------------------------------------------- 环形缓冲区
+
+# 头部布局：生产者和消费者写入的字段放在不同的缓存行
+_MAGIC = 0x54474d52
+_OFF_MAGIC = 0          # u32
+_OFF_CLOSED = 4         # u32，消费者或主进程设置
+_OFF_CAPACITY = 8       # u64
+_OFF_HEAD = 64          # u64，生产者写入位置（只增不减）
+_OFF_WRITTEN = 72       # u64，已写入的记录数
+_OFF_DROPPED = 80       # u64，缓冲区满时丢弃的记录数
+_OFF_TAIL = 128         # u64，消费者读取位置（只增不减）
+_OFF_READ = 136         # u64，已读取的记录数
+_OFF_WAITING = 144      # u32，消费者正在等待唤醒
+HEADER_SIZE = 192
+
+_U64 = struct.Struct('<Q')
+
+# 消费者等待时的最长休眠，兜底可能错过的唤醒
+WAKEUP_INTERVAL = 0.05
+
+
+class ShmResultQueue:
+    """基于共享内存的结果队列，接口与 multiprocessing.Queue 的 put/get/qsize 一致
+
+    - 只能有一个进程 put（工作进程）和一个进程 get（主进程的结果读取线程）
+    - 每条记录为 u32 长度 + encode_record 的输出，跨越缓冲区末尾时分两段拷贝
+    - 缓冲区满时丢弃新记录并计入 dropped，不阻塞工作进程的事件循环
+    - 消费者空闲时才通过信号量唤醒，繁忙时写入不需要任何系统调用
+    - put(None) 只设置关闭标记（可由任一进程调用），get 读完剩余记录后返回 None
+    """
+
+    def __init__(self, capacity: int = 4 * 1024 * 1024):
+        """
+        Args:
+            capacity: 数据区字节数
+        """
+        self.capacity = capacity
+        self._shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity)
+        self._owner = True
+        buf = self._shm.buf
+        buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        _U32.pack_into(buf, _OFF_MAGIC, _MAGIC)
+        _U64.pack_into(buf, _OFF_CAPACITY, capacity)
+        self._wakeup = multiprocessing.Semaphore(0)
+        self._head = 0
+        self._tail = 0
+        self._written = 0
+        self._dropped = 0
+
+    def __getstate__(self):
+        # spawn 方式启动工作进程时按名字重新连接共享内存
+        return {'name': self._shm.name, 'capacity': self.capacity, 'wakeup': self._wakeup}
+
+    def __setstate__(self, state):
+        self.capacity = state['capacity']
+        self._wakeup = state['wakeup']
+        self._shm = _attach(state['name'])
+        self._owner = False
+        self._head = self._get(_OFF_HEAD)
+        self._tail = self._get(_OFF_TAIL)
+        self._written = self._get(_OFF_WRITTEN)
+        self._dropped = self._get(_OFF_DROPPED)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def _get(self, offset: int) -> int:
+        return _U64.unpack_from(self._shm.buf, offset)[0]
+
+    def _set(self, offset: int, value: int):
+        _U64.pack_into(self._shm.buf, offset, value)
+
+    @property
+    def dropped(self) -> int:
+        return self._get(_OFF_DROPPED)
+
+    @property
+    def closed(self) -> bool:
+        return _U32.unpack_from(self._shm.buf, _OFF_CLOSED)[0] != 0
+
+    def qsize(self) -> int:
+        return self._get(_OFF_WRITTEN) - self._get(_OFF_READ)
+
+    def empty(self) -> bool:
+        return self._get(_OFF_HEAD) == self._tail
+
+    # 生产者 ------------------------------------------------------------
+
+    def put(self, result: Optional[Dict[str, Any]]) -> bool:
+        """写入一条结果，缓冲区满时丢弃并返回 False"""
+        if result is None:
+            _U32.pack_into(self._shm.buf, _OFF_CLOSED, 1)
+            self._wakeup.release()
+            return True
+
+        payload = encode_record(result)
+        size = 4 + len(payload)
+        head = self._head
+        buf = self._shm.buf
+        if size > self.capacity - (head - _U64.unpack_from(buf, _OFF_TAIL)[0]):
+            self._dropped += 1
+            _U64.pack_into(buf, _OFF_DROPPED, self._dropped)
+            return False
+
+        self._copy_in(head, _U32.pack(len(payload)) + payload)
+        # 先写数据再发布写入位置
+        self._head = head + size
+        self._written += 1
+        _U64.pack_into(buf, _OFF_HEAD, self._head)
+        _U64.pack_into(buf, _OFF_WRITTEN, self._written)
+
+        # Event.set 要等待被唤醒的一方响应，这里只做一次 sem_post
+        if _U32.unpack_from(buf, _OFF_WAITING)[0]:
+            _U32.pack_into(buf, _OFF_WAITING, 0)
+            self._wakeup.release()
+        return True
+
+    def _copy_in(self, position: int, data: bytes):
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        buf = self._shm.buf
+        buf[HEADER_SIZE + start:HEADER_SIZE + start + first] = data[:first]
+        if first < len(data):
+            buf[HEADER_SIZE:HEADER_SIZE + len(data) - first] = data[first:]
+
+    # 消费者 ------------------------------------------------------------
+
+    def _copy_out(self, position: int, length: int) -> bytes:
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        buf = self._shm.buf
+        data = bytes(buf[HEADER_SIZE + start:HEADER_SIZE + start + first])
+        if first < length:
+            data += bytes(buf[HEADER_SIZE:HEADER_SIZE + length - first])
+        return data
+
+    def _read(self) -> Optional[bytes]:
+        tail = self._tail
+        if self._get(_OFF_HEAD) == tail:
+            return None
+        length, = _U32.unpack(self._copy_out(tail, 4))
+        payload = self._copy_out(tail + 4, length)
+        self._tail = tail + 4 + length
+        self._set(_OFF_TAIL, self._tail)
+        self._set(_OFF_READ, self._get(_OFF_READ) + 1)
+        return payload
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """读取一条结果；已关闭且没有剩余记录时返回 None，超时抛出 queue.Empty"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        buf = self._shm.buf
+        while True:
+            payload = self._read()
+            if payload is not None:
+                return decode_record(payload)
+            if self.closed:
+                return None
+
+            # 先声明正在等待再检查一次，避免错过在两次检查之间写入的记录；
+            # 信号量中残留的计数只会造成一次多余的循环
+            _U32.pack_into(buf, _OFF_WAITING, 1)
+            payload = self._read()
+            if payload is None and not self.closed:
+                wait = WAKEUP_INTERVAL
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        _U32.pack_into(buf, _OFF_WAITING, 0)
+                        raise queue.Empty
+                    wait = min(wait, remaining)
+                self._wakeup.acquire(timeout=wait)
+            _U32.pack_into(buf, _OFF_WAITING, 0)
+            if payload is not None:
+                return decode_record(payload)
+
+    def close(self):
+        """断开共享内存；创建方同时删除共享内存"""
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """连接已有的共享内存
+
+    工作进程与主进程共用同一个 resource_tracker，重复登记没有影响，由创建方在 close 时删除。
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
@@ -0,0 +1,134 @@
+"""
+控制台静态资源 - 启动时读入内存并预压缩
+按 Accept-Encoding 返回 brotli / gzip / 原文，带 ETag 和 Last-Modified，未变化时返回 304
+"""
+import asyncio
+import email.utils
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 开发时检查文件变化的间隔（秒）
+WATCH_INTERVAL = 1.0
+
+
+class Asset:
+    """一个文件的原文、各编码的压缩结果和缓存校验信息"""
+
+    __slots__ = ('path', 'mtime', 'media_type', 'bodies', 'etag', 'last_modified')
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if media_type.startswith('text/'):
+            media_type += '; charset=utf-8'
+        self.media_type = media_type
+
+        # 按优先顺序排列，压缩后没有变小的编码不保留
+        self.bodies: Dict[str, bytes] = {}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+        self.bodies['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+        self.bodies = {encoding: data for encoding, data in self.bodies.items() if len(data) < len(body)}
+        self.bodies['identity'] = body
+
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+
+
+def _accepted_encodings(header: str) -> List[str]:
+    """解析 Accept-Encoding，返回可以接受的编码（忽略 q=0）"""
+    encodings = []
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and params[2:] in ('0', '0.0', '0.00', '0.000'):
+            continue
+        encodings.append(name.strip().lower())
+    return encodings
+
+
+class StaticAssets:
+    """内存中的静态资源
+
+    load() 在启动时读入所有文件并压缩，请求只做字典查找；
+    watch() 用于开发环境，定期检查文件修改时间，变化后重新加载。
+    """
+
+    def __init__(self, directory: str, names: List[str]):
+        self.directory = directory
+        self.names = names
+        self.assets: Dict[str, Asset] = {}
+
+    def load(self):
+        for name in self.names:
+            self.assets[name] = Asset(os.path.join(self.directory, name))
+        logger.info(f"已加载控制台资源: {', '.join(self.names)}（brotli {'可用' if brotli else '不可用'}）")
+
+    async def watch(self):
+        """文件修改时间变化时重新加载（开发环境使用）"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            for name, asset in list(self.assets.items()):
+                try:
+                    if os.stat(asset.path).st_mtime == asset.mtime:
+                        continue
+                    # 压缩放到线程中，不阻塞事件循环
+                    self.assets[name] = await loop.run_in_executor(None, Asset, asset.path)
+                    logger.info(f"控制台资源已重新加载: {name}")
+                except OSError as e:
+                    logger.error(f"重新加载控制台资源失败: {e}")
+
+    def response(self, name: str, request: Request) -> Optional[Response]:
+        """返回资源的响应，未加载的文件返回 None"""
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+
+        headers = {
+            'ETag': asset.etag,
+            'Last-Modified': asset.last_modified,
+            # 每次使用前校验，文件更新后立即生效
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding'
+        }
+
+        # 有 If-None-Match 时忽略 If-Modified-Since
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')]
+            if asset.etag in tags or '*' in tags:
+                return Response(status_code=304, headers=headers)
+        else:
+            if_modified_since = request.headers.get('if-modified-since')
+            if if_modified_since:
+                try:
+                    since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+                except (TypeError, ValueError):
+                    since = None
+                if since is not None and int(asset.mtime) <= since:
+                    return Response(status_code=304, headers=headers)
+
+        accepted = _accepted_encodings(request.headers.get('accept-encoding', ''))
+        for encoding, body in asset.bodies.items():
+            if encoding == 'identity' or encoding in accepted:
+                if encoding != 'identity':
+                    headers['Content-Encoding'] = encoding
+                return Response(content=body, media_type=asset.media_type, headers=headers)
@@ -4,23 +4,48 @@ Telegram 客户端多进程实现
 """
 import asyncio
 import logging
-from typing import List, Optional
-from telethon import TelegramClient, events
-from telethon.errors import SessionPasswordNeededError, FloodWaitError
+from typing import Dict, List, Optional
+from telethon import TelegramClient, events, utils
+from telethon.errors import ChannelPrivateError, FloodWaitError, SessionPasswordNeededError
 from telethon.tl.functions.messages import GetDialogsRequest
-from telethon.tl.types import Channel, InputPeerEmpty, User
+from telethon.tl.types import Channel, InputPeerEmpty, MessageService, PeerChannel, UpdateChannel, User
+from .dedup_filter import DuplicateFilter
+from .dialog_index import DialogIndex
+from .match_pipeline import MatchPipeline
+from .metrics import MetricsRegistry
+from .profiler import MAX_INTERVAL, MIN_INTERVAL, MODES as PROFILE_MODES, FunctionProfiler, StackSampler
+from .rule_engine import RuleSet
+from .send_scheduler import DEFAULT_PRIORITY, SendJob, SendScheduler
+from .trigger_gate import NO_WINDOW, TriggerGate
+from .watermarks import WatermarkStore
 import signal
 import sys
+import threading
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 指标快照的推送间隔（秒）
+METRICS_INTERVAL = 5.0
+# 心跳写入间隔（秒），主进程据此判断事件循环是否卡住
+HEARTBEAT_INTERVAL = 1.0
+# 群聊处理进度的保存间隔（秒）
+WATERMARK_SAVE_INTERVAL = 2.0
+# 补拉断线期间消息的默认限制，可通过 start_monitor 的 catch_up 覆盖
+CATCH_UP_DEFAULTS = {
+    'max_age': 900,       # 只补拉最近多少秒内的消息
+    'max_messages': 200,  # 每个群聊最多补拉的条数
+    'interval': 1.0       # 群聊之间、每批（100 条）历史消息请求之间的间隔（秒）
+}
+
 
 class TelegramWorker:
     """Telegram 工作进程 - 处理所有 Telegram 相关操作"""
     
     def __init__(self, api_id: int, api_hash: str, 
-                 command_queue, response_queue, result_queue):
+                 command_queue, response_queue, result_queue,
+                 session_name: str = 'telegram_session', heartbeat=None):
         """
         初始化 Telegram 工作进程
         
@@ -30,56 +55,207 @@ class TelegramWorker:
             command_queue: 命令队列（主进程 -> 工作进程）
             response_queue: 响应队列（工作进程 -> 主进程）
             result_queue: 结果队列（工作进程 -> 主进程）
+            session_name: Telethon 会话文件名
+            heartbeat: 与主进程共享的 multiprocessing.RawValue('d')，事件循环定期写入当前时间
         """
         self.api_id = api_id
         self.api_hash = api_hash
         self.command_queue = command_queue
         self.response_queue = response_queue
         self.result_queue = result_queue
+        self.session_name = session_name
+        self.heartbeat = heartbeat
         
         self.client: Optional[TelegramClient] = None
         self.is_connected = False
         self.is_listening = False
         self.monitor_config = None
-        self.monitor_target = None
+        
+        # 规则表: chat_id -> 该群聊的规则列表
+        self.rule_table: Dict[int, RuleSet] = {}
+        self.handler_registered = False
+        
+        # 回复发送调度器（在 start_monitor 中创建）
+        self.send_scheduler: Optional[SendScheduler] = None
+        
+        # 可选的微批匹配流水线（start_monitor 中配置 match_pipeline 时创建）
+        self.match_pipeline: Optional[MatchPipeline] = None
+        
+        # 群聊索引，按群聊变动增量更新
+        self.dialog_index = DialogIndex()
+        self.dialog_handlers_registered = False
+        self.me_id: Optional[int] = None
+        
+        # 触发节流: 群聊级别的 (合并窗口, 冷却时间)
+        self.trigger_gate = TriggerGate()
+        self.chat_windows: Dict[int, tuple] = {}
+        
+        # 重连后重复推送的消息在匹配前丢弃
+        self.duplicate_filter = DuplicateFilter()
+        
+        # 每个群聊已处理的最大消息 ID，重连或重启后据此补拉错过的消息
+        self.watermarks = WatermarkStore(f"{session_name}.watermarks.json")
+        self.catch_up_options: Optional[dict] = dict(CATCH_UP_DEFAULTS)
+        self.catch_up_task: Optional[asyncio.Task] = None
+        # 断线时的处理进度：重连后实时消息会先推进进度，补拉要从断线时的位置开始
+        self.catch_up_from: Optional[Dict[int, int]] = None
+        self.catch_up_stats = {'runs': 0, 'chats': 0, 'messages': 0, 'truncated': 0}
+        
+        # 已读取、等待处理的命令（在 run 中创建）
+        self.pending_commands: Optional[asyncio.Queue] = None
+        # 正在处理的命令的 request_id，响应会原样带回
+        self.current_request_id: Optional[str] = None
         
         # 监听任务
         self.monitor_task = None
         
+        # 运行指标，由 _push_metrics 定期发给主进程
+        self.metrics = MetricsRegistry()
+        
+        # 正在运行的性能分析任务（同一时间只允许一个）
+        self.profile_task: Optional[asyncio.Task] = None
+        
+        # 最近一次推送给主进程的连接/登录状态
+        self.published_state: Optional[dict] = None
+        
     async def run(self):
         """运行工作进程主循环"""
         logger.info("Telegram 工作进程启动")
         
+        # 命令由读取线程转发到 asyncio 队列，到达后立即唤醒事件循环
+        self.pending_commands = asyncio.Queue()
+        reader = threading.Thread(
+            target=self._read_commands,
+            args=(asyncio.get_running_loop(),),
+            name='command-reader',
+            daemon=True
+        )
+        reader.start()
+        metrics_task = asyncio.get_running_loop().create_task(self._push_metrics())
+        heartbeat_task = asyncio.get_running_loop().create_task(self._beat()) if self.heartbeat is not None else None
+        watermark_task = asyncio.get_running_loop().create_task(self._save_watermarks())
+        
         try:
             while True:
-                # 从命令队列获取命令
-                if not self.command_queue.empty():
-                    command = self.command_queue.get()
-                    await self.handle_command(command)
-                else:
-                    await asyncio.sleep(0.1)
+                command = await self.pending_commands.get()
+                start = time.perf_counter()
+                await self.handle_command(command)
+                self.metrics.observe(
+                    'tgmon_command_duration_seconds', time.perf_counter() - start,
+                    command=command.get('type')
+                )
+                self._publish_state()
         except KeyboardInterrupt:
             logger.info("收到停止信号")
         finally:
+            metrics_task.cancel()
+            watermark_task.cancel()
+            if heartbeat_task is not None:
+                heartbeat_task.cancel()
             await self.cleanup()
     
+    async def _beat(self):
+        """定期写入心跳；事件循环被阻塞时心跳停止更新"""
+        while True:
+            self.heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+    
+    async def _save_watermarks(self):
+        """定期在线程中保存群聊处理进度（只在有变化时写文件）"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(WATERMARK_SAVE_INTERVAL)
+            marks = self.watermarks.snapshot()
+            if marks is not None:
+                await loop.run_in_executor(None, self.watermarks.save, marks)
+    
+    async def _push_metrics(self):
+        """定期把指标快照放入结果队列（主进程收到后不会当作监听结果）"""
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            metrics = self.metrics
+            metrics.set('tgmon_pending_commands', self.pending_commands.qsize())
+            metrics.set('tgmon_send_queue_depth', self.send_scheduler.pending if self.send_scheduler else 0)
+            metrics.set('tgmon_match_pipeline_depth', self.match_pipeline.pending if self.match_pipeline else 0)
+            self._emit_result({'type': 'metrics', 'metrics': metrics.snapshot()})
+            # 网络断开等不经过命令的状态变化也能及时推送；
+            # 第一次状态在命令处理完后推送，避免连接过程中被当作未登录
+            if self.published_state is not None:
+                self._publish_state()
+    
+    def _read_commands(self, loop: asyncio.AbstractEventLoop):
+        """命令读取线程：阻塞等待命令队列，不占用事件循环"""
+        while True:
+            try:
+                command = self.command_queue.get()
+                loop.call_soon_threadsafe(self.pending_commands.put_nowait, command)
+            except (EOFError, OSError, RuntimeError):
+                # 队列已关闭或事件循环已退出
+                break
+    
+    def _respond(self, response: dict, request_id: Optional[str] = None):
+        """发送响应，并带上 request_id 以便主进程匹配请求
+
+        Args:
+            response: 响应
+            request_id: 后台任务在命令处理结束后才响应时需要显式传入，默认为当前命令的 request_id
+        """
+        if request_id is None:
+            request_id = self.current_request_id
+        if request_id is not None:
+            response['request_id'] = request_id
+        self.response_queue.put(response)
+    
+    def _publish_state(self):
+        """连接、登录或监听状态变化时推送给主进程，主进程缓存后直接回答状态查询"""
+        state = {
+            'connected': self.client is not None and self.client.is_connected(),
+            'authorized': self.is_connected,
+            'listening': self.is_listening
+        }
+        if state != self.published_state:
+            # Telethon 自动重连后补拉断线期间的消息
+            if self.published_state is not None and state['connected'] != self.published_state['connected']:
+                if state['connected']:
+                    self._start_catch_up()
+                else:
+                    self.catch_up_from = dict(self.watermarks.marks)
+            self.published_state = state
+            self._emit_result(dict(state, type='worker_state'))
+    
+    def _emit_result(self, result: dict):
+        """发送结果，并记录产生时间"""
+        result.setdefault('ts', time.time())
+        self.result_queue.put(result)
+    
     async def handle_command(self, command: dict):
         """处理命令"""
         cmd_type = command.get('type')
+        self.current_request_id = command.get('request_id')
         logger.info(f"处理命令: {cmd_type}")
         
-        if cmd_type == 'connect':
+        if cmd_type == 'ping':
+            self._respond({'type': 'pong', 'success': True})
+        elif cmd_type == 'connect':
             await self.connect()
         elif cmd_type == 'send_code':
             await self.send_code(command['phone'])
         elif cmd_type == 'verify_code':
             await self.verify_code(command['code'], command.get('password'))
         elif cmd_type == 'get_dialogs':
-            await self.get_dialogs()
+            await self.get_dialogs(command)
+        elif cmd_type == 'stream_dialogs':
+            await self.stream_dialogs(command.get('batch_size', 50))
         elif cmd_type == 'start_monitor':
             await self.start_monitor(command)
+        elif cmd_type == 'update_rules':
+            await self.update_rules(command)
         elif cmd_type == 'stop_monitor':
             await self.stop_monitor()
+        elif cmd_type == 'get_stats':
+            self.get_stats()
+        elif cmd_type == 'profile':
+            self.start_profile(command)
         elif cmd_type == 'disconnect':
             await self.disconnect()
         else:
@@ -90,21 +266,21 @@ class TelegramWorker:
         try:
             if self.client is None:
                 self.client = TelegramClient(
-                    'telegram_session',
+                    self.session_name,
                     self.api_id,
                     self.api_hash
                 )
                 await self.client.connect()
                 self.is_connected = await self.client.is_user_authorized()
                 
-                self.response_queue.put({
+                self._respond({
                     'type': 'connect_response',
                     'success': True,
                     'is_authorized': self.is_connected
                 })
                 logger.info(f"连接成功，已授权: {self.is_connected}")
             else:
-                self.response_queue.put({
+                self._respond({
                     'type': 'connect_response',
                     'success': True,
                     'is_authorized': self.is_connected,
@@ -112,7 +288,7 @@ class TelegramWorker:
                 })
         except Exception as e:
             logger.error(f"连接失败: {e}")
-            self.response_queue.put({
+            self._respond({
                 'type': 'connect_response',
                 'success': False,
                 'error': str(e)
@@ -121,18 +297,12 @@ class TelegramWorker:
     async def send_code(self, phone: str):
         """发送验证码"""
         try:
-            # 如果已有客户端且已断开，先清理
-            if self.client is not None:
-                try:
-                    if self.client.is_connected():
-                        await self.client.disconnect()
-                except:
-                    pass
-                self.client = None
+            # 如果已有客户端且已断开，先清理（监听状态随旧客户端一起清除）
+            await self._drop_client()
             
             # 创建新客户端连接
             self.client = TelegramClient(
-                'telegram_session',
+                self.session_name,
                 self.api_id,
                 self.api_hash
             )
@@ -140,7 +310,7 @@ class TelegramWorker:
             
             await self.client.send_code_request(phone)
             
-            self.response_queue.put({
+            self._respond({
                 'type': 'code_sent',
                 'success': True,
                 'message': '验证码已发送'
@@ -150,12 +320,7 @@ class TelegramWorker:
             logger.error(f"发送验证码失败: {e}")
             
             # 清理失败的客户端
-            if self.client is not None:
-                try:
-                    await self.client.disconnect()
-                except:
-                    pass
-                self.client = None
+            await self._drop_client()
             
             # 友好的错误提示
             error_msg = str(e)
@@ -166,7 +331,7 @@ class TelegramWorker:
             else:
                 user_msg = str(e)
             
-            self.response_queue.put({
+            self._respond({
                 'type': 'code_sent',
                 'success': False,
                 'error': user_msg
@@ -176,7 +341,7 @@ class TelegramWorker:
         """验证登录代码"""
         try:
             if self.client is None:
-                self.response_queue.put({
+                self._respond({
                     'type': 'verify_response',
                     'success': False,
                     'error': '未连接'
@@ -188,7 +353,7 @@ class TelegramWorker:
                 if password:
                     await self._verify_password(password)
                 else:
-                    self.response_queue.put({
+                    self._respond({
                         'type': 'verify_response',
                         'success': False,
                         'error': '需要二次密码'
@@ -200,7 +365,7 @@ class TelegramWorker:
                 await self.client.sign_in(self.client._phone, code)
                 self.is_connected = True
                 
-                self.response_queue.put({
+                self._respond({
                     'type': 'verify_response',
                     'success': True,
                     'message': '登录成功'
@@ -217,7 +382,7 @@ class TelegramWorker:
                     await self._verify_password(password)
                 else:
                     # 没有密码，返回需要密码的提示
-                    self.response_queue.put({
+                    self._respond({
                         'type': 'verify_response',
                         'success': False,
                         'error': 'need_password',
@@ -230,13 +395,13 @@ class TelegramWorker:
             # 判断错误类型
             error_msg = str(e)
             if 'password' in error_msg.lower() or '密码' in error_msg:
-                self.response_queue.put({
+                self._respond({
                     'type': 'verify_response',
                     'success': False,
                     'error': '二次密码错误'
                 })
             else:
-                self.response_queue.put({
+                self._respond({
                     'type': 'verify_response',
                     'success': False,
                     'error': str(e)
@@ -255,7 +420,7 @@ class TelegramWorker:
             if hasattr(self.client, '_password_auth'):
                 delattr(self.client, '_password_auth')
             
-            self.response_queue.put({
+            self._respond({
                 'type': 'verify_response',
                 'success': True,
                 'message': '登录成功'
@@ -268,133 +433,617 @@ class TelegramWorker:
             # 判断是否是密码错误
             error_msg = str(e)
             if 'password' in error_msg.lower() or '密码' in error_msg.lower():
-                self.response_queue.put({
+                self._respond({
                     'type': 'verify_response',
                     'success': False,
                     'error': '二次密码错误'
                 })
             else:
-                self.response_queue.put({
+                self._respond({
                     'type': 'verify_response',
                     'success': False,
                     'error': f'登录失败: {str(e)}'
                 })
     
-    async def get_dialogs(self):
-        """获取群聊列表"""
+    async def get_dialogs(self, command: Optional[dict] = None):
+        """获取群聊列表（从群聊索引返回，首次请求时加载）
+        
+        command 可包含:
+            offset/limit: 分页
+            etag: 客户端已有的版本，未变化时只返回 not_modified
+            refresh: 强制重新加载
+        """
+        command = command or {}
         try:
             if not self.is_connected:
-                self.response_queue.put({
+                self._respond({
                     'type': 'dialogs_response',
                     'success': False,
                     'error': '未登录'
                 })
                 return
             
-            dialogs = await self.client.get_dialogs(limit=None)
-            
-            # 过滤出群聊
-            groups = []
-            for dialog in dialogs:
-                if isinstance(dialog.entity, Channel):
-                    participants_count = getattr(dialog.entity, 'participants_count', 0)
-                    groups.append({
-                        'id': dialog.entity.id,
-                        'title': dialog.entity.title or f"群聊 {dialog.entity.id}",
-                        'username': dialog.entity.username or '',
-                        'participants_count': participants_count
-                    })
+            if not self.dialog_index.loaded or command.get('refresh'):
+                await self._load_dialog_index()
             
-            self.response_queue.put({
+            index = self.dialog_index
+            if command.get('etag') == index.etag:
+                self._respond({
+                    'type': 'dialogs_response',
+                    'success': True,
+                    'not_modified': True,
+                    'etag': index.etag
+                })
+                return
+            
+            offset = max(0, int(command.get('offset') or 0))
+            limit = command.get('limit')
+            self._respond({
                 'type': 'dialogs_response',
                 'success': True,
-                'groups': groups
+                'groups': index.page(offset, None if limit is None else int(limit)),
+                'total': len(index),
+                'etag': index.etag
             })
-            logger.info(f"获取到 {len(groups)} 个群聊")
             
         except Exception as e:
             logger.error(f"获取群聊列表失败: {e}")
-            self.response_queue.put({
+            self._respond({
                 'type': 'dialogs_response',
                 'success': False,
                 'error': str(e)
             })
     
+    async def stream_dialogs(self, batch_size: int = 50):
+        """分批返回群聊列表
+        
+        群聊索引已加载时直接分批返回索引；否则边用 iter_dialogs 获取边转发，
+        不在内存中保留完整列表。最后一批的 done 为 True。
+        """
+        total = 0
+        try:
+            if not self.is_connected:
+                self._respond({
+                    'type': 'dialogs_batch',
+                    'success': False,
+                    'error': '未登录',
+                    'done': True
+                })
+                return
+            
+            if self.dialog_index.loaded:
+                for offset in range(0, len(self.dialog_index), batch_size):
+                    groups = self.dialog_index.page(offset, batch_size)
+                    total += len(groups)
+                    self._respond({'type': 'dialogs_batch', 'success': True, 'groups': groups, 'done': False})
+            else:
+                batch = []
+                async for dialog in self.client.iter_dialogs():
+                    if isinstance(dialog.entity, Channel):
+                        batch.append(self._group_info(dialog.entity))
+                        if len(batch) >= batch_size:
+                            total += len(batch)
+                            self._respond({'type': 'dialogs_batch', 'success': True, 'groups': batch, 'done': False})
+                            batch = []
+                if batch:
+                    total += len(batch)
+                    self._respond({'type': 'dialogs_batch', 'success': True, 'groups': batch, 'done': False})
+            
+            self._respond({'type': 'dialogs_batch', 'success': True, 'groups': [], 'total': total, 'done': True})
+            logger.info(f"流式返回 {total} 个群聊")
+            
+        except Exception as e:
+            logger.error(f"获取群聊列表失败: {e}")
+            self._respond({
+                'type': 'dialogs_batch',
+                'success': False,
+                'error': str(e),
+                'done': True
+            })
+    
+    @staticmethod
+    def _group_info(entity) -> dict:
+        """群聊实体转换为返回给前端的字典"""
+        return {
+            'id': entity.id,
+            'title': entity.title or f"群聊 {entity.id}",
+            'username': entity.username or '',
+            'participants_count': getattr(entity, 'participants_count', 0)
+        }
+    
+    async def _load_dialog_index(self):
+        """完整加载一次群聊列表，并注册增量更新的事件处理器"""
+        groups = []
+        async for dialog in self.client.iter_dialogs():
+            if isinstance(dialog.entity, Channel):
+                groups.append(self._group_info(dialog.entity))
+        self.dialog_index.replace(groups)
+        logger.info(f"获取到 {len(groups)} 个群聊")
+        
+        if not self.dialog_handlers_registered:
+            self.me_id = await self.client.get_peer_id('me')
+            self.client.add_event_handler(self.handle_chat_action, events.ChatAction())
+            self.client.add_event_handler(self.handle_channel_update, events.Raw(UpdateChannel))
+            self.dialog_handlers_registered = True
+    
+    def _reset_dialog_index(self):
+        """切换或断开客户端后清空群聊索引"""
+        if self.client and self.dialog_handlers_registered:
+            self.client.remove_event_handler(self.handle_chat_action)
+            self.client.remove_event_handler(self.handle_channel_update)
+        self.dialog_handlers_registered = False
+        self.dialog_index = DialogIndex()
+    
+    async def handle_chat_action(self, event):
+        """群聊改名、自己加入或离开群聊时更新索引"""
+        try:
+            chat_id = utils.resolve_id(event.chat_id)[0]
+            if event.new_title and chat_id in self.dialog_index.groups:
+                group = dict(self.dialog_index.groups[chat_id], title=event.new_title)
+                self.dialog_index.upsert(group)
+            elif self.me_id in (event.user_ids or []):
+                if event.user_joined or event.user_added:
+                    chat = await event.get_chat()
+                    if isinstance(chat, Channel):
+                        self.dialog_index.upsert(self._group_info(chat))
+                elif event.user_left or event.user_kicked:
+                    self.dialog_index.remove(chat_id)
+        except Exception as e:
+            logger.error(f"更新群聊索引失败: {e}")
+    
+    async def handle_channel_update(self, update):
+        """频道/超级群状态变化（加入、退出、权限变化等）时更新索引"""
+        channel_id = update.channel_id
+        try:
+            entity = await self.client.get_entity(PeerChannel(channel_id))
+            if isinstance(entity, Channel) and not entity.left:
+                self.dialog_index.upsert(self._group_info(entity))
+            else:
+                self.dialog_index.remove(channel_id)
+        except (ChannelPrivateError, ValueError):
+            # 已被移出或无法访问
+            self.dialog_index.remove(channel_id)
+        except Exception as e:
+            logger.error(f"更新群聊索引失败: {e}")
+    
     async def start_monitor(self, config: dict):
-        """开始监听"""
+        """开始监听
+
+        config 可以是 rules 列表（每条规则对应一个群聊），
+        也兼容旧格式的 target_group_id/keywords/messages/interval 单条规则。
+        规则可以带 expression 布尔表达式；同一群聊的规则编译成一个 RuleSet。
+        """
         try:
-            self.monitor_config = {
-                'target_group_id': config['target_group_id'],
-                'keywords': config['keywords'],
-                'messages': config['messages'],
-                'interval': config.get('interval', 1)
+            rules = config.get('rules')
+            if not rules:
+                rules = [{
+                    'target_group_id': config['target_group_id'],
+                    'keywords': config['keywords'],
+                    'messages': config['messages'],
+                    'interval': config.get('interval', 1)
+                }]
+            
+            # 先构建完整的规则表，再整体替换
+            chat_rules: Dict[int, List[dict]] = {}
+            stored_rules = []
+            for index, rule in enumerate(rules):
+                chat_id = await self._resolve_chat_id(rule['target_group_id'])
+                rule_id = rule.get('rule_id') or f"{rule['target_group_id']}:{index}"
+                chat_rules.setdefault(chat_id, []).append(self._compile_rule(rule, chat_id, rule_id))
+                stored_rules.append(dict(rule, rule_id=rule_id))
+            
+            normalize_text = config.get('normalize', True)
+            rule_table = {
+                chat_id: RuleSet(chat_rule_list, normalize_text)
+                for chat_id, chat_rule_list in chat_rules.items()
             }
-            self.monitor_target = config['target_group_id']
-            self.is_listening = True
             
-            # 注册事件处理器
-            self.client.add_event_handler(
-                self.handle_new_message,
-                events.NewMessage(chats=self.monitor_target)
-            )
+            chat_windows = {}
+            for target, window in (config.get('chat_windows') or {}).items():
+                chat_id = await self._resolve_chat_id(int(target))
+                chat_windows[chat_id] = (window.get('coalesce', 0), window.get('cooldown', 0))
+            
+            await self._configure_match_pipeline(config.get('match_pipeline'), rule_table)
+            
+            catch_up = config.get('catch_up', True)
+            if isinstance(catch_up, dict):
+                self.catch_up_options = dict(CATCH_UP_DEFAULTS, **catch_up)
+            else:
+                self.catch_up_options = dict(CATCH_UP_DEFAULTS) if catch_up else None
+            
+            self.monitor_config = {'rules': stored_rules, 'normalize': normalize_text}
+            self.rule_table = rule_table
+            self.chat_windows = chat_windows
+            self.trigger_gate.reset()
+            self._activate_monitor(config.get('send_limits') or {})
             
-            self.response_queue.put({
+            self._respond({
                 'type': 'monitor_started',
                 'success': True,
-                'message': '监听已开始'
+                'message': '监听已开始',
+                'chats': len(rule_table),
+                'rules': len(rules),
+                # 按规则顺序的 rule_id（含自动生成的），主进程据此记录重启时重放的规则
+                'rule_ids': [rule['rule_id'] for rule in stored_rules]
             })
-            logger.info(f"开始监听群聊: {self.monitor_target}")
+            logger.info(f"开始监听 {len(rule_table)} 个群聊，共 {len(rules)} 条规则")
+            # 启动或重启后补拉上次处理进度之后的消息
+            self._start_catch_up()
             
         except Exception as e:
             logger.error(f"启动监听失败: {e}")
-            self.response_queue.put({
+            self._respond({
                 'type': 'monitor_started',
                 'success': False,
                 'error': str(e)
             })
     
+    @staticmethod
+    def _compile_rule(rule: dict, chat_id: int, rule_id: str) -> dict:
+        """把 API 传入的规则转换为规则表中使用的格式"""
+        return {
+            'rule_id': rule_id,
+            'chat_id': chat_id,
+            'keywords': rule.get('keywords') or [],
+            'expression': rule.get('expression'),
+            'messages': rule['messages'],
+            'interval': rule.get('interval', 1),
+            'priority': rule.get('priority', DEFAULT_PRIORITY),
+            'window': (rule.get('coalesce', 0), rule.get('cooldown', 0))
+        }
+    
+    def _activate_monitor(self, send_limits: dict):
+        """启动发送调度器并注册消息处理器（已注册时不会重复注册）"""
+        # 发送调度器（限速参数可随 start_monitor 更新）
+        if self.send_scheduler is None:
+            self.send_scheduler = SendScheduler(
+                self._send_message,
+                on_sent=self._on_message_sent,
+                on_error=self._on_send_error,
+                on_flood_wait=self._on_flood_wait,
+                **send_limits
+            )
+        elif send_limits:
+            self.send_scheduler.configure(**send_limits)
+        self.send_scheduler.start()
+        self.is_listening = True
+        
+        # 只注册一个不带 chats 过滤的处理器，由规则表分发
+        if not self.handler_registered:
+            self.client.add_event_handler(
+                self.handle_new_message,
+                events.NewMessage()
+            )
+            self.handler_registered = True
+    
+    async def update_rules(self, command: dict):
+        """增量更新规则，不重新注册处理器
+
+        command 中 upsert 为新增或替换的规则（格式同 start_monitor，按 rule_id 替换），
+        remove 为要删除的 rule_id，evict 为要删除但不存在时无需报告的 rule_id（进程池迁移规则时使用）。
+        只重新编译受影响群聊的 RuleSet，新规则表构建完成后整体替换，期间的消息仍按旧规则处理。
+        未开始监听时以空规则表为基础，更新后开始监听。
+        """
+        try:
+            upsert = command.get('upsert') or []
+            remove = set(command.get('remove') or [])
+            evict = set(command.get('evict') or [])
+            
+            # 先解析所有群聊 ID（需要等待），之后的替换不再让出事件循环
+            resolved = [(rule, await self._resolve_chat_id(rule['target_group_id'])) for rule in upsert]
+            
+            if self.is_listening:
+                stored_rules = list(self.monitor_config['rules'])
+                normalize_text = self.monitor_config['normalize']
+            else:
+                stored_rules = []
+                normalize_text = command.get('normalize', True)
+            locations = {
+                rule['rule_id']: chat_id
+                for chat_id, rule_set in self.rule_table.items()
+                for rule in rule_set.rules
+            }
+            chat_rules = {chat_id: list(rule_set.rules) for chat_id, rule_set in self.rule_table.items()}
+            dirty = set()
+            
+            # 删除
+            missing = sorted(remove - locations.keys())
+            removed = (remove | evict) & locations.keys()
+            for rule_id in removed:
+                chat_id = locations.pop(rule_id)
+                chat_rules[chat_id] = [rule for rule in chat_rules[chat_id] if rule['rule_id'] != rule_id]
+                dirty.add(chat_id)
+            stored_rules = [rule for rule in stored_rules if rule['rule_id'] not in removed]
+            
+            # 新增或替换（同一群聊内保持原有顺序，换群聊时移到新群聊末尾）
+            added = updated = 0
+            upserted_ids = []
+            sequence = len(stored_rules)
+            for rule, chat_id in resolved:
+                rule_id = rule.get('rule_id')
+                if not rule_id:
+                    rule_id = f"{rule['target_group_id']}:{sequence}"
+                    while rule_id in locations:
+                        sequence += 1
+                        rule_id = f"{rule['target_group_id']}:{sequence}"
+                    sequence += 1
+                upserted_ids.append(rule_id)
+                compiled = self._compile_rule(rule, chat_id, rule_id)
+                stored = dict(rule, rule_id=rule_id)
+                
+                old_chat_id = locations.get(rule_id)
+                if old_chat_id == chat_id:
+                    chat_rules[chat_id] = [compiled if r['rule_id'] == rule_id else r for r in chat_rules[chat_id]]
+                    stored_rules = [stored if r['rule_id'] == rule_id else r for r in stored_rules]
+                    updated += 1
+                else:
+                    if old_chat_id is not None:
+                        chat_rules[old_chat_id] = [r for r in chat_rules[old_chat_id] if r['rule_id'] != rule_id]
+                        stored_rules = [r for r in stored_rules if r['rule_id'] != rule_id]
+                        dirty.add(old_chat_id)
+                        updated += 1
+                    else:
+                        added += 1
+                    chat_rules.setdefault(chat_id, []).append(compiled)
+                    stored_rules.append(stored)
+                locations[rule_id] = chat_id
+                dirty.add(chat_id)
+            
+            # 只重新编译变化的群聊
+            rule_table = dict(self.rule_table)
+            for chat_id in dirty:
+                if chat_rules.get(chat_id):
+                    rule_table[chat_id] = RuleSet(chat_rules[chat_id], normalize_text)
+                else:
+                    rule_table.pop(chat_id, None)
+            
+            if dirty:
+                if self.match_pipeline is not None:
+                    self.match_pipeline.set_rules(rule_table)
+                self.rule_table = rule_table
+                self.monitor_config = {'rules': stored_rules, 'normalize': normalize_text}
+                if not self.is_listening and rule_table:
+                    self._activate_monitor(command.get('send_limits') or {})
+            
+            self._respond({
+                'type': 'rules_updated',
+                'success': True,
+                'added': added,
+                'updated': updated,
+                'removed': len(removed),
+                'missing': missing,
+                'chats': len(self.rule_table),
+                'rules': len(locations),
+                # 与 upsert 一一对应的 rule_id
+                'rule_ids': upserted_ids
+            })
+            logger.info(f"规则已更新: 新增 {added}，替换 {updated}，删除 {len(removed)}")
+            
+        except Exception as e:
+            logger.error(f"更新规则失败: {e}")
+            self._respond({
+                'type': 'rules_updated',
+                'success': False,
+                'error': str(e)
+            })
+    
+    async def _configure_match_pipeline(self, options: Optional[dict], rule_table: Dict[int, RuleSet]):
+        """按 start_monitor 的 match_pipeline 参数创建、更新或关闭匹配流水线"""
+        if not options:
+            if self.match_pipeline is not None:
+                await self.match_pipeline.close()
+                self.match_pipeline = None
+            return
+        
+        if self.match_pipeline is not None and self.match_pipeline.options != dict(self.match_pipeline.options, **options):
+            await self.match_pipeline.close()
+            self.match_pipeline = None
+        if self.match_pipeline is None:
+            self.match_pipeline = MatchPipeline(self._on_batch_matched, **options)
+            logger.info(f"匹配流水线已启用: {self.match_pipeline.options}")
+        self.match_pipeline.set_rules(rule_table)
+    
+    async def _resolve_chat_id(self, target) -> int:
+        """把群聊 ID（可能是不带前缀的 ID）转换为事件中使用的 chat_id"""
+        entity = await self.client.get_input_entity(target)
+        return utils.get_peer_id(entity)
+    
     async def handle_new_message(self, event):
         """处理新消息事件"""
-        if not self.is_listening or not self.monitor_config:
+        self._process_message(event.chat_id, event.message)
+    
+    def _process_message(self, chat_id: int, message) -> bool:
+        """匹配一条消息（新消息和补拉的消息共用），返回是否处理了这条消息"""
+        # 没有规则的群聊只需要一次字典查找
+        rule_set = self.rule_table.get(chat_id)
+        if rule_set is None or not self.is_listening:
+            return False
+        if self.duplicate_filter.is_duplicate(chat_id, message.id):
+            self.metrics.inc('tgmon_duplicate_messages_total')
+            return False
+        self.watermarks.advance(chat_id, message.id)
+        
+        start = time.perf_counter()
+        message_text = message.text or ""
+        if self.match_pipeline is not None:
+            # 在线程池/进程池中批量匹配，结果回到事件循环后再触发回复
+            self.match_pipeline.submit(chat_id, message.id, message_text)
+        else:
+            # 文本只规范化和扫描一次，再逐条规则判断表达式
+            self._handle_matches(
+                (chat_id, message.id, message_text),
+                rule_set, rule_set.match_indices(message_text)
+            )
+        self.metrics.inc('tgmon_messages_total')
+        self.metrics.observe('tgmon_message_handle_duration_seconds', time.perf_counter() - start)
+        return True
+    
+    def _start_catch_up(self):
+        """在后台补拉错过的消息（未开启、未监听或已在补拉时不启动）"""
+        marks, self.catch_up_from = self.catch_up_from, None
+        if not self.catch_up_options or not self.is_listening:
             return
+        if self.catch_up_task is not None and not self.catch_up_task.done():
+            return
+        # 启动时的处理进度在注册消息处理器后、处理第一条实时消息前读取
+        if marks is None:
+            marks = dict(self.watermarks.marks)
+        self.catch_up_task = asyncio.get_running_loop().create_task(
+            self._catch_up(marks, dict(self.catch_up_options))
+        )
+    
+    async def _catch_up(self, marks: Dict[int, int], options: dict):
+        """按处理进度补拉每个群聊错过的消息，交给与新消息相同的匹配流程
+
+        从最新的消息往前拉取，早于 max_age 秒或超过 max_messages 条就停止，更早的消息不再补拉；
+        群聊之间和每批请求之间间隔 interval 秒。没有处理进度的群聊（从未收到过消息）跳过。
+        """
+        max_age = options.get('max_age')
+        max_messages = options.get('max_messages')
+        interval = options.get('interval', 0)
+        cutoff = time.time() - max_age if max_age else None
+        stats = self.catch_up_stats
+        stats['runs'] += 1
+        fetched = 0
         
-        try:
-            message_text = event.message.text or ""
-            keywords = self.monitor_config['keywords']
+        for chat_id in list(self.rule_table):
+            min_id = marks.get(chat_id)
+            if min_id is None or not self.is_listening:
+                continue
+            if fetched and interval:
+                await asyncio.sleep(interval)
+            fetched += 1
             
-            # 检查是否包含关键字
-            matched = any(keyword in message_text for keyword in keywords)
+            missed = []
+            truncated = False
+            try:
+                async for message in self.client.iter_messages(
+                    chat_id, limit=max_messages, min_id=min_id, wait_time=interval
+                ):
+                    if cutoff is not None and message.date.timestamp() < cutoff:
+                        truncated = True
+                        break
+                    # 与 NewMessage 事件一致，不处理入群、改名等服务消息
+                    if not isinstance(message, MessageService):
+                        missed.append(message)
+                else:
+                    truncated = max_messages is not None and len(missed) >= max_messages
+            except FloodWaitError as e:
+                # 剩下的群聊等下次重连再补拉
+                logger.warning(f"补拉消息触发 FloodWait（{e.seconds} 秒），停止本次补拉")
+                self._on_flood_wait(e.seconds)
+                break
+            except Exception as e:
+                logger.error(f"补拉群聊 {chat_id} 的消息失败: {e}")
+                continue
             
-            if matched:
-                logger.info(f"匹配到关键字: {message_text}")
-                await self.send_messages()
+            # 按消息顺序处理，已经实时处理过的消息由去重过滤掉
+            processed = sum(self._process_message(chat_id, message) for message in reversed(missed))
+            if processed:
+                logger.info(f"群聊 {chat_id} 补拉 {processed} 条消息")
+            stats['chats'] += 1
+            stats['messages'] += processed
+            stats['truncated'] += truncated
+            self.metrics.inc('tgmon_catch_up_messages_total', processed)
+    
+    def _on_batch_matched(self, item: tuple, rule_set: RuleSet, matches: list):
+        """匹配流水线的结果回调（在事件循环中调用）"""
+        if self.is_listening:
+            self._handle_matches(item, rule_set, matches)
+    
+    def _handle_matches(self, item: tuple, rule_set: RuleSet, matches: list):
+        """对命中的规则做触发节流、上报结果并提交回复"""
+        chat_id, message_id, message_text = item
+        try:
+            for index, matched_keywords in matches:
+                rule = rule_set.rules[index]
+                # 合并窗口或冷却期内的匹配不再触发新的回复
+                delay = self.trigger_gate.check(
+                    chat_id, rule['rule_id'], time.monotonic(),
+                    rule['window'], self.chat_windows.get(chat_id, NO_WINDOW)
+                )
                 
+                logger.info(f"规则 {rule['rule_id']} 匹配到关键字 {matched_keywords}: {message_text}")
+                self._emit_result({
+                    'type': 'keyword_matched',
+                    'chat_id': chat_id,
+                    'message_id': message_id,
+                    'rule_id': rule['rule_id'],
+                    'keywords': matched_keywords,
+                    'text': message_text,
+                    'suppressed': delay is None
+                })
+                self.metrics.inc('tgmon_rule_matches_total', rule_id=rule['rule_id'])
+                if delay is not None:
+                    self.send_messages(chat_id, rule, delay)
+                else:
+                    self.metrics.inc('tgmon_rule_suppressed_total', rule_id=rule['rule_id'])
+            
         except Exception as e:
             logger.error(f"处理新消息时出错: {e}")
-            self.result_queue.put({
+            self._emit_result({
                 'type': 'error',
                 'error': str(e)
             })
     
+    async def _teardown_monitor(self):
+        """清除监听状态并从当前客户端移除消息处理器（不发送响应）"""
+        self.is_listening = False
+        self.monitor_config = None
+        self.rule_table = {}
+        
+        if self.catch_up_task is not None:
+            self.catch_up_task.cancel()
+            self.catch_up_task = None
+        
+        if self.match_pipeline:
+            await self.match_pipeline.close()
+            self.match_pipeline = None
+        
+        # 丢弃尚未发送的回复
+        if self.send_scheduler:
+            await self.send_scheduler.stop()
+            self.send_scheduler = None
+        
+        if self.monitor_task:
+            self.monitor_task.cancel()
+            try:
+                await self.monitor_task
+            except asyncio.CancelledError:
+                pass
+            self.monitor_task = None
+        
+        # 移除事件处理器
+        if self.client:
+            self.client.remove_event_handler(self.handle_new_message)
+        self.handler_registered = False
+    
+    async def _drop_client(self):
+        """丢弃当前客户端：清除监听状态和群聊索引后断开
+
+        处理器注册在客户端上，换用新客户端后需要重新 start_monitor 才会注册。
+        """
+        if self.client is None:
+            return
+        try:
+            await self._teardown_monitor()
+        except Exception as e:
+            logger.error(f"清除监听状态失败: {e}")
+        self._reset_dialog_index()
+        try:
+            if self.client.is_connected():
+                await self.client.disconnect()
+        except Exception:
+            pass
+        self.client = None
+        self.is_connected = False
+    
     async def stop_monitor(self):
         """停止监听"""
         try:
-            self.is_listening = False
-            self.monitor_config = None
+            await self._teardown_monitor()
             
-            if self.monitor_task:
-                self.monitor_task.cancel()
-                try:
-                    await self.monitor_task
-                except asyncio.CancelledError:
-                    pass
-                self.monitor_task = None
-            
-            # 移除事件处理器
-            if self.client:
-                self.client.remove_event_handler(self.handle_new_message)
-            
-            self.response_queue.put({
+            self._respond({
                 'type': 'monitor_stopped',
                 'success': True,
                 'message': '监听已停止'
@@ -404,49 +1053,128 @@ class TelegramWorker:
         except Exception as e:
             logger.error(f"停止监听失败: {e}")
     
-    async def send_messages(self):
-        """按顺序发送消息"""
-        if not self.monitor_config:
+    def send_messages(self, chat_id: int, rule: dict, delay: float = 0):
+        """把规则中的消息交给发送调度器，按顺序限速发送（不等待发送完成）"""
+        self.send_scheduler.submit(
+            chat_id,
+            rule['messages'],
+            interval=rule.get('interval', 1),
+            priority=rule.get('priority', DEFAULT_PRIORITY),
+            delay=delay,
+            rule_id=rule['rule_id']
+        )
+    
+    def get_stats(self):
+        """返回触发和发送统计"""
+        scheduler = self.send_scheduler
+        self._respond({
+            'type': 'stats',
+            'success': True,
+            'triggers': self.trigger_gate.stats(),
+            'duplicates': self.duplicate_filter.stats(),
+            'catch_up': dict(
+                self.catch_up_stats,
+                running=self.catch_up_task is not None and not self.catch_up_task.done()
+            ),
+            'match_pipeline': self.match_pipeline.stats() if self.match_pipeline else None,
+            'send': {
+                'sent': scheduler.sent if scheduler else 0,
+                'pending': scheduler.pending if scheduler else 0,
+                'flood_waits': scheduler.flood_waits if scheduler else 0,
+                'flood_wait_seconds': scheduler.flood_wait_seconds if scheduler else 0
+            }
+        })
+    
+    def start_profile(self, command: dict):
+        """在后台运行性能分析，结束后再响应，期间命令循环照常处理其他命令"""
+        mode = command.get('mode', 'sample')
+        seconds = float(command.get('seconds', 10))
+        interval = float(command.get('interval', 0.005))
+        if mode not in PROFILE_MODES:
+            self._respond({'type': 'profile', 'success': False, 'error': f'未知的分析模式: {mode}'})
+            return
+        if not 0 < seconds <= 300:
+            self._respond({'type': 'profile', 'success': False, 'error': '分析时长需在 0~300 秒之间'})
+            return
+        if not MIN_INTERVAL <= interval <= MAX_INTERVAL:
+            self._respond({
+                'type': 'profile', 'success': False,
+                'error': f'采样间隔需在 {MIN_INTERVAL}~{MAX_INTERVAL} 秒之间'
+            })
+            return
+        if self.profile_task is not None and not self.profile_task.done():
+            self._respond({'type': 'profile', 'success': False, 'error': '已有性能分析正在运行'})
             return
         
-        messages = self.monitor_config['messages']
-        interval = self.monitor_config.get('interval', 1)
-        
-        for msg in messages:
-            try:
-                await self.client.send_message(self.monitor_target, msg)
-                logger.info(f"发送消息: {msg}")
-                
-                self.result_queue.put({
-                    'type': 'message_sent',
-                    'content': msg
-                })
-                
-                if interval > 0:
-                    await asyncio.sleep(interval)
-                    
-            except FloodWaitError as e:
-                logger.warning(f"触发了 Flood Wait: {e.seconds}秒")
-                await asyncio.sleep(e.seconds)
-                
-            except Exception as e:
-                logger.error(f"发送消息失败: {e}")
-                self.result_queue.put({
-                    'type': 'error',
-                    'error': f'发送消息失败: {str(e)}'
-                })
+        self.profile_task = asyncio.get_running_loop().create_task(self._run_profile(
+            self.current_request_id, mode, seconds, interval, int(command.get('limit', 50))
+        ))
+    
+    async def _run_profile(self, request_id: Optional[str], mode: str, seconds: float,
+                           interval: float, limit: int):
+        logger.info(f"开始性能分析: {mode}，{seconds} 秒")
+        try:
+            if mode == 'sample':
+                sampler = StackSampler(interval=interval)
+                sampler.start()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    sampler.stop()
+                result = {'samples': sampler.samples, 'interval': interval, 'collapsed': sampler.collapsed()}
+            else:
+                profiler = FunctionProfiler()
+                profiler.start()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    profiler.stop()
+                result = {'functions': profiler.top(limit)}
+            
+            self._respond(dict(result, type='profile', success=True, mode=mode, seconds=seconds), request_id)
+            logger.info("性能分析完成")
+        except Exception as e:
+            logger.error(f"性能分析失败: {e}")
+            self._respond({'type': 'profile', 'success': False, 'error': str(e)}, request_id)
+    
+    async def _send_message(self, chat_id: int, text: str):
+        await self.client.send_message(chat_id, text)
+    
+    def _on_message_sent(self, job: SendJob, text: str):
+        logger.info(f"发送消息: {text}")
+        self.metrics.inc('tgmon_messages_sent_total')
+        self._emit_result({
+            'type': 'message_sent',
+            'chat_id': job.chat_id,
+            'rule_id': job.meta.get('rule_id'),
+            'content': text
+        })
+    
+    def _on_send_error(self, job: SendJob, text: str, error: Exception):
+        self.metrics.inc('tgmon_send_errors_total')
+        self._emit_result({
+            'type': 'error',
+            'chat_id': job.chat_id,
+            'rule_id': job.meta.get('rule_id'),
+            'error': f'发送消息失败: {str(error)}'
+        })
+    
+    def _on_flood_wait(self, seconds: int):
+        self.metrics.inc('tgmon_flood_waits_total')
+        self.metrics.inc('tgmon_flood_wait_seconds_total', seconds)
+        self._emit_result({
+            'type': 'flood_wait',
+            'seconds': seconds
+        })
     
     async def disconnect(self):
         """断开连接"""
         try:
-            await self.stop_monitor()
-            
-            if self.client:
-                await self.client.disconnect()
-                self.client = None
-                self.is_connected = False
+            await self._drop_client()
+            # 没有客户端时也清除监听状态
+            await self._teardown_monitor()
             
-            self.response_queue.put({
+            self._respond({
                 'type': 'disconnected',
                 'success': True
             })
@@ -459,10 +1187,14 @@ class TelegramWorker:
         """清理资源"""
         logger.info("清理资源")
         await self.disconnect()
+        marks = self.watermarks.snapshot()
+        if marks is not None:
+            self.watermarks.save(marks)
 
 
 def telegram_worker_process(api_id, api_hash, command_queue, 
-                           response_queue, result_queue):
+                           response_queue, result_queue,
+                           session_name='telegram_session', heartbeat=None):
     """
     工作进程入口函数
     """
@@ -476,7 +1208,8 @@ def telegram_worker_process(api_id, api_hash, command_queue,
     
     # 创建工作进程
     worker = TelegramWorker(api_id, api_hash, 
-                           command_queue, response_queue, result_queue)
+                           command_queue, response_queue, result_queue,
+                           session_name, heartbeat)
     
     # 运行事件循环
     asyncio.run(worker.run())
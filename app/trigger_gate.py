@@ -0,0 +1,87 @@
+"""
+触发节流 - 按群聊和规则的合并窗口与冷却时间
+刷屏时同一窗口内的多次匹配只产生一次回复，并统计被抑制的次数
+"""
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# (合并窗口秒数, 冷却秒数)
+Window = Tuple[float, float]
+NO_WINDOW: Window = (0.0, 0.0)
+
+
+class TriggerGate:
+    """触发节流
+
+    一次匹配放行后：
+    - 合并窗口（coalesce）内的后续匹配被合并，回复在窗口结束时发送一次
+    - 回复发送后的冷却时间（cooldown）内的匹配被抑制
+
+    群聊和规则两个层级都通过时才放行。
+    """
+
+    def __init__(self):
+        # key -> 下一次允许触发的时间 / 最近一次回复的发送时间
+        self._next_allowed: Dict[Hashable, float] = {}
+        self._fire_time: Dict[Hashable, float] = {}
+        self.fired = 0
+        self.coalesced = 0
+        self.cooled_down = 0
+        self.suppressed_by_rule: Dict[Any, int] = defaultdict(int)
+
+    @property
+    def suppressed(self) -> int:
+        return self.coalesced + self.cooled_down
+
+    def reset(self):
+        """清空窗口状态（保留计数）"""
+        self._next_allowed.clear()
+        self._fire_time.clear()
+
+    def check(self, chat_id: int, rule_id: Any, now: float,
+              rule_window: Window = NO_WINDOW,
+              chat_window: Window = NO_WINDOW) -> Optional[float]:
+        """判断一次匹配是否应触发回复
+
+        Args:
+            chat_id: 群聊 ID
+            rule_id: 规则 ID
+            now: 当前时间（time.monotonic）
+            rule_window: 规则的 (合并窗口, 冷却时间)
+            chat_window: 群聊的 (合并窗口, 冷却时间)
+
+        Returns:
+            放行时返回回复的延迟秒数（合并窗口长度），被抑制时返回 None
+        """
+        rule_key = (chat_id, rule_id)
+        blocked_until = max(
+            self._next_allowed.get(rule_key, 0.0),
+            self._next_allowed.get(chat_id, 0.0)
+        )
+        if now < blocked_until:
+            # 回复尚未发出时属于合并，已发出则属于冷却
+            if now < self._fire_time.get(rule_key, 0.0) or now < self._fire_time.get(chat_id, 0.0):
+                self.coalesced += 1
+            else:
+                self.cooled_down += 1
+            self.suppressed_by_rule[rule_id] += 1
+            return None
+
+        delay = max(rule_window[0], chat_window[0])
+        fire_at = now + delay
+        for key, (coalesce, cooldown) in ((rule_key, rule_window), (chat_id, chat_window)):
+            # 只有配置了窗口的层级才需要记录
+            if coalesce > 0 or cooldown > 0:
+                self._next_allowed[key] = fire_at + cooldown
+                self._fire_time[key] = fire_at
+        self.fired += 1
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'fired': self.fired,
+            'suppressed': self.suppressed,
+            'coalesced': self.coalesced,
+            'cooled_down': self.cooled_down,
+            'suppressed_by_rule': dict(self.suppressed_by_rule)
+        }
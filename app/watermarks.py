@@ -0,0 +1,60 @@
+"""
+群聊处理进度 - 每个群聊已处理的最大消息 ID
+重连或重启后从这里开始补拉断线期间错过的消息；写入只改内存，由工作进程定期保存到 JSON 文件
+"""
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WatermarkStore:
+    """chat_id -> 已处理的最大 message_id
+
+    advance() 在事件循环中调用，只更新字典；snapshot() 取出有变化时的副本，
+    由调用方在线程中 save()，文件通过临时文件替换写入，进程中途退出也不会损坏。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.marks: Dict[int, int] = {}
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.marks = {int(chat_id): int(message_id) for chat_id, message_id in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取群聊处理进度失败，将从新消息开始: {e}")
+            self.marks = {}
+
+    def get(self, chat_id: int) -> Optional[int]:
+        return self.marks.get(chat_id)
+
+    def advance(self, chat_id: int, message_id: int):
+        """记录一条已处理的消息（只会增大）"""
+        if message_id > self.marks.get(chat_id, 0):
+            self.marks[chat_id] = message_id
+            self._dirty = True
+
+    def snapshot(self) -> Optional[Dict[int, int]]:
+        """有未保存的变化时返回副本，否则返回 None"""
+        if not self._dirty:
+            return None
+        self._dirty = False
+        return dict(self.marks)
+
+    def save(self, marks: Dict[int, int]):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({str(chat_id): message_id for chat_id, message_id in marks.items()}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"保存群聊处理进度失败: {e}")
+            self._dirty = True
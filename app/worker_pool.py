@@ -0,0 +1,362 @@
+"""
+工作进程池 - 多账号、多进程分片监听
+每个工作进程使用独立的会话文件（独立账号），监听的群聊按一致性哈希分配到各个分片
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .process_manager import ProcessManager
+from .result_ring import ResultRing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 不属于某个群聊、需要发给所有分片的命令
+BROADCAST_COMMANDS = {'connect', 'get_dialogs', 'get_stats', 'stop_monitor', 'disconnect'}
+
+
+def bare_chat_id(chat_id: int) -> int:
+    """去掉 Bot API 风格的前缀（-100 / -），保证同一群聊的不同写法分到同一分片"""
+    if chat_id >= 0:
+        return chat_id
+    text = str(-chat_id)
+    if text.startswith('100') and len(text) > 12:
+        return int(text[3:])
+    return -chat_id
+
+
+class WorkerPool:
+    """工作进程池 - 对外提供与 ProcessManager 相同的接口
+
+    群聊到分片的分配使用 rendezvous（最高随机权重）哈希：
+    同一个群聊总是落在同一个分片，调整分片数量时只有少量群聊需要迁移。
+    """
+
+    def __init__(self, api_id: int, api_hash: str, size: int,
+                 session_prefix: str = 'telegram_session', result_capacity: int = 1000,
+                 result_transport: str = 'queue'):
+        """
+        初始化工作进程池
+
+        Args:
+            api_id: Telegram API ID
+            api_hash: Telegram API Hash
+            size: 工作进程（账号）数量
+            session_prefix: 会话文件名前缀，第 0 个分片沿用单进程模式的会话文件
+            result_capacity: 合并后的结果环形缓冲区容量
+            result_transport: 各分片的结果通道（queue / shm）
+        """
+        if size < 1:
+            raise ValueError("工作进程数量至少为 1")
+
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.managers: List[ProcessManager] = [
+            ProcessManager(api_id, api_hash, session_name=self.session_name(session_prefix, index),
+                           result_transport=result_transport)
+            for index in range(size)
+        ]
+
+        # 最近一条命令发往的分片，get_response 从这些分片收集响应
+        self._last_targets: List[int] = [0]
+
+        # 所有分片的结果合并到同一个环形缓冲区，序号全局递增
+        self.results = ResultRing(result_capacity)
+        self._results_cursor = 0
+        self._result_listeners: List[Callable[[Dict[str, Any]], None]] = []
+        for index, manager in enumerate(self.managers):
+            manager.add_result_listener(
+                lambda result, shard=index: self._on_shard_result(shard, result)
+            )
+
+    @staticmethod
+    def session_name(prefix: str, index: int) -> str:
+        return prefix if index == 0 else f"{prefix}_{index}"
+
+    @property
+    def size(self) -> int:
+        return len(self.managers)
+
+    @property
+    def is_running(self) -> bool:
+        return any(manager.is_running for manager in self.managers)
+
+    @property
+    def worker_ready(self) -> bool:
+        return all(manager.worker_ready for manager in self.managers)
+
+    @property
+    def worker_startup_seconds(self) -> Optional[float]:
+        """最慢的分片的启动耗时，有分片尚未就绪时为 None"""
+        seconds = [manager.worker_startup_seconds for manager in self.managers]
+        return None if None in seconds else max(seconds)
+
+    @property
+    def worker_state(self) -> Optional[Dict[str, Any]]:
+        """合并各分片推送的状态：所有分片都已连接/登录才算已连接/登录；有分片尚未推送时为 None"""
+        states = [manager.worker_state for manager in self.managers]
+        if any(state is None for state in states):
+            return None
+        return {
+            'type': 'worker_state',
+            'connected': all(state['connected'] for state in states),
+            'authorized': all(state['authorized'] for state in states),
+            'listening': any(state['listening'] for state in states),
+            'shards': [dict(state, shard=index) for index, state in enumerate(states)]
+        }
+
+    def shard_for(self, chat_id: int) -> int:
+        """计算群聊所属的分片"""
+        key = str(bare_chat_id(chat_id)).encode()
+        return max(
+            range(self.size),
+            key=lambda index: hashlib.blake2b(key + b':%d' % index, digest_size=8).digest()
+        )
+
+    def split_rules(self, rules: List[dict]) -> Dict[int, List[dict]]:
+        """按分片拆分监听规则"""
+        shards: Dict[int, List[dict]] = {index: [] for index in range(self.size)}
+        for rule in rules:
+            shards[self.shard_for(rule['target_group_id'])].append(rule)
+        return shards
+
+    def start(self):
+        """启动所有工作进程"""
+        for manager in self.managers:
+            manager.start()
+        logger.info(f"工作进程池已启动，共 {self.size} 个分片")
+
+    def stop(self):
+        """停止所有工作进程"""
+        for manager in self.managers:
+            manager.stop()
+        logger.info("工作进程池已停止")
+
+    def _route(self, command: Dict[str, Any]) -> List[Tuple[int, Dict[str, Any]]]:
+        """计算命令应发往的分片
+
+        - start_monitor: 规则和 chat_windows 按群聊拆分，没有分到规则的分片停止监听
+        - update_rules: 新增/替换的规则按群聊拆分，删除广播到所有分片；
+          指定了 rule_id 的规则同时从其他分片移除（群聊换到其他分片时）
+        - 带 shard 字段的命令（如登录）: 只发给指定分片
+        - 与群聊无关的命令: 发给所有分片
+        """
+        cmd_type = command.get('type')
+
+        if cmd_type == 'start_monitor' and command.get('rules'):
+            # 群聊窗口与规则一样按群聊拆分，分片只需要解析自己负责的群聊
+            windows: Dict[int, Dict[Any, Any]] = {index: {} for index in range(self.size)}
+            for target, window in (command.get('chat_windows') or {}).items():
+                windows[self.shard_for(int(target))][target] = window
+            routes = []
+            for index, rules in self.split_rules(command['rules']).items():
+                if rules:
+                    routes.append((index, dict(command, rules=rules, chat_windows=windows[index])))
+                else:
+                    routes.append((index, {'type': 'stop_monitor'}))
+            return routes
+
+        if cmd_type == 'update_rules':
+            remove = command.get('remove') or []
+            named = [rule['rule_id'] for rule in command.get('upsert') or [] if rule.get('rule_id')]
+            routes = []
+            for index, rules in self.split_rules(command.get('upsert') or []).items():
+                own = {rule.get('rule_id') for rule in rules}
+                evict = [rule_id for rule_id in named if rule_id not in own]
+                if rules or remove or evict:
+                    routes.append((index, dict(command, upsert=rules, remove=remove, evict=evict)))
+            return routes
+
+        if 'shard' in command:
+            targets = [int(command['shard'])]
+        elif cmd_type in BROADCAST_COMMANDS:
+            targets = list(range(self.size))
+        else:
+            targets = [0]
+
+        if any(index < 0 or index >= self.size for index in targets):
+            raise ValueError(f"无效的分片: {targets}")
+        return [(index, command) for index in targets]
+
+    def send_command(self, command: Dict[str, Any]) -> bool:
+        """把命令路由到对应的分片"""
+        try:
+            routes = self._route(command)
+        except ValueError as e:
+            logger.error(str(e))
+            return False
+
+        self._last_targets = [index for index, _ in routes]
+        return all([self.managers[index].send_command(cmd) for index, cmd in routes])
+
+    async def request(self, command: Dict[str, Any], timeout: float = 5.0,
+                      response_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """并发地向相关分片发送请求，并合并各分片的响应"""
+        if command.get('type') == 'get_dialogs':
+            return await self._request_dialogs(command, timeout)
+        return await self._fan_out(command, timeout, response_type)
+
+    async def _fan_out(self, command: Dict[str, Any], timeout: float,
+                       response_type: Optional[str]) -> Optional[Dict[str, Any]]:
+        try:
+            routes = self._route(command)
+        except ValueError as e:
+            return {'type': f"{command.get('type')}_response", 'success': False, 'error': str(e)}
+
+        # 同一个 start_monitor 里，停止监听的分片响应类型不同
+        results = await asyncio.gather(*[
+            self.managers[index].request(
+                cmd, timeout=timeout,
+                response_type=response_type if cmd.get('type') == command.get('type') else None
+            )
+            for index, cmd in routes
+        ])
+
+        targets = [index for index, _ in routes]
+        responses = [(index, response) for index, response in zip(targets, results) if response is not None]
+        if not responses:
+            return None
+        if len(targets) == 1:
+            return dict(responses[0][1], shard=targets[0])
+        return self._merge_responses(targets, responses)
+
+    async def stream(self, command: Dict[str, Any], timeout: float = 10.0,
+                     response_type: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """依次从各分片流式接收响应，只在最后一个分片结束时发出 done"""
+        total = 0
+        for index, manager in enumerate(self.managers):
+            async for response in manager.stream(command, timeout=timeout, response_type=response_type):
+                if response.get('groups'):
+                    response = dict(response, groups=[dict(g, shard=index) for g in response['groups']])
+                if not response.get('done'):
+                    yield response
+                    continue
+                if not response.get('success', True):
+                    yield dict(response, shard=index)
+                    return
+                total += response.get('total', 0)
+        yield {'type': response_type, 'success': True, 'groups': [], 'total': total, 'done': True}
+
+    def get_response(self, timeout: float = 1.0, filter_type: Optional[str] = None,
+                     shard: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """收集最近一条命令在各分片上的响应并合并"""
+        targets = [shard] if shard is not None else self._last_targets
+
+        deadline = time.time() + timeout
+        responses = []
+        for index in targets:
+            remaining = max(0.0, deadline - time.time())
+            response = self.managers[index].get_response(timeout=remaining, filter_type=filter_type)
+            if response is not None:
+                responses.append((index, response))
+
+        if not responses:
+            return None
+        if len(targets) == 1:
+            return dict(responses[0][1], shard=targets[0])
+        return self._merge_responses(targets, responses)
+
+    async def _request_dialogs(self, command: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+        """获取所有分片的群聊列表，合并后再分页
+
+        各分片的 ETag 组合成整体 ETag，分片内部不做 304 判断。
+        """
+        response = await self._fan_out(
+            {'type': 'get_dialogs', 'refresh': command.get('refresh', False)},
+            timeout=timeout, response_type='dialogs_response'
+        )
+        if not response or not response.get('success'):
+            return response
+
+        etags = [shard.get('etag', '').strip('"') for shard in response.get('shards', [response])]
+        etag = '"' + '.'.join(etags) + '"'
+        if command.get('etag') == etag:
+            return {'type': 'dialogs_response', 'success': True, 'not_modified': True, 'etag': etag}
+
+        groups = response.get('groups', [])
+        offset = max(0, int(command.get('offset') or 0))
+        limit = command.get('limit')
+        end = None if limit is None else offset + int(limit)
+        return {
+            'type': 'dialogs_response',
+            'success': True,
+            'groups': groups[offset:end],
+            'total': len(groups),
+            'etag': etag
+        }
+
+    @staticmethod
+    def _merge_responses(targets: List[int], responses: List[tuple]) -> Dict[str, Any]:
+        """合并多个分片的响应"""
+        merged = dict(responses[0][1])
+        merged['success'] = len(responses) == len(targets) and all(
+            response.get('success') for _, response in responses
+        )
+        merged['shards'] = [dict(response, shard=index) for index, response in responses]
+
+        if len(responses) < len(targets):
+            merged['error'] = '部分分片响应超时'
+        elif not merged['success']:
+            errors = [r.get('error') for _, r in responses if r.get('error')]
+            merged['error'] = '; '.join(str(e) for e in errors)
+
+        # 群聊列表需要合并，并标记所在分片
+        if any('groups' in response for _, response in responses):
+            merged['groups'] = [
+                dict(group, shard=index)
+                for index, response in responses
+                for group in response.get('groups', [])
+            ]
+
+        # 规则增量更新：删除广播到所有分片，所有分片都没有的 rule_id 才算不存在
+        if any('missing' in response for _, response in responses):
+            for key in ('added', 'updated', 'removed', 'chats', 'rules'):
+                merged[key] = sum(response.get(key, 0) for _, response in responses)
+            merged['missing'] = sorted(set.intersection(
+                *[set(response.get('missing', [])) for _, response in responses]
+            ))
+
+        if any('is_authorized' in response for _, response in responses):
+            merged['is_authorized'] = all(r.get('is_authorized') for _, r in responses)
+
+        return merged
+
+    def _on_shard_result(self, shard: int, result: Dict[str, Any]):
+        """分片结果到达（在该分片的结果读取线程中调用）"""
+        result = dict(result, shard=shard)
+        self.results.append(result)
+        for listener in list(self._result_listeners):
+            try:
+                listener(result)
+            except Exception as e:
+                logger.error(f"结果监听者异常: {e}")
+
+    def add_result_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """注册结果监听者，结果会带上来源分片和全局序号"""
+        self._result_listeners.append(listener)
+
+    def metrics_snapshots(self) -> List[Tuple[Dict[str, Any], Dict[str, List]]]:
+        """所有分片的指标快照，带上 shard 标签"""
+        return [
+            (dict(labels, shard=index), snapshot)
+            for index, manager in enumerate(self.managers)
+            for labels, snapshot in manager.metrics_snapshots()
+        ]
+
+    def read_results(self, since: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """从指定序号之后读取所有分片的结果"""
+        results, cursor, missed = self.results.since(since, limit)
+        return {'results': results, 'next': cursor, 'missed': missed}
+
+    def check_results(self):
+        """检查所有分片的待处理结果"""
+        results, self._results_cursor, _ = self.results.since(self._results_cursor, self.results.capacity)
+        return results
+
+    def clear_results(self):
+        """清空结果缓冲区"""
+        self.results.clear()
+        self._results_cursor = self.results.last_seq
@@ -0,0 +1,79 @@
+"""
+命令往返延迟基准测试
+通过 ProcessManager.send_command / get_response 发送 ping 命令，
+对比旧的轮询式命令循环（empty() + sleep(0.1)）与事件驱动的命令读取
+
+用法: python benchmarks/bench_command_latency.py [--rounds 50]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.process_manager import ProcessManager
+
+
+def legacy_polling_worker(api_id, api_hash, command_queue, response_queue, result_queue,
+                          session_name='telegram_session', heartbeat=None):
+    """旧版命令循环：每 100ms 检查一次命令队列（不写心跳，需关闭监督）"""
+    async def run():
+        while True:
+            if not command_queue.empty():
+                command = command_queue.get()
+                if command.get('type') == 'ping':
+                    response_queue.put({'type': 'pong', 'success': True})
+                elif command.get('type') == 'disconnect':
+                    return
+            else:
+                await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+
+class LegacyPollingManager(ProcessManager):
+    _worker_target = staticmethod(legacy_polling_worker)
+
+
+def measure(manager: ProcessManager, rounds: int):
+    manager.start()
+    try:
+        # 预热：等待工作进程就绪
+        manager.send_command({'type': 'ping'})
+        if manager.get_response(timeout=30.0, filter_type='pong') is None:
+            raise RuntimeError("工作进程未响应")
+
+        samples = []
+        for _ in range(rounds):
+            # 模拟请求随机到达，避免与轮询周期对齐
+            time.sleep(0.013)
+            start = time.perf_counter()
+            manager.send_command({'type': 'ping'})
+            manager.get_response(timeout=5.0, filter_type='pong')
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+    finally:
+        manager.stop()
+
+
+def report(name: str, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<10} 平均 {statistics.mean(samples):8.2f} ms  "
+          f"p50 {statistics.median(samples):8.2f} ms  p99 {p99:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="命令往返延迟基准测试")
+    parser.add_argument('--rounds', type=int, default=50, help="测量次数")
+    args = parser.parse_args()
+
+    report("轮询(旧)", measure(LegacyPollingManager(0, '', supervise=False), args.rounds))
+    report("事件驱动", measure(ProcessManager(0, ''), args.rounds))
+
+
+if __name__ == "__main__":
+    main()
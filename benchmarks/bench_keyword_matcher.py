@@ -0,0 +1,64 @@
+"""
+关键字匹配基准测试
+对比原实现 any(keyword in text) 与 Aho-Corasick 匹配器在不同关键字数量下的单条消息耗时
+
+用法: python benchmarks/bench_keyword_matcher.py [--messages 2000]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.keyword_matcher import KeywordMatcher
+
+KEYWORD_COUNTS = [10, 100, 1000, 10000, 100000]
+ALPHABET = string.ascii_lowercase + "的一是在不了有和人这中大为上个国我以要他"
+
+
+def random_word(rng: random.Random, min_len: int, max_len: int) -> str:
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(min_len, max_len)))
+
+
+def make_messages(rng: random.Random, count: int):
+    """生成长度 20~200 的随机消息"""
+    return [random_word(rng, 20, 200) for _ in range(count)]
+
+
+def per_message_us(func, messages) -> float:
+    start = time.perf_counter()
+    for text in messages:
+        func(text)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关键字匹配基准测试")
+    parser.add_argument('--messages', type=int, default=2000, help="每轮消息条数")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = make_messages(rng, args.messages)
+
+    print(f"{'关键字数':>10} {'构建(ms)':>10} {'any() us/条':>14} {'AC us/条':>12} {'加速比':>8}")
+    for count in KEYWORD_COUNTS:
+        keywords = [random_word(rng, 4, 10) for _ in range(count)]
+
+        start = time.perf_counter()
+        matcher = KeywordMatcher(keywords)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        # 原实现在大关键字量下极慢，只取部分消息测量
+        sample = messages[:max(20, len(messages) * 10 // count)]
+        naive = per_message_us(lambda text: any(k in text for k in keywords), sample)
+        compiled = per_message_us(matcher.find, messages)
+
+        print(f"{count:>10} {build_ms:>10.1f} {naive:>14.1f} {compiled:>12.1f} {naive / compiled:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
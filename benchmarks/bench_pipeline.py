@@ -0,0 +1,216 @@
+"""
+端到端处理链路基准测试（无需网络）
+用假的 TelegramClient 按指定速率向 TelegramWorker 注入 NewMessage 事件，记录 send_message 的调用时间，
+统计吞吐量、触发到回复的 p50/p99 延迟、各队列深度和事件循环延迟
+
+用法: python benchmarks/bench_pipeline.py [--keywords 10,1000] [--groups 1,50] [--rates 200,2000]
+                                         [--duration 2] [--pipeline none,thread] [--realistic-limits]
+                                         [--send-latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import queue
+import random
+import string
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.tl.types import InputPeerChannel
+
+from app.telegram_client import TelegramWorker
+
+ALPHABET = string.ascii_lowercase + "的一是在不了有和人这中大为上个国我以要他"
+# 关键字使用消息正文中不会出现的字符，保证只有注入的关键字会触发
+KEYWORD_ALPHABET = "甲乙丙丁戊己庚辛壬癸子丑寅卯辰巳午未申酉戌亥"
+# 不限速，测量的是处理链路本身而不是令牌桶
+UNLIMITED = {'global_rate': 1e9, 'global_burst': 1e9, 'chat_rate': 1e9, 'chat_burst': 1e9}
+
+
+class FakeClient:
+    """替代 TelegramClient：保存事件处理器，记录发送的消息"""
+
+    def __init__(self, send_latency: float = 0.0):
+        self.send_latency = send_latency
+        self.handlers = []
+        # (chat_id, text, 发送时间)
+        self.sent = []
+
+    def add_event_handler(self, handler, event=None):
+        self.handlers.append(handler)
+
+    def remove_event_handler(self, handler, event=None):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+
+    async def get_input_entity(self, target):
+        return InputPeerChannel(abs(int(target)), 0)
+
+    async def send_message(self, chat_id, text):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent.append((chat_id, text, time.perf_counter()))
+
+    async def dispatch(self, event):
+        # 与 Telethon 的更新循环一样依次调用处理器
+        for handler in list(self.handlers):
+            await handler(event)
+
+
+def random_word(rng: random.Random, min_len: int, max_len: int, alphabet: str = ALPHABET) -> str:
+    return ''.join(rng.choice(alphabet) for _ in range(rng.randint(min_len, max_len)))
+
+
+def percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_case(keyword_count: int, group_count: int, rate: int, duration: float,
+                   pipeline: str, hit_ratio: float, realistic_limits: bool, send_latency: float,
+                   seed: int):
+    rng = random.Random(seed)
+    client = FakeClient(send_latency)
+    responses, results = queue.Queue(), queue.Queue()
+    worker = TelegramWorker(0, '', queue.Queue(), responses, results)
+    worker.client = client
+
+    keywords = [random_word(rng, 4, 8, KEYWORD_ALPHABET) for _ in range(keyword_count)]
+    groups = list(range(1, group_count + 1))
+    config = {
+        'rules': [
+            {'target_group_id': group, 'keywords': keywords, 'messages': ['reply'], 'interval': 0}
+            for group in groups
+        ]
+    }
+    if not realistic_limits:
+        config['send_limits'] = UNLIMITED
+    if pipeline != 'none':
+        config['match_pipeline'] = {'mode': pipeline}
+    await worker.start_monitor(config)
+    started = responses.get_nowait()
+    if not started.get('success'):
+        raise RuntimeError(started.get('error'))
+    chat_ids = list(worker.rule_table)
+
+    # 与 ProcessManager 一样由单独的线程读取结果队列
+    def drain_results():
+        while results.get() is not None:
+            pass
+
+    drainer = threading.Thread(target=drain_results, daemon=True)
+    drainer.start()
+
+    # 预热：进程池在子进程中编译规则，等第一批匹配完成后再开始计时
+    await client.dispatch(SimpleNamespace(chat_id=chat_ids[0], message=SimpleNamespace(id=-1, text='')))
+    while worker.match_pipeline and worker.match_pipeline.pending:
+        await asyncio.sleep(0.01)
+
+    # 每个群聊中触发回复的消息的注入时间，按顺序与该群聊的回复一一对应
+    trigger_times = {chat_id: [] for chat_id in chat_ids}
+    depths = {'send': 0, 'results': 0, 'pipeline': 0, 'loop_lag_ms': 0.0}
+    sampling = True
+
+    async def sample_depths():
+        while sampling:
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag = (time.perf_counter() - before - 0.01) * 1000
+            depths['loop_lag_ms'] = max(depths['loop_lag_ms'], lag)
+            depths['send'] = max(depths['send'], worker.send_scheduler.pending)
+            depths['results'] = max(depths['results'], results.qsize())
+            if worker.match_pipeline:
+                depths['pipeline'] = max(depths['pipeline'], worker.match_pipeline.pending)
+
+    sampler = asyncio.get_running_loop().create_task(sample_depths())
+
+    total = int(rate * duration)
+    start = time.perf_counter()
+    for index in range(total):
+        # 按目标速率注入；处理跟不上时不再等待，实际速率会低于目标
+        delay = start + index / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        chat_id = chat_ids[index % len(chat_ids)]
+        text = random_word(rng, 20, 120)
+        if rng.random() < hit_ratio:
+            text += ' ' + rng.choice(keywords)
+            trigger_times[chat_id].append(time.perf_counter())
+        event = SimpleNamespace(chat_id=chat_id, message=SimpleNamespace(id=index, text=text))
+        await client.dispatch(event)
+    injected = time.perf_counter() - start
+
+    # 等待回复全部发出
+    expected = sum(len(times) for times in trigger_times.values())
+    deadline = time.perf_counter() + max(10.0, duration * 5)
+    while len(client.sent) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    sampling = False
+    await sampler
+    await worker.stop_monitor()
+    results.put(None)
+
+    sent_by_chat = {chat_id: [] for chat_id in chat_ids}
+    for chat_id, _, sent_at in client.sent:
+        sent_by_chat[chat_id].append(sent_at)
+    latencies = [
+        (sent_at - triggered_at) * 1000
+        for chat_id in chat_ids
+        for triggered_at, sent_at in zip(trigger_times[chat_id], sent_by_chat[chat_id])
+    ]
+
+    return {
+        'processed_rate': total / injected,
+        'reply_rate': len(client.sent) / elapsed,
+        'replies': len(client.sent),
+        'expected': expected,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        **depths
+    }
+
+
+def parse_list(value: str, cast=int):
+    return [cast(item) for item in value.split(',') if item]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="端到端处理链路基准测试")
+    parser.add_argument('--keywords', default='10,1000,10000', help="每条规则的关键字数")
+    parser.add_argument('--groups', default='1,50', help="监听的群聊数")
+    parser.add_argument('--rates', default='200,2000', help="注入速率（条/秒）")
+    parser.add_argument('--pipeline', default='none,thread', help="匹配方式: none/thread/process")
+    parser.add_argument('--duration', type=float, default=2.0, help="每轮注入时长（秒）")
+    parser.add_argument('--hit-ratio', type=float, default=0.05, help="包含关键字的消息比例")
+    parser.add_argument('--realistic-limits', action='store_true', help="使用默认发送限速")
+    parser.add_argument('--send-latency', type=float, default=0.0, help="模拟每次发送的耗时（秒）")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'关键字':>7} {'群聊':>5} {'目标速率':>8} {'匹配':>7} {'处理 条/s':>10} {'回复 条/s':>10} "
+          f"{'回复数':>9} {'p50 ms':>8} {'p99 ms':>8} {'发送队列':>8} {'结果队列':>8} "
+          f"{'批量队列':>8} {'循环延迟ms':>10}")
+    for keyword_count in parse_list(args.keywords):
+        for group_count in parse_list(args.groups):
+            for rate in parse_list(args.rates):
+                for pipeline in parse_list(args.pipeline, str):
+                    stats = await run_case(keyword_count, group_count, rate, args.duration, pipeline,
+                                           args.hit_ratio, args.realistic_limits, args.send_latency,
+                                           args.seed)
+                    print(f"{keyword_count:>7} {group_count:>5} {rate:>8} {pipeline:>7} "
+                          f"{stats['processed_rate']:>10.0f} {stats['reply_rate']:>10.1f} "
+                          f"{stats['replies']:>4}/{stats['expected']:<4} "
+                          f"{stats['p50']:>8.2f} {stats['p99']:>8.2f} {stats['send']:>8} "
+                          f"{stats['results']:>8} {stats['pipeline']:>8} {stats['loop_lag_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
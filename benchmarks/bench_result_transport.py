@@ -0,0 +1,141 @@
+"""
+结果通道基准测试
+对比 multiprocessing.Queue（pickle + feeder 线程 + 管道）与共享内存环形缓冲区 ShmResultQueue：
+子进程按 keyword_matched / message_sent / error 的比例产生结果，主进程的读取线程像 ProcessManager 一样读取
+
+- 全速：生产者每条 put 的耗时（工作进程事件循环被占用的时间）、生产者进程每条的 CPU 时间
+  （Queue 的 pickle 在 feeder 线程中进行，同样占用工作进程的 GIL）和端到端吞吐
+- 限速：按固定速率产生结果时，从 put 到主进程读到的延迟分位数
+
+用法: python benchmarks/bench_result_transport.py [--count 200000] [--rate 2000] [--text-size 120]
+"""
+import argparse
+import multiprocessing
+import multiprocessing.queues
+import os
+import random
+import string
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.shm_ring import ShmResultQueue
+
+
+def make_results(count: int, text_size: int, seed: int = 42):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + "的一是在不了有和人这中大为上价格招聘"
+    results = []
+    for index in range(count):
+        roll = rng.random()
+        if roll < 0.6:
+            results.append({
+                'type': 'keyword_matched', 'chat_id': -1001234567890 - index % 50, 'message_id': index,
+                'rule_id': str(index % 20), 'keywords': ['价格', 'usdt'][:1 + index % 2],
+                'text': ''.join(rng.choice(alphabet) for _ in range(rng.randint(text_size // 2, text_size))),
+                'suppressed': roll < 0.1, 'ts': 0.0
+            })
+        elif roll < 0.95:
+            results.append({
+                'type': 'message_sent', 'chat_id': -1001234567890 - index % 50, 'rule_id': str(index % 20),
+                'content': '请私聊我了解详情', 'ts': 0.0
+            })
+        else:
+            results.append({
+                'type': 'error', 'chat_id': -1001234567890 - index % 50, 'rule_id': str(index % 20),
+                'error': 'A wait of 7 seconds is required', 'ts': 0.0
+            })
+    return results
+
+
+def producer(result_queue, count: int, text_size: int, rate: float, stats_queue):
+    """子进程：产生结果并记录 put 的总耗时和进程 CPU 时间"""
+    results = make_results(count, text_size)
+    cpu_start = time.process_time()
+    interval = 1.0 / rate if rate else 0.0
+    busy = 0.0
+    start = next_at = time.perf_counter()
+    for result in results:
+        if interval:
+            next_at += interval
+            while time.perf_counter() < next_at:
+                pass
+        # ts 与 ProcessManager 计算结果投递延迟时使用的字段一致
+        result['ts'] = time.time()
+        before = time.perf_counter()
+        result_queue.put(result)
+        busy += time.perf_counter() - before
+    if isinstance(result_queue, multiprocessing.queues.Queue):
+        # 等 feeder 线程把数据写完，CPU 时间才完整
+        result_queue.close()
+        result_queue.join_thread()
+    stats_queue.put((busy, time.process_time() - cpu_start))
+
+
+def consume(result_queue, count: int, latencies: list):
+    received = 0
+    while received < count:
+        result = result_queue.get()
+        if result is None:
+            break
+        latencies.append(time.time() - result['ts'])
+        received += 1
+
+
+def run(transport: str, count: int, text_size: int, rate: float):
+    if transport == 'shm':
+        # 容量足够大，全速时也不丢弃，保证两种通道传输的条数相同
+        result_queue = ShmResultQueue(capacity=64 * 1024 * 1024)
+    else:
+        result_queue = multiprocessing.Queue()
+    stats_queue = multiprocessing.Queue()
+
+    latencies = []
+    reader = threading.Thread(target=consume, args=(result_queue, count, latencies))
+    reader.start()
+
+    start = time.perf_counter()
+    process = multiprocessing.Process(target=producer, args=(result_queue, count, text_size, rate, stats_queue))
+    process.start()
+    busy, cpu_seconds = stats_queue.get()
+    reader.join()
+    elapsed = time.perf_counter() - start
+    process.join()
+
+    dropped = 0
+    if isinstance(result_queue, ShmResultQueue):
+        dropped = result_queue.dropped
+        result_queue.close()
+
+    latencies.sort()
+    return {
+        'put_us': busy / count * 1e6,
+        'cpu_us': cpu_seconds / count * 1e6,
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'received': len(latencies),
+        'dropped': dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="结果通道基准测试")
+    parser.add_argument('--count', type=int, default=200000, help="全速测试的结果条数")
+    parser.add_argument('--rate', type=float, default=2000, help="限速测试每秒产生的结果数")
+    parser.add_argument('--paced-count', type=int, default=10000, help="限速测试的结果条数")
+    parser.add_argument('--text-size', type=int, default=120, help="匹配消息文本的最大长度")
+    args = parser.parse_args()
+
+    print(f"{'场景':<8} {'通道':<6} {'put us/条':>10} {'CPU us/条':>10} {'吞吐(条/秒)':>12} {'p50(ms)':>9} {'p99(ms)':>9} {'丢弃':>6}")
+    for label, count, rate in (('全速', args.count, 0.0), (f'{args.rate:g}/s', args.paced_count, args.rate)):
+        for transport in ('queue', 'shm'):
+            stats = run(transport, count, args.text_size, rate)
+            print(f"{label:<8} {transport:<6} {stats['put_us']:>10.2f} {stats['cpu_us']:>10.2f} {stats['throughput']:>12.0f} "
+                  f"{stats['p50_ms']:>9.3f} {stats['p99_ms']:>9.3f} {stats['dropped']:>6}")
+
+
+if __name__ == "__main__":
+    main()
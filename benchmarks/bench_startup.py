@@ -0,0 +1,105 @@
+"""
+启动时间基准测试
+在临时目录（带一份占位的 api_config.json）中启动 main.py 或打包后的可执行文件，轮询 /api/health：
+
+- HTTP 就绪：从启动进程到 /api/health 第一次返回的秒数
+- 工作进程就绪：从启动进程到 /api/health 返回 worker=ready（工作进程事件循环开始运行）的秒数
+
+占位凭证无法登录，连接 Telegram 的结果不影响测量。
+
+用法: python benchmarks/bench_startup.py [--runs 5] [--port 8765] [--exe dist/TelegramMonitor/TelegramMonitor]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_EXE = os.path.join(ROOT, 'dist', 'TelegramMonitor',
+                           'TelegramMonitor.exe' if os.name == 'nt' else 'TelegramMonitor')
+POLL_INTERVAL = 0.02
+
+
+def poll_health(port: int):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None
+
+
+def run_once(command, port: int, timeout: float):
+    """启动一次，返回 (HTTP 就绪秒数, 工作进程就绪秒数, 工作进程报告的启动秒数)"""
+    workdir = tempfile.mkdtemp(prefix='tgmon-startup-')
+    with open(os.path.join(workdir, 'api_config.json'), 'w') as f:
+        json.dump({'api_id': '12345', 'api_hash': '0' * 32}, f)
+
+    env = dict(os.environ, PORT=str(port))
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    http_ready = worker_ready = reported = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"进程提前退出，返回码 {process.returncode}")
+            health = poll_health(port)
+            if health is not None:
+                if http_ready is None:
+                    http_ready = time.perf_counter() - start
+                if health.get('worker') == 'ready' and worker_ready is None:
+                    worker_ready = time.perf_counter() - start
+                # 启动耗时由监督线程记录，可能比就绪状态晚一个检查间隔
+                reported = health.get('worker_startup_seconds')
+                if worker_ready is not None and reported is not None:
+                    break
+            time.sleep(POLL_INTERVAL)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return http_ready, worker_ready, reported
+
+
+def summarize(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return "       -        -"
+    return f"{min(values):>8.3f} {statistics.median(values):>8.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动时间基准测试")
+    parser.add_argument('--runs', type=int, default=5, help="每个目标启动的次数")
+    parser.add_argument('--port', type=int, default=8765, help="测试使用的端口")
+    parser.add_argument('--timeout', type=float, default=60.0, help="单次启动的最长等待秒数")
+    parser.add_argument('--exe', nargs='?', const=DEFAULT_EXE, default=None,
+                        help="同时测试打包后的可执行文件（默认 dist/TelegramMonitor/）")
+    args = parser.parse_args()
+
+    targets = [('main.py', [sys.executable, os.path.join(ROOT, 'main.py')])]
+    if args.exe:
+        if not os.path.exists(args.exe):
+            parser.error(f"找不到可执行文件: {args.exe}")
+        targets.append(('exe', [args.exe]))
+
+    print(f"{'目标':<8} {'HTTP 就绪 min/中位(秒)':>20} {'工作进程就绪 min/中位(秒)':>24} {'工作进程自报(秒)':>18}")
+    for label, command in targets:
+        runs = [run_once(command, args.port, args.timeout) for _ in range(args.runs)]
+        http_ready, worker_ready, reported = zip(*runs)
+        print(f"{label:<8} {summarize(http_ready):>20} {summarize(worker_ready):>24} {summarize(reported):>18}")
+
+
+if __name__ == "__main__":
+    main()
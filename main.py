@@ -1,8 +1,9 @@
 """
 Telegram 群聊监听系统 - 主程序入口
 """
-import uvicorn
 import logging
+import multiprocessing
+import os
 
 # 配置日志
 logging.basicConfig(
@@ -12,10 +13,15 @@ logging.basicConfig(
 
 def main():
     """主函数"""
+    # 在函数内导入：spawn 方式启动的工作进程会重新导入本模块，不需要 uvicorn
+    import uvicorn
+    
+    port = int(os.environ.get("PORT", "8000"))
+    
     print("=" * 60)
     print("Telegram 群聊监听系统")
     print("=" * 60)
-    print(f"监听地址: http://localhost:8000")
+    print(f"监听地址: http://localhost:{port}")
     print("=" * 60)
     print("请在浏览器中配置 API 凭证")
     print()
@@ -24,11 +30,12 @@ def main():
     uvicorn.run(
         "app.api:app",
         host="0.0.0.0",
-        port=8000,
+        port=port,
         reload=False,
         log_level="info"
     )
 
 if __name__ == "__main__":
+    # 打包后的可执行文件启动工作进程时需要
+    multiprocessing.freeze_support()
     main()
-
@@ -130,7 +130,8 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    # 不用 UPX 压缩：每次启动都要解压可执行文件和动态库，拖慢启动
+    upx=False,
     console=True,  # 显示控制台窗口，用于查看日志
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -147,7 +148,7 @@ coll = COLLECT(
     a.zipfiles,
     a.datas,
     strip=False,
-    upx=True,
+    upx=False,
     upx_exclude=[],
     name='TelegramMonitor'
 )